@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .db import configure_sqlite
+        from .metrics import count_queries
+
+        def install_query_counter(sender, connection, **kwargs):
+            # At the front: connections may open inside an execute_wrapper() block, which pops the last one
+            if count_queries not in connection.execute_wrappers:
+                connection.execute_wrappers.insert(0, count_queries)
+
+        connection_created.connect(install_query_counter, weak=False, dispatch_uid="chatbot_query_counter")
+        connection_created.connect(configure_sqlite, weak=False, dispatch_uid="chatbot_sqlite_pragmas")
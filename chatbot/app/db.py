@@ -0,0 +1,70 @@
+"""
+SQLite tuning and read/write routing.
+
+- configure_sqlite runs on every new connection (connection_created) and
+  applies SQLITE_PRAGMAS: WAL journaling so readers never block the writer,
+  a busy timeout so writers queue for the lock instead of failing with
+  "database is locked", synchronous=NORMAL (safe with WAL) and a larger
+  page cache. Read-only aliases get query_only instead of the journal
+  settings, which only the primary may change.
+- ReadReplicaRouter sends reads of the history/summary models
+  (DATABASE_READ_REPLICA_MODELS) to the "replica" alias, a read-only
+  connection to the same file, and everything else to "default". Inside a
+  transaction on the primary, reads stay there so a request always sees
+  its own uncommitted writes; committed writes are visible to the replica
+  at once because it is the same WAL database.
+"""
+from django.conf import settings
+from django.db import connections
+
+REPLICA_ALIAS = "replica"
+
+# Only the primary may change these; they persist in the database file / per connection
+_PRIMARY_ONLY_PRAGMAS = {"journal_mode", "synchronous", "wal_autocheckpoint"}
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created hook: apply SQLITE_PRAGMAS to a new SQLite connection."""
+    if connection.vendor != "sqlite":
+        return
+    pragmas = dict(getattr(settings, "SQLITE_PRAGMAS", {}))
+    if not pragmas:
+        return
+    read_only = "mode=ro" in str(connection.settings_dict["NAME"])
+    if read_only:
+        pragmas = {name: value for name, value in pragmas.items() if name not in _PRIMARY_ONLY_PRAGMAS}
+        pragmas["query_only"] = 1
+    elif connection.is_in_memory_db():
+        pragmas.pop("journal_mode", None)  # in-memory databases can't use WAL
+
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+class ReadReplicaRouter:
+    """Route history/summary reads to the read-only alias when it is configured."""
+
+    def __init__(self):
+        self.models = {label.lower() for label in getattr(settings, "DATABASE_READ_REPLICA_MODELS", ())}
+
+    def _replica_for(self, model):
+        if REPLICA_ALIAS not in settings.DATABASES:
+            return None
+        if getattr(model._meta, "label_lower", None) not in self.models:  # DatabaseCache passes a stand-in
+            return None
+        if connections["default"].in_atomic_block:
+            return "default"  # read-your-writes inside a transaction
+        return REPLICA_ALIAS
+
+    def db_for_read(self, model, **hints):
+        return self._replica_for(model)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # both aliases are the same database
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
@@ -0,0 +1,299 @@
+"""
+Helpers for the load-test, benchmark and replay management commands.
+
+Benchmarks run in-process with the Django test client against a throwaway,
+file-backed test database (so worker threads share it), time every request
+and count the DB queries each one issues.
+"""
+import difflib
+import json as pyjson
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+DEV_OTP_RE = re.compile(r"Dev OTP: (\d{6})")
+
+ENDPOINT_URLS = {
+    "chat_api": "/app/chat_api/",
+    "chat_stream_api": "/app/chat_stream_api/",
+    "chat_async_api": "/app/chat_async_api/",
+    "chat_async_stream_api": "/app/chat_async_stream_api/",
+}
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of `values` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class QueryCounter:
+    """Count queries issued on this thread's connections (primary and read replica)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrappers = ExitStack()
+        for alias in connections:
+            self._wrappers.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc):
+        return self._wrappers.__exit__(*exc)
+
+
+class EndpointStats:
+    """Thread-safe latency / query-count samples per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)  # endpoint -> [(seconds, queries, ok)]
+
+    def record(self, endpoint, seconds, queries, ok=True):
+        with self._lock:
+            self.samples[endpoint].append((seconds, queries, ok))
+
+    @contextmanager
+    def measure(self, endpoint):
+        """
+        Time the enclosed request and count its queries. Yields a dict;
+        set its "ok" to False to count a bad response as an error.
+        """
+        started = time.perf_counter()
+        outcome = {"ok": True}
+        with QueryCounter() as queries:
+            try:
+                yield outcome
+            except Exception:
+                outcome["ok"] = False
+                raise
+            finally:
+                self.record(endpoint, time.perf_counter() - started, queries.count, outcome["ok"])
+
+    def rows(self, wall_seconds):
+        rows = []
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = [s[0] * 1000 for s in samples]
+            rows.append({
+                "endpoint": endpoint,
+                "requests": len(samples),
+                "errors": sum(1 for s in samples if not s[2]),
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "rps": len(samples) / wall_seconds if wall_seconds else 0.0,
+                "queries_avg": sum(s[1] for s in samples) / len(samples),
+                "queries_max": max(s[1] for s in samples),
+            })
+        return rows
+
+
+REPORT_COLUMNS = [  # (name, width, format spec)
+    ("endpoint", 24, "<"), ("requests", 8, ">"), ("errors", 6, ">"),
+    ("p50_ms", 8, ">.1f"), ("p95_ms", 8, ">.1f"), ("p99_ms", 8, ">.1f"),
+    ("rps", 7, ">.1f"), ("queries_avg", 11, ">.1f"), ("queries_max", 11, ">"),
+]
+
+
+def format_report(rows) -> str:
+    """Fixed-width table of EndpointStats.rows()."""
+    header = " ".join(f"{name:{'<' if name == 'endpoint' else '>'}{width}}" for name, width, _ in REPORT_COLUMNS)
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append(" ".join(
+            f"{row[name]:{spec[0]}{width}{spec[1:]}}" for name, width, spec in REPORT_COLUMNS
+        ))
+    return "\n".join(lines)
+
+
+def _point_mirrors_at(test_name) -> dict:
+    """Re-point aliases that mirror the default database (the read replica) at the test database."""
+    saved = {}
+    for alias in connections:
+        if connections[alias].settings_dict.get("TEST", {}).get("MIRROR") != DEFAULT_DB_ALIAS:
+            continue
+        saved[alias] = connections[alias].settings_dict["NAME"]
+        connections[alias].close()
+        read_only = "mode=ro" in str(saved[alias]) and connection.vendor == "sqlite"
+        connections[alias].settings_dict["NAME"] = f"file:{test_name}?mode=ro" if read_only else test_name
+    return saved
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Create a throwaway test database for the duration of the block.
+    SQLite gets a temporary file rather than the default shared-cache
+    in-memory database, whose table locks fail instead of waiting.
+    """
+    tmpdir = None
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    saved_test_name = test_settings.get("NAME")
+    if connection.vendor == "sqlite":
+        tmpdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+        test_settings["NAME"] = os.path.join(tmpdir, "bench.sqlite3")
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    mirrors = _point_mirrors_at(connection.settings_dict["NAME"])
+    try:
+        yield
+    finally:
+        connections.close_all()
+        for alias, name in mirrors.items():
+            connections[alias].settings_dict["NAME"] = name
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings["NAME"] = saved_test_name
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run_concurrently(fn, items, concurrency):
+    """Run fn(item) for every item on `concurrency` threads; re-raises the first error."""
+    def run(item):
+        try:
+            return fn(item)
+        finally:
+            connections.close_all()  # this thread's connections
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+        return list(pool.map(run, items))
+
+
+# -------------------------
+# Simulated chat clients
+# -------------------------
+def response_reply(response) -> str:
+    """The bot reply from a chat endpoint response (JSON, or the SSE `done` event)."""
+    if not response.streaming:
+        return response.json().get("reply", "")
+    reply = ""
+    for frame in b"".join(response).decode().split("\n\n"):
+        if frame.startswith("data: "):
+            event = pyjson.loads(frame[6:])
+            if event.get("done"):
+                reply = event.get("reply", "")
+    return reply
+
+
+def post_chat(client, endpoint, message):
+    return client.post(ENDPOINT_URLS[endpoint], {"message": message}, content_type="application/json")
+
+
+def log_in(client, phone, post=None):
+    """
+    Register/verify `phone` through the chat OTP flow (phone → yes → OTP),
+    reading the dev OTP from the replies. `post(message)` returns the reply
+    text (default: post to chat_api with `client`).
+    """
+    post = post or (lambda message: response_reply(post_chat(client, "chat_api", message)))
+    post(phone)
+    match = DEV_OTP_RE.search(post("yes"))
+    if not match:
+        raise RuntimeError(f"No OTP in the registration reply for {phone}")
+    post(match.group(1))
+
+
+# -------------------------
+# Conversation replay
+# -------------------------
+def read_sessions(path) -> dict:
+    """
+    {session id: [user messages]} from NDJSON, in file order. Each line is
+    either {"session": id, "message": text} (one turn) or
+    {"session": id, "messages": [text, ...]} (a whole session).
+    """
+    sessions = {}
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = pyjson.loads(line)
+            session = str(record.get("session", f"line-{number}"))
+            if "messages" in record:
+                sessions.setdefault(session, []).extend(record["messages"])
+            elif "message" in record:
+                sessions.setdefault(session, []).append(record["message"])
+            else:
+                raise ValueError(f"{path}:{number}: expected a \"message\" or \"messages\" field")
+    return sessions
+
+
+def read_results(path) -> dict:
+    """{(session, turn): record} from a replay results file."""
+    with open(path, encoding="utf-8") as f:
+        records = (pyjson.loads(line) for line in f if line.strip())
+        return {(r["session"], r["turn"]): r for r in records}
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else 0.0
+
+
+def summarize_results(records) -> dict:
+    """Aggregate per-turn replay records into the figures compared between runs."""
+    ms = [r["ms"] for r in records]
+    return {
+        "turns": len(records),
+        "errors": sum(1 for r in records if r["status"] >= 400),
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "queries_avg": _mean(r["queries"] for r in records),
+        "prompt_tokens_avg": _mean(r["prompt_tokens"] for r in records),
+        "prompt_tokens_max": max((r["prompt_tokens"] or 0 for r in records), default=0),
+        "summary_ms_avg": _mean(r.get("summary_ms") for r in records),
+    }
+
+
+def compare_results(baseline: dict, current: dict, max_diffs=5) -> str:
+    """Side-by-side report of two replay runs ({(session, turn): record} each)."""
+    shared = sorted(set(baseline) & set(current))
+    base = summarize_results([baseline[k] for k in shared])
+    cur = summarize_results([current[k] for k in shared])
+
+    lines = [f"{'metric':<20} {'baseline':>10} {'current':>10} {'delta':>10}", "-" * 53]
+    for name in base:
+        delta = cur[name] - base[name]
+        pct = f" ({delta / base[name]:+.0%})" if base[name] else ""
+        lines.append(f"{name:<20} {base[name]:>10.1f} {cur[name]:>10.1f} {delta:>+10.1f}{pct}")
+    only = len(set(baseline) ^ set(current))
+    if only:
+        lines.append(f"({only} turn(s) present in only one run were skipped)")
+
+    changed = [k for k in shared if baseline[k]["reply"] != current[k]["reply"]]
+    lines.append(f"\nReplies changed: {len(changed)}/{len(shared)}")
+    for session, turn in changed[:max_diffs]:
+        lines.append(f"--- {session} turn {turn}: {current[(session, turn)]['message']!r}")
+        lines.extend(difflib.unified_diff(
+            baseline[(session, turn)]["reply"].splitlines(), current[(session, turn)]["reply"].splitlines(),
+            "baseline", "current", lineterm="", n=1,
+        ))
+
+    grown = sorted(
+        shared, key=lambda k: (current[k]["prompt_tokens"] or 0) - (baseline[k]["prompt_tokens"] or 0), reverse=True,
+    )
+    grown = [k for k in grown if (current[k]["prompt_tokens"] or 0) > (baseline[k]["prompt_tokens"] or 0)]
+    if grown:
+        lines.append("\nLargest prompt growth:")
+        for key in grown[:max_diffs]:
+            lines.append(
+                f"  {key[0]} turn {key[1]}: {baseline[key]['prompt_tokens']} -> {current[key]['prompt_tokens']} tokens, "
+                f"{baseline[key]['queries']} -> {current[key]['queries']} queries"
+            )
+    return "\n".join(lines)
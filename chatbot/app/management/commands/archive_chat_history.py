@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.services.archive_service import (
+    archive_cutoff, archive_user_history, count_archivable, users_with_archivable_history,
+)
+
+
+class Command(BaseCommand):
+    help = "Move old ChatHistory rows into compressed per-user archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help="Archive messages older than this many days (default: CHAT_ARCHIVE_AFTER_DAYS).",
+        )
+        parser.add_argument(
+            "--segment-size", type=int, default=settings.CHAT_ARCHIVE_SEGMENT_SIZE,
+            help="Messages per compressed segment (default: CHAT_ARCHIVE_SEGMENT_SIZE).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many rows would be archived.")
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options["days"])
+
+        if options["dry_run"]:
+            self.stdout.write(f"{count_archivable(cutoff)} message(s) older than {cutoff:%Y-%m-%d %H:%M} would be archived.")
+            return
+
+        total = 0
+        for user_id in list(users_with_archivable_history(cutoff)):
+            archived = archive_user_history(user_id, cutoff, options["segment_size"])
+            if archived:
+                self.stdout.write(f"user {user_id}: archived {archived} message(s)")
+            total += archived
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} message(s)."))
@@ -0,0 +1,128 @@
+import itertools
+import time
+import warnings
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from app.loadtest import (
+    ENDPOINT_URLS, EndpointStats, benchmark_database, format_report, log_in, run_concurrently,
+)
+from app.services import admission, model_router
+from app.services.summary_worker import get_worker
+
+# A mix of small talk, general questions (reply-cache candidates) and plan requests (heavy tier)
+CHAT_MESSAGES = [
+    "hello there coach",
+    "what is the best beginner chest workout",
+    "how much protein should I eat after training",
+    "can you build me a 4 week strength plan",
+    "thanks, that helps",
+    "best beginner chest workouts",
+    "my lower back hurts after deadlifts, what should I change",
+    "create a weekly meal plan for cutting",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the OTP login + chat flow with concurrent simulated users against a throwaway "
+        "test database and the fake LLM backend. Reports p50/p95/p99 latency, throughput and DB queries per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="Simulated users (each logs in, then chats).")
+        parser.add_argument("--concurrency", type=int, default=8, help="Users running at the same time.")
+        parser.add_argument("--turns", type=int, default=5, help="Chat messages per user after login.")
+        parser.add_argument(
+            "--endpoints", default="chat_api,chat_stream_api",
+            help=f"Comma-separated chat endpoints to rotate through ({', '.join(ENDPOINT_URLS)}).",
+        )
+        parser.add_argument("--backend", default="fake", help="LLM_BACKEND to benchmark with (default: fake).")
+        parser.add_argument("--latency-ms", type=float, default=300, help="Fake backend median latency.")
+        parser.add_argument("--latency-sigma", type=float, default=0.5, help="Fake backend log-normal spread.")
+        parser.add_argument("--malformed-rate", type=float, default=0.05, help="Fake backend share of malformed JSON.")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--rate-limit", type=int, default=0,
+            help="CHAT_RATE_LIMIT_PER_MINUTE during the run (default 0: off, simulated users type faster than people).",
+        )
+        parser.add_argument(
+            "--llm-concurrency", type=int, default=None, help="LLM_MAX_CONCURRENCY during the run (default: settings).",
+        )
+
+    def handle(self, *args, **options):
+        endpoints = [e.strip() for e in options["endpoints"].split(",") if e.strip()]
+        unknown = set(endpoints) - set(ENDPOINT_URLS)
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+
+        overrides = {
+            "LLM_BACKEND": options["backend"],
+            "LLM_FAKE_BACKEND": {
+                "latency_ms": options["latency_ms"],
+                "latency_sigma": options["latency_sigma"],
+                "malformed_rate": options["malformed_rate"],
+                "seed": options["seed"],
+            },
+            "CHAT_RATE_LIMIT_PER_MINUTE": options["rate_limit"],
+        }
+        if options["llm_concurrency"] is not None:
+            overrides["LLM_MAX_CONCURRENCY"] = options["llm_concurrency"]
+        stats = EndpointStats()
+        # The sync test client drains the async streaming views itself; that is expected here.
+        warnings.filterwarnings("ignore", message="StreamingHttpResponse must consume asynchronous iterators")
+
+        setup_test_environment()  # allows the test client's "testserver" host
+        try:
+            with override_settings(**overrides), benchmark_database():
+                model_router.reset_clients()
+                started = time.perf_counter()
+                run_concurrently(
+                    lambda n: self.simulate_user(n, stats, endpoints, options["turns"]),
+                    range(options["users"]),
+                    options["concurrency"],
+                )
+                wall = time.perf_counter() - started
+                get_worker().stop()
+        finally:
+            model_router.reset_clients()
+            teardown_test_environment()
+
+        rows = stats.rows(wall)
+        total = sum(row["requests"] for row in rows)
+        self.stdout.write(format_report(rows))
+        self.stdout.write(
+            f"\n{options['users']} users x {options['turns']} turns, concurrency {options['concurrency']}, "
+            f"backend {options['backend']}: {total} requests in {wall:.2f}s ({total / wall:.1f} req/s)"
+        )
+        self.stdout.write(f"LLM calls by tier: {model_router.call_log.stats()}")
+        rejected = {key[0][1]: n for _, key, n in admission.rejections.samples()}
+        self.stdout.write(f"Admission rejections: {rejected or 'none'}")
+
+    def simulate_user(self, n, stats, endpoints, turns):
+        client = Client()
+        phone = f"9{n:09d}"
+
+        def post(endpoint, label, message):
+            with stats.measure(label) as outcome:
+                response = client.post(
+                    ENDPOINT_URLS[endpoint], {"message": message}, content_type="application/json",
+                )
+                body = b"".join(response).decode() if response.streaming else response.content.decode()
+                outcome["ok"] = response.status_code < 400
+            return body
+
+        with stats.measure("chat_page") as outcome:
+            outcome["ok"] = client.get("/app/chat/").status_code == 200
+
+        log_in(client, phone, lambda message: post("chat_api", "login", message))
+
+        messages = itertools.cycle(CHAT_MESSAGES[n % len(CHAT_MESSAGES):] + CHAT_MESSAGES[:n % len(CHAT_MESSAGES)])
+        for turn in range(turns):
+            endpoint = endpoints[turn % len(endpoints)]
+            post(endpoint, endpoint, next(messages))
+
+        with stats.measure("chat_history_api") as outcome:
+            outcome["ok"] = client.get("/app/chat_history_api/").status_code == 200
@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.test import override_settings
+
+from app.loadtest import EndpointStats, benchmark_database, format_report, run_concurrently
+from app.models import ChatHistory, User
+from app.services import context_cache, memory_service, model_router
+from app.services.chat_service import ChatTurn, get_chat_history_page
+from app.services.summary_worker import run_pending_summary_jobs
+
+PROFILES = ("stock", "tuned")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark sustained SQLite write throughput: concurrent writer threads commit chat turns while "
+        "reader threads page through history and summarizer threads run summary jobs, against a throwaway database file. Compares Django's stock "
+        "SQLite settings (rollback journal, deferred transactions, no router) with the tuned layer "
+        "(SQLITE_PRAGMAS, IMMEDIATE transactions, persistent connections, read replica routing)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", choices=PROFILES + ("both",), default="both")
+        parser.add_argument("--writers", type=int, default=8, help="Threads committing chat turns.")
+        parser.add_argument("--readers", type=int, default=4, help="Threads reading history pages.")
+        parser.add_argument(
+            "--summarizers", type=int, default=2, help="Threads running due summary jobs (fake LLM, no latency).",
+        )
+        parser.add_argument("--seconds", type=float, default=10, help="Duration of each run.")
+        parser.add_argument("--users", type=int, default=50, help="Users to spread turns across.")
+        parser.add_argument("--seed-messages", type=int, default=200, help="History rows per user before the run.")
+        parser.add_argument("--timeout", type=float, default=5, help="Stock profile sqlite3 lock timeout (Django default 5s).")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("bench_db_writes benchmarks the SQLite layer; the default database is not SQLite.")
+
+        profiles = PROFILES if options["profile"] == "both" else (options["profile"],)
+        summaries = []
+        for profile in profiles:
+            stats, wall, locked = self.run_profile(profile, options)
+            rows = stats.rows(wall)
+            commits = next((row["requests"] - row["errors"] for row in rows if row["endpoint"] == "turn_commit"), 0)
+            self.stdout.write(f"\n== {profile} ==")
+            self.stdout.write(format_report(rows))
+            summaries.append(
+                f"{profile:>6}: {commits} turns committed in {wall:.1f}s ({commits / wall:.1f} commits/s), "
+                f"{locked} 'database is locked' errors"
+            )
+
+        self.stdout.write(
+            f"\n{options['writers']} writers + {options['readers']} readers + {options['summarizers']} summarizers, "
+            f"{options['users']} users:"
+        )
+        for line in summaries:
+            self.stdout.write(line)
+
+    def run_profile(self, profile, options):
+        stats = EndpointStats()
+        locked = [0]
+        lock = threading.Lock()
+        deadline = [0.0]
+
+        def until_deadline(fn):
+            rng = random.Random(options["seed"] + threading.get_ident())
+            while time.perf_counter() < deadline[0]:
+                try:
+                    fn(rng)
+                except OperationalError as e:
+                    if "locked" not in str(e):
+                        raise
+                    with lock:
+                        locked[0] += 1
+                finally:
+                    close_old_connections()  # as at the end of a request (honours CONN_MAX_AGE)
+
+        def write_turn(rng):
+            user = rng.choice(users)
+            turn = ChatTurn(user)
+            turn.add("user", f"question {rng.randrange(10 ** 6)} about my training plan")
+            turn.add("bot", "Keep the volume moderate and progress the load every week.")
+            with stats.measure("turn_commit"):
+                turn.commit()
+
+        def read_history(rng):
+            with stats.measure("history_page"):
+                get_chat_history_page(rng.choice(users), limit=50)
+
+        def summarize(rng):
+            with stats.measure("summary_jobs"):
+                ran = run_pending_summary_jobs(limit=5)
+            if not ran:
+                time.sleep(0.05)
+
+        roles = {"writer": write_turn, "reader": read_history, "summarizer": summarize}
+        workers = (
+            ["writer"] * options["writers"] + ["reader"] * options["readers"]
+            + ["summarizer"] * options["summarizers"]
+        )
+        with self.profile_settings(profile, options), benchmark_database():
+            users = self.seed(options)
+            started = time.perf_counter()
+            deadline[0] = started + options["seconds"]
+            run_concurrently(
+                lambda role: until_deadline(roles[role]),
+                workers,
+                len(workers),
+            )
+            wall = time.perf_counter() - started
+            for user in users:  # the next run's test database reuses these ids
+                context_cache.invalidate(user.pk)
+                memory_service.forget(user.pk)
+        return stats, wall, locked[0]
+
+    def seed(self, options):
+        users = User.objects.bulk_create(
+            [User(phone=f"8{n:09d}", is_verified=True) for n in range(options["users"])]
+        )
+        rows = [
+            ChatHistory(user=user, sender="user" if i % 2 == 0 else "bot", message=f"seed message {i}")
+            for user in users for i in range(options["seed_messages"])
+        ]
+        ChatHistory.objects.bulk_create(rows, batch_size=5000)
+        return users
+
+    @contextmanager
+    def profile_settings(self, profile, options):
+        """The tuned layer as configured, or (stock) Django's SQLite defaults for the default alias."""
+        overrides = {
+            "SUMMARY_WORKER_AUTOSTART": False,  # the summarizer threads run the jobs
+            "SUMMARY_DEBOUNCE_SECONDS": 0,
+            "LLM_BACKEND": "fake",
+            "LLM_FAKE_BACKEND": {"latency_ms": 0, "malformed_rate": 0, "chunk_delay_ms": 0},
+        }
+        if profile == "stock":
+            overrides.update(SQLITE_PRAGMAS={}, DATABASE_ROUTERS=[])
+        settings_dict = connection.settings_dict  # shared by every thread's connection
+        saved = settings_dict["OPTIONS"], settings_dict["CONN_MAX_AGE"]
+        connection.close()
+        if profile == "stock":
+            settings_dict["OPTIONS"] = {"timeout": options["timeout"]}
+            settings_dict["CONN_MAX_AGE"] = 0
+        try:
+            with override_settings(**overrides):
+                model_router.reset_clients()
+                yield
+        finally:
+            model_router.reset_clients()
+            connection.close()
+            settings_dict["OPTIONS"], settings_dict["CONN_MAX_AGE"] = saved
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from app.models import ChatArchiveSegment, ChatHistory, MessageEmbedding
+from app.services import memory_service
+from app.services.archive_service import decode_segment
+
+
+class Command(BaseCommand):
+    help = "Embed chat messages that have no MessageEmbedding yet (hot and archived history)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Messages embedded per insert.")
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help="Delete all stored embeddings first (needed after changing EMBEDDING_DIM).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["rebuild"]:
+            deleted, _ = MessageEmbedding.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} embedding(s).")
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(
+                ChatHistory.objects.filter(id__gt=last_id).order_by("id").only("id", "user_id", "message")[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            total += self._embed_missing(batch)
+
+        for segment in ChatArchiveSegment.objects.only("user_id", "payload").iterator(chunk_size=16):
+            messages = [
+                ChatHistory(id=record["id"], user_id=segment.user_id, message=record["message"])
+                for record in decode_segment(segment.payload)
+            ]
+            total += self._embed_missing(messages)
+
+        for user_id in MessageEmbedding.objects.values_list("user_id", flat=True).distinct():
+            memory_service.forget(user_id)
+        self.stdout.write(self.style.SUCCESS(f"Embedded {total} message(s)."))
+
+    def _embed_missing(self, messages) -> int:
+        existing = set(
+            MessageEmbedding.objects.filter(message_id__in=[m.pk for m in messages]).values_list("message_id", flat=True)
+        )
+        rows = memory_service.build_embeddings([m for m in messages if m.pk not in existing])
+        MessageEmbedding.objects.bulk_create(rows, ignore_conflicts=True)
+        return len(rows)
@@ -0,0 +1,63 @@
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.services.export_service import EXPORT_FORMATS, encode_rows, gzip_chunks, iter_chat_rows, parse_export_filters
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream chat history (archived segments, then ChatHistory) to a gzip-compressed NDJSON or CSV file "
+        "in constant memory (keyset pages, only the exported columns). Reports rows/sec as it goes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Output file (e.g. chats.ndjson.gz), or - for stdout.")
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+        parser.add_argument("--user", default=None, help="Comma-separated user ids.")
+        parser.add_argument("--since", default=None, help="ISO date or datetime (inclusive).")
+        parser.add_argument("--until", default=None, help="ISO date or datetime (inclusive; a date means the whole day).")
+        parser.add_argument("--sender", choices=["user", "bot"], default=None)
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.CHAT_EXPORT_BATCH_SIZE,
+            help="Rows per keyset page / cursor chunk (default: CHAT_EXPORT_BATCH_SIZE).",
+        )
+        parser.add_argument("--no-gzip", action="store_true", help="Write plain text instead of gzip.")
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters(options["user"], options["since"], options["until"], options["sender"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        progress = {"rows": 0, "reported": time.monotonic()}
+        started = time.monotonic()
+
+        def counted(rows):
+            for row in rows:
+                progress["rows"] += 1
+                yield row
+                if time.monotonic() - progress["reported"] >= 2:
+                    progress["reported"] = time.monotonic()
+                    self._report(progress["rows"], started)
+
+        lines = encode_rows(counted(iter_chat_rows(filters, options["batch_size"])), options["format"])
+        chunks = (line.encode("utf-8") for line in lines) if options["no_gzip"] else gzip_chunks(lines)
+
+        out = sys.stdout.buffer if options["output"] == "-" else open(options["output"], "wb")
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+
+        self._report(progress["rows"], started, final=True)
+
+    def _report(self, rows, started, final=False):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        message = f"{rows} row(s) in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)"
+        # stderr, so `-` can stream the export itself to stdout
+        self.stderr.write(self.style.SUCCESS(f"Exported {message}.") if final else message)
@@ -0,0 +1,65 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.services.retention_service import POLICIES, retention_days
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete data older than its DATA_RETENTION policy in small keyset batches "
+        "(short transactions, optional sleep between batches) so chat traffic keeps flowing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only", default="",
+            help=f"Comma-separated policies to run ({', '.join(POLICIES)}; default: all with a retention period).",
+        )
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help="Override the retention period (days) for the selected policies.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.DATA_RETENTION_BATCH_SIZE,
+            help="Rows deleted per transaction (default: DATA_RETENTION_BATCH_SIZE).",
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=settings.DATA_RETENTION_BATCH_SLEEP,
+            help="Seconds to pause between batches (default: DATA_RETENTION_BATCH_SLEEP).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only estimate how many rows would be deleted.")
+
+    def handle(self, *args, **options):
+        names = [n.strip() for n in options["only"].split(",") if n.strip()] or list(POLICIES)
+        unknown = set(names) - set(POLICIES)
+        if unknown:
+            raise CommandError(f"Unknown policy(s): {', '.join(sorted(unknown))}")
+
+        days = retention_days()
+        grand_total = 0
+        for name in names:
+            policy = POLICIES[name]
+            keep = options["days"] if options["days"] is not None else days[name]
+            if keep is None:
+                self.stdout.write(f"{name}: kept forever (DATA_RETENTION[{name!r}] is None), skipped")
+                continue
+
+            cutoff = policy.cutoff(keep)
+            estimate = policy.count(cutoff)
+            if options["dry_run"] or not estimate:
+                self.stdout.write(f"{name}: {estimate} row(s) before {cutoff:%Y-%m-%d %H:%M} — {policy.description}")
+                continue
+
+            total, started = 0, time.monotonic()
+            for deleted in policy.purge(cutoff, options["batch_size"], options["sleep"]):
+                total += deleted
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{name}: {total}/{estimate} row(s) deleted ({min(total / estimate, 1):.0%}, {elapsed:.1f}s)"
+                )
+            grand_total += total
+
+        if not options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"Deleted {grand_total} row(s)."))
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.services.retention_service import POLICIES
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old OTP audit rows in batches. Live codes expire from the cache on their own; "
+        "this only trims the audit log (same as purge_data --only otp)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.OTP_AUDIT_RETENTION_DAYS,
+            help="Delete OTP rows older than this many days (default: OTP_AUDIT_RETENTION_DAYS).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.OTP_PURGE_BATCH_SIZE,
+            help="Rows deleted per batch (default: OTP_PURGE_BATCH_SIZE).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many rows would be deleted.")
+
+    def handle(self, *args, **options):
+        policy = POLICIES["otp"]
+        cutoff = policy.cutoff(options["days"])
+
+        if options["dry_run"]:
+            self.stdout.write(f"{policy.count(cutoff)} OTP row(s) older than {cutoff:%Y-%m-%d %H:%M} would be deleted.")
+            return
+
+        total = 0
+        for deleted in policy.purge(cutoff, options["batch_size"]):
+            total += deleted
+            self.stdout.write(f"deleted {deleted} row(s)")
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total} OTP row(s)."))
@@ -0,0 +1,133 @@
+import json as pyjson
+import time
+import warnings
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from app.loadtest import (
+    ENDPOINT_URLS, QueryCounter, benchmark_database, compare_results, log_in, post_chat, read_results,
+    read_sessions, response_reply, run_concurrently, summarize_results,
+)
+from app.models import User
+from app.services import model_router
+from app.services.llm_service import prompt_observer
+from app.services.summary_worker import run_pending_summary_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay recorded conversations (NDJSON of user messages per session) through the real chat "
+        "endpoints and state machine against a throwaway database and a fake or recorded LLM. Reports "
+        "prompt tokens, DB queries, wall time and replies per turn, and compares them with a baseline run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("sessions", help='NDJSON: {"session", "message"} or {"session", "messages": [...]} per line.')
+        parser.add_argument("--endpoint", choices=sorted(ENDPOINT_URLS), default="chat_api")
+        parser.add_argument("--concurrency", type=int, default=4, help="Sessions replayed at the same time.")
+        parser.add_argument("--output", default=None, help="Write per-turn results as NDJSON (usable as --baseline / --recording).")
+        parser.add_argument("--baseline", default=None, help="Results file of an earlier run to compare against.")
+        parser.add_argument("--show-diffs", type=int, default=5, help="Reply diffs / prompt regressions to print.")
+        parser.add_argument("--backend", default="fake", help="LLM_BACKEND: fake (default), recorded or gemini.")
+        parser.add_argument("--recording", default=None, help="Results file whose replies the recorded backend replays.")
+        parser.add_argument("--latency-ms", type=float, default=0, help="Fake/recorded backend median latency.")
+        parser.add_argument("--no-login", action="store_true", help="Don't log each session in first (anonymous).")
+        parser.add_argument(
+            "--reply-cache", action="store_true",
+            help="Keep the shared reply cache on (off by default: hits depend on session interleaving).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sessions = read_sessions(options["sessions"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if options["backend"] == "recorded" and not options["recording"]:
+            raise CommandError("--backend recorded needs --recording")
+
+        overrides = {
+            "LLM_BACKEND": options["backend"],
+            "LLM_FAKE_BACKEND": {"latency_ms": options["latency_ms"], "malformed_rate": 0, "chunk_delay_ms": 0},
+            "LLM_RECORDED_BACKEND": {"path": options["recording"]},
+            "REPLY_CACHE_ENABLED": options["reply_cache"],
+            "CHAT_RATE_LIMIT_PER_MINUTE": 0,
+            # Summaries run inline after each turn, so every run sees the same summaries
+            "SUMMARY_WORKER_AUTOSTART": False,
+            "SUMMARY_DEBOUNCE_SECONDS": 0,
+        }
+        warnings.filterwarnings("ignore", message="StreamingHttpResponse must consume asynchronous iterators")
+
+        results = {}
+        setup_test_environment()
+        try:
+            with override_settings(**overrides), benchmark_database():
+                model_router.reset_clients()
+                started = time.perf_counter()
+                run_concurrently(
+                    lambda item: results.update(self.replay_session(item[0], item[1], item[2], options)),
+                    [(n, session, messages) for n, (session, messages) in enumerate(sessions.items())],
+                    options["concurrency"],
+                )
+                wall = time.perf_counter() - started
+        finally:
+            model_router.reset_clients()
+            teardown_test_environment()
+
+        ordered = [results[key] for key in sorted(results, key=lambda k: (list(sessions).index(k[0]), k[1]))]
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                for record in ordered:
+                    f.write(pyjson.dumps(record, ensure_ascii=False) + "\n")
+
+        summary = summarize_results(ordered)
+        self.stdout.write(f"Replayed {len(sessions)} session(s), {summary['turns']} turn(s) in {wall:.2f}s "
+                          f"via {options['endpoint']} ({options['backend']} backend)")
+        for name, value in summary.items():
+            self.stdout.write(f"  {name:<20} {value:>10.1f}")
+        self.stdout.write(f"LLM calls by tier: {model_router.call_log.stats()}")
+
+        if options["baseline"]:
+            self.stdout.write("\n" + compare_results(read_results(options["baseline"]), results, options["show_diffs"]))
+
+    def replay_session(self, n, session, messages, options):
+        client = Client()
+        user = None
+        if not options["no_login"]:
+            phone = f"8{n:09d}"
+            log_in(client, phone)
+            user = User.objects.get(phone=phone)
+
+        records = {}
+        for turn, message in enumerate(messages, 1):
+            prompts = []
+            token = prompt_observer.set(prompts)
+            try:
+                started = time.perf_counter()
+                with QueryCounter() as queries:
+                    response = post_chat(client, options["endpoint"], message)
+                    reply = response_reply(response) if response.status_code < 400 else ""
+                ms = (time.perf_counter() - started) * 1000
+            finally:
+                prompt_observer.reset(token)
+
+            summary_ms = None
+            if user is not None:
+                summary_started = time.perf_counter()
+                if run_pending_summary_jobs(user=user):
+                    summary_ms = (time.perf_counter() - summary_started) * 1000
+
+            records[(session, turn)] = {
+                "session": session,
+                "turn": turn,
+                "message": message,
+                "endpoint": options["endpoint"],
+                "status": response.status_code,
+                "ms": round(ms, 2),
+                "queries": queries.count,
+                "prompt_tokens": sum(p.tokens for p in prompts) if prompts else None,
+                "summary_ms": round(summary_ms, 2) if summary_ms is not None else None,
+                "reply": reply,
+            }
+        return records
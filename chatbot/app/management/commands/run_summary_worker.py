@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.services.summary_worker import SummaryWorker, run_pending_summary_jobs
+
+
+class Command(BaseCommand):
+    help = "Process queued conversation summary jobs (run with SUMMARY_WORKER_AUTOSTART = False in web processes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Process due jobs once and exit.")
+        parser.add_argument("--threads", type=int, default=None, help="Worker threads (default: SUMMARY_WORKER_THREADS).")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            processed = run_pending_summary_jobs()
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} summary job(s)."))
+            return
+
+        worker = SummaryWorker(threads=options["threads"])
+        worker.start()
+        self.stdout.write(self.style.SUCCESS(f"Summary worker running with {worker.threads} thread(s). Ctrl+C to stop."))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,279 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and fixed-bucket histograms live in this process's memory and are
+served by the /metrics view. `span` / `timed` time the stages of a chat
+turn (session and user lookup, prompt context, reply cleanup, commit), the
+LLM layer records its calls, and MetricsMiddleware records request latency
+and DB queries per request. Values that are cheap to read on demand
+(pending summary jobs, reply cache stats) are added by collectors at
+scrape time.
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+TOKEN_BUCKETS = (50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in key) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        series = self._series.get(_label_key(labels))
+        return series[-1] if series else 0
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, series):
+                    cumulative += bucket
+                    out.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+                out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), series[-1]))
+                out.append((f"{self.name}_sum", key, series[-2]))
+                out.append((f"{self.name}_count", key, series[-1]))
+        return out
+
+
+class Gauge:
+    """A value computed at scrape time: callback() -> {label key tuple: value}."""
+    type = "gauge"
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in sorted(self.callback().items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, callback) -> Gauge:
+        return self._register(Gauge(name, help_text, callback))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:  # a broken collector must not break the scrape
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in samples:
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# -------------------------
+# Core metrics
+# -------------------------
+http_requests = registry.counter("chatbot_http_requests_total", "HTTP requests by view, method and status.")
+http_duration = registry.histogram("chatbot_http_request_duration_seconds", "HTTP request latency by view.")
+db_queries = registry.histogram(
+    "chatbot_db_queries_per_request", "Database queries issued per HTTP request, by view.", COUNT_BUCKETS,
+)
+stage_duration = registry.histogram("chatbot_stage_duration_seconds", "Latency of chat-turn stages.")
+llm_calls = registry.counter("chatbot_llm_calls_total", "LLM calls by tier, purpose and outcome.")
+llm_duration = registry.histogram("chatbot_llm_call_duration_seconds", "LLM call latency by tier and purpose.")
+prompt_tokens = registry.histogram(
+    "chatbot_prompt_tokens", "Estimated tokens in each assembled chat prompt.", TOKEN_BUCKETS,
+)
+reply_cache_lookups = registry.counter(
+    "chatbot_reply_cache_lookups_total", "Semantic reply cache lookups by result (hit or miss).",
+)
+ws_connections = registry.counter(
+    "chatbot_websocket_connections_total", "Chat WebSocket handshakes by outcome.",
+)
+ws_message_duration = registry.histogram(
+    "chatbot_websocket_message_duration_seconds", "Time to handle one chat WebSocket message.",
+)
+ws_queries = registry.histogram(
+    "chatbot_db_queries_per_websocket_message", "Database queries issued per chat WebSocket message.", COUNT_BUCKETS,
+)
+summary_lag = registry.histogram(
+    "chatbot_summary_lag_seconds", "Time from a summary job being queued to the summary being refreshed.",
+    LAG_BUCKETS,
+)
+
+
+# -------------------------
+# Spans
+# -------------------------
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as `stage` in chatbot_stage_duration_seconds."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed(stage: str):
+    """Decorator form of `span`, for plain and async functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# -------------------------
+# DB query counting
+# -------------------------
+# The current request's query counter. contextvars follow the request into
+# sync_to_async threads, so async views are counted too.
+_query_counter = contextvars.ContextVar("chatbot_query_counter", default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """connection.execute_wrappers hook (installed on every new DB connection)."""
+    counter = _query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def start_query_count() -> list:
+    """Start counting queries for the current request; returns a one-item [count] list."""
+    counter = [0]
+    _query_counter.set(counter)
+    return counter
+
+
+# -------------------------
+# Scrape-time collectors
+# -------------------------
+def _summary_jobs():
+    from django.db.models import Count
+    from .models import SummaryJob
+
+    rows = SummaryJob.objects.values_list("status").annotate(n=Count("id"))
+    return {(("status", status),): n for status, n in rows}
+
+
+def _summary_oldest_pending():
+    from django.utils import timezone
+    from .models import SummaryJob
+
+    oldest = SummaryJob.objects.filter(status=SummaryJob.STATUS_PENDING).order_by("created_at").values_list(
+        "created_at", flat=True,
+    ).first()
+    return {(): (timezone.now() - oldest).total_seconds() if oldest else 0.0}
+
+
+def _reply_cache(stat):
+    def collect():
+        from .services.reply_cache import get_reply_cache
+
+        cache = get_reply_cache()
+        return {(): cache.stats()[stat]} if cache is not None else {}
+    return collect
+
+
+registry.gauge("chatbot_summary_jobs", "Queued summary jobs by status.", _summary_jobs)
+registry.gauge(
+    "chatbot_summary_oldest_pending_seconds", "Age of the oldest pending summary job.", _summary_oldest_pending,
+)
+registry.gauge("chatbot_reply_cache_entries", "Entries in the semantic reply cache.", _reply_cache("size"))
+registry.gauge("chatbot_reply_cache_hit_ratio", "Semantic reply cache hit ratio since start.", _reply_cache("hit_rate"))
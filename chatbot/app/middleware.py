@@ -0,0 +1,109 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import JsonResponse
+
+from . import metrics
+from .services import session_user
+from .services.admission import AdmissionError
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status and DB query count for every request, labelled
+    by the resolved view. Streaming responses are measured until their
+    content is fully sent, so queries made while streaming are included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started, queries = time.perf_counter(), metrics.start_query_count()
+        return self._finish(request, self.get_response(request), started, queries)
+
+    async def __acall__(self, request):
+        started, queries = time.perf_counter(), metrics.start_query_count()
+        return self._finish(request, await self.get_response(request), started, queries)
+
+    def _finish(self, request, response, started, queries):
+        def record():
+            match = request.resolver_match
+            view = match.view_name if match else "unmatched"
+            metrics.http_requests.inc(view=view, method=request.method, status=response.status_code)
+            metrics.http_duration.observe(time.perf_counter() - started, view=view)
+            metrics.db_queries.observe(queries[0], view=view)
+
+        if not response.streaming:
+            record()
+        elif response.is_async:
+            response.streaming_content = self._arecord_after(response.streaming_content, record)
+        else:
+            response.streaming_content = self._record_after(response.streaming_content, record)
+        return response
+
+    @staticmethod
+    def _record_after(content, record):
+        try:
+            yield from content
+        finally:
+            record()
+
+    @staticmethod
+    async def _arecord_after(content, record):
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            record()
+
+
+class AdmissionMiddleware:
+    """
+    Turn admission-control rejections (per-user rate limit, saturated LLM
+    queue, provider quota) into 429/503 JSON responses with Retry-After.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, AdmissionError):
+            return None
+        response = JsonResponse(
+            {"error": exception.reason, "reply": str(exception), "retry_after": exception.retry_after},
+            status=exception.status,
+        )
+        response["Retry-After"] = str(exception.retry_after)
+        return response
+
+
+class ChatUserMiddleware:
+    """
+    Resolve the chat user (the User for the session phone) lazily and at
+    most once per request: `request.chat_user()` / `await request.achat_user()`.
+    Must come after SessionMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        return self.get_response(session_user.attach(request))
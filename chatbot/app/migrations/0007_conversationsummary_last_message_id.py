@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:38
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def mark_existing_summaries(apps, schema_editor):
+    """Existing summaries already cover the history so far — start the watermark at the latest message."""
+    ConversationSummary = apps.get_model('app', 'ConversationSummary')
+    ChatHistory = apps.get_model('app', 'ChatHistory')
+    for summary in ConversationSummary.objects.all():
+        latest = ChatHistory.objects.filter(user_id=summary.user_id).aggregate(m=Max('id'))['m']
+        if latest:
+            summary.last_message_id = latest
+            summary.save(update_fields=['last_message_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_summaryjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='last_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(mark_existing_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_conversationsummary_last_message_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='chat_user_ts_id_idx'),
+        ),
+    ]
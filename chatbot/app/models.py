@@ -1,7 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
-from datetime import timedelta
 
 
 # -------------------------------
@@ -54,13 +53,18 @@ class User(AbstractBaseUser, PermissionsMixin):
 # OTP Model
 # -------------------------------
 class OTP(models.Model):
+    """
+    Audit log of issued codes. Live codes are checked against the cache
+    (app.services.otp_service); rows are purged by `manage.py purge_otps`.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="otps")
     code = models.CharField(max_length=6)
     created_at = models.DateTimeField(auto_now_add=True)
+    verified_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)  # recorded on success or lockout
 
-    def is_expired(self):
-        """OTP expires in 5 minutes"""
-        return timezone.now() > self.created_at + timedelta(minutes=5)
+    class Meta:
+        indexes = [models.Index(fields=["user", "created_at"], name="otp_user_created_idx")]
 
     def __str__(self):
         return f"OTP {self.code} for {self.user.phone}"
@@ -78,9 +82,64 @@ class ChatHistory(models.Model):
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination / recent-context reads: WHERE user ORDER BY timestamp, id
+            models.Index(fields=["user", "timestamp", "id"], name="chat_user_ts_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.user.phone} | {self.sender}: {self.message[:30]}"
 
+# -------------------------------
+# Message Embedding Model
+# -------------------------------
+class MessageEmbedding(models.Model):
+    """
+    Local embedding of one chat message for long-term recall.
+    `vector` is raw float32 bytes; `message_id` is the ChatHistory id, kept
+    as a plain integer so embeddings outlive archiving of the message row.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="message_embeddings")
+    message_id = models.BigIntegerField(unique=True)
+    vector = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "message_id"], name="msgembed_user_msg_idx"),
+        ]
+
+    def __str__(self):
+        return f"Embedding for message {self.message_id}"
+
+
+# -------------------------------
+# Chat Archive Model
+# -------------------------------
+class ChatArchiveSegment(models.Model):
+    """
+    A run of a user's old ChatHistory rows moved out of the hot table.
+    `payload` is zlib-compressed NDJSON, one {id, sender, message, timestamp}
+    object per line; the id/timestamp ranges index the segment.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chat_archive_segments")
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    payload = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "last_message_id"], name="chatarchive_user_last_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.phone} | archived #{self.first_message_id}-{self.last_message_id}"
+
+
 # -------------------------------
 # Chat Summary Model
 # -------------------------------
@@ -88,6 +147,44 @@ class ConversationSummary(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="summary")
     summary_text = models.TextField(blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
+    refreshed_at = models.DateTimeField(blank=True, null=True)  # last completed summary refresh
+    last_message_id = models.BigIntegerField(default=0)  # high-water mark: last ChatHistory id summarized
+
+    def __str__(self):
+        return f"Summary for {self.user.phone}"
+
+
+# -------------------------------
+# Summary Job Model
+# -------------------------------
+class SummaryJob(models.Model):
+    """Queued summary refresh, processed by the background summary worker."""
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_FAILED = "failed"
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="summary_jobs")
+    status = models.CharField(
+        max_length=10,
+        choices=((STATUS_PENDING, "Pending"), (STATUS_RUNNING, "Running"), (STATUS_FAILED, "Failed")),
+        default=STATUS_PENDING,
+    )
+    run_after = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"], name="summaryjob_status_run_idx")]
+        constraints = [
+            # At most one pending job per user — new turns coalesce into it
+            models.UniqueConstraint(
+                fields=["user"],
+                condition=models.Q(status="pending"),
+                name="unique_pending_summary_job",
+            ),
+        ]
 
     def __str__(self):
-        return f"Summary for {self.user.phone}"
\ No newline at end of file
+        return f"SummaryJob {self.status} for {self.user.phone}"
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+Admission control in front of the LLM.
+
+- A process-wide concurrency limiter bounds in-flight LLM calls to
+  LLM_MAX_CONCURRENCY. Further calls wait in a FIFO queue of at most
+  LLM_MAX_QUEUE for up to LLM_QUEUE_TIMEOUT_SECONDS; beyond that they are
+  rejected immediately (503).
+- A provider quota error (HTTP 429 / ResourceExhausted) is turned into
+  LLMQuotaExceeded and opens a cooldown of LLM_QUOTA_COOLDOWN_SECONDS
+  during which new calls fail fast instead of hitting the provider again.
+- A per-user token bucket limits chat turns that go to the LLM to
+  CHAT_RATE_LIMIT_PER_MINUTE with bursts of CHAT_RATE_LIMIT_BURST (429).
+  Login/OTP messages, logout and replies answered locally are not charged.
+
+All rejections carry a retry_after; AdmissionMiddleware turns them into
+responses with a Retry-After header. Limits are per process.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from .. import metrics
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class AdmissionError(Exception):
+    """Request refused to protect the LLM; `status` and `retry_after` shape the response."""
+    status = 503
+    reason = "overloaded"
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class LLMOverloaded(AdmissionError):
+    def __init__(self, reason, retry_after=1):
+        super().__init__("⚠️ I'm getting a lot of messages right now. Please try again in a moment.", retry_after)
+        self.reason = reason
+
+
+class LLMQuotaExceeded(AdmissionError):
+    reason = "quota"
+
+    def __init__(self, retry_after):
+        super().__init__("⚠️ I've hit my usage limit for the moment. Please try again shortly.", retry_after)
+
+
+class RateLimited(AdmissionError):
+    status = 429
+    reason = "rate_limited"
+
+    def __init__(self, retry_after):
+        super().__init__("⚠️ You're sending messages too quickly. Please slow down a little.", retry_after)
+
+
+rejections = metrics.registry.counter(
+    "chatbot_admission_rejected_total", "Requests refused by admission control, by reason.",
+)
+queue_wait = metrics.registry.histogram(
+    "chatbot_llm_queue_wait_seconds", "Time LLM calls waited for a concurrency slot.",
+)
+
+
+# -------------------------
+# Concurrency limiter
+# -------------------------
+class _Waiter:
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class ConcurrencyLimiter:
+    """
+    Counting semaphore with a bounded FIFO wait queue, usable from threads
+    and coroutines alike. A released slot is handed straight to the oldest
+    waiter, so queued calls are served in order.
+    """
+
+    def __init__(self, limit, max_queue, timeout):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.active = 0
+        self._cooldown_until = 0.0
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    # Quota cooldown
+    def cool_down(self, seconds):
+        with self._lock:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+
+    def _check_cooldown(self):
+        remaining = self._cooldown_until - time.monotonic()
+        if remaining > 0:
+            raise LLMQuotaExceeded(remaining)
+
+    def _enter_or_wait(self, wake):
+        """Take a slot (returns None) or join the queue (returns the waiter). Caller holds the lock."""
+        self._check_cooldown()
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            raise LLMOverloaded("queue_full", retry_after=self.timeout)
+        waiter = _Waiter(wake)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _give_up(self, waiter):
+        """After a wait timed out or was cancelled: True if the slot arrived anyway."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def reject_if_saturated(self):
+        """Fail fast (without queueing) when a new call could not even be queued."""
+        with self._lock:
+            self._check_cooldown()
+            if self.active >= self.limit and len(self._waiters) >= self.max_queue:
+                raise LLMOverloaded("queue_full", retry_after=self.timeout)
+
+    def acquire(self):
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enter_or_wait(event.set)
+        if waiter is None:
+            return
+        if not event.wait(self.timeout) and not self._give_up(waiter):
+            raise LLMOverloaded("queue_timeout", retry_after=self.timeout)
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        with self._lock:
+            waiter = self._enter_or_wait(wake)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.timeout)
+        except asyncio.TimeoutError:
+            if not self._give_up(waiter):
+                raise LLMOverloaded("queue_timeout", retry_after=self.timeout)
+        except asyncio.CancelledError:
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True  # the slot passes straight to the waiter
+                waiter.wake()
+            else:
+                self.active -= 1
+
+
+_limiter = None
+_limiter_config = None
+_limiter_lock = threading.Lock()
+
+
+def get_llm_limiter() -> ConcurrencyLimiter:
+    """Built once per LLM_MAX_CONCURRENCY / LLM_MAX_QUEUE / LLM_QUEUE_TIMEOUT_SECONDS value."""
+    global _limiter, _limiter_config
+    config = (
+        _setting("LLM_MAX_CONCURRENCY", 8),
+        _setting("LLM_MAX_QUEUE", 32),
+        _setting("LLM_QUEUE_TIMEOUT_SECONDS", 10),
+    )
+    with _limiter_lock:
+        if _limiter is None or _limiter_config != config:
+            _limiter = ConcurrencyLimiter(*config)
+            _limiter_config = config
+        return _limiter
+
+
+def is_quota_error(error) -> bool:
+    """Provider rate-limit / quota errors (google.api_core ResourceExhausted, HTTP 429)."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    return "429" in str(error) and "quota" in str(error).lower()
+
+
+def _on_error(limiter, error):
+    if is_quota_error(error):
+        cooldown = _setting("LLM_QUOTA_COOLDOWN_SECONDS", 30)
+        limiter.cool_down(cooldown)
+        rejections.inc(reason="quota")
+        raise LLMQuotaExceeded(cooldown) from error
+    raise error
+
+
+@contextmanager
+def llm_slot():
+    """Hold one LLM concurrency slot for the enclosed call (sync)."""
+    limiter = get_llm_limiter()
+    started = time.perf_counter()
+    try:
+        limiter.acquire()
+    except AdmissionError as e:
+        rejections.inc(reason=e.reason)
+        raise
+    queue_wait.observe(time.perf_counter() - started)
+    try:
+        yield
+    except AdmissionError:
+        raise
+    except Exception as e:
+        _on_error(limiter, e)
+    finally:
+        limiter.release()
+
+
+@asynccontextmanager
+async def allm_slot():
+    """Async version of llm_slot"""
+    limiter = get_llm_limiter()
+    started = time.perf_counter()
+    try:
+        await limiter.aacquire()
+    except AdmissionError as e:
+        rejections.inc(reason=e.reason)
+        raise
+    queue_wait.observe(time.perf_counter() - started)
+    try:
+        yield
+    except AdmissionError:
+        raise
+    except Exception as e:
+        _on_error(limiter, e)
+    finally:
+        limiter.release()
+
+
+def check_llm_capacity():
+    """Raise before starting a streaming response if the LLM is saturated or cooling down."""
+    try:
+        get_llm_limiter().reject_if_saturated()
+    except AdmissionError as e:
+        rejections.inc(reason=e.reason)
+        raise
+
+
+metrics.registry.gauge(
+    "chatbot_llm_active_calls", "LLM calls currently holding a concurrency slot.",
+    lambda: {(): get_llm_limiter().active},
+)
+metrics.registry.gauge(
+    "chatbot_llm_queue_depth", "LLM calls waiting for a concurrency slot.",
+    lambda: {(): get_llm_limiter().queued},
+)
+
+
+# -------------------------
+# Per-user token bucket
+# -------------------------
+class TokenBucketLimiter:
+    """`rate` tokens per second up to `burst`, tracked per key (LRU-bounded)."""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key):
+        """Spend one token for `key`; raises RateLimited when the bucket is empty."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                raise RateLimited((1 - tokens) / self.rate)
+            self._buckets[key] = (tokens - 1, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+
+_rate_limiter = None
+_rate_config = None
+
+
+def get_chat_rate_limiter():
+    """The per-user chat limiter, or None when CHAT_RATE_LIMIT_PER_MINUTE is 0."""
+    global _rate_limiter, _rate_config
+    config = (_setting("CHAT_RATE_LIMIT_PER_MINUTE", 20), _setting("CHAT_RATE_LIMIT_BURST", 5))
+    if not config[0]:
+        return None
+    with _limiter_lock:
+        if _rate_limiter is None or _rate_config != config:
+            _rate_limiter = TokenBucketLimiter(config[0] / 60, config[1])
+            _rate_config = config
+        return _rate_limiter
+
+
+def chat_rate_key(request, user):
+    """The token bucket for a chat request: the user, else the session, else the client IP."""
+    if user is not None:
+        return f"user:{user.pk}"
+    if request.session.session_key:
+        return f"session:{request.session.session_key}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def check_chat_rate(key):
+    """Take a token from `key`'s bucket (see chat_rate_key); no-op for None or when disabled."""
+    limiter = get_chat_rate_limiter()
+    if limiter is None or key is None:
+        return
+    try:
+        limiter.take(key)
+    except RateLimited:
+        rejections.inc(reason=RateLimited.reason)
+        raise
@@ -0,0 +1,125 @@
+import json as pyjson
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ..models import ChatArchiveSegment, ChatHistory, ConversationSummary
+from . import context_cache
+
+
+# -------------------------
+# Segment encoding
+# -------------------------
+def encode_segment(rows) -> bytes:
+    """Compress (id, sender, message, timestamp) rows into zlib NDJSON."""
+    lines = (
+        pyjson.dumps({"id": mid, "sender": sender, "message": message, "timestamp": ts.isoformat()}, ensure_ascii=False)
+        for mid, sender, message, ts in rows
+    )
+    return zlib.compress("\n".join(lines).encode("utf-8"), level=9)
+
+
+def decode_segment(payload) -> list:
+    """Decompress a segment payload into {id, sender, message, timestamp} dicts."""
+    messages = []
+    for line in zlib.decompress(bytes(payload)).decode("utf-8").splitlines():
+        record = pyjson.loads(line)
+        record["timestamp"] = parse_datetime(record["timestamp"])
+        messages.append(record)
+    return messages
+
+
+# -------------------------
+# Archiving
+# -------------------------
+def archive_cutoff(days=None):
+    days = days if days is not None else getattr(settings, "CHAT_ARCHIVE_AFTER_DAYS", 90)
+    return timezone.now() - timedelta(days=days)
+
+
+def _archivable(user_id, cutoff):
+    """
+    Hot rows older than `cutoff` that the summary already covers.
+    Unsummarized rows stay hot so the summary watermark never skips them,
+    which also keeps the archive an id-prefix of each user's history.
+    """
+    watermark = (
+        ConversationSummary.objects.filter(user_id=user_id).values_list("last_message_id", flat=True).first() or 0
+    )
+    return ChatHistory.objects.filter(user_id=user_id, timestamp__lt=cutoff, id__lte=watermark)
+
+
+def archive_user_history(user_id, cutoff, segment_size=None) -> int:
+    """Move a user's archivable messages into compressed segments. Returns rows archived."""
+    segment_size = segment_size or getattr(settings, "CHAT_ARCHIVE_SEGMENT_SIZE", 500)
+    archived = 0
+    while True:
+        rows = list(
+            _archivable(user_id, cutoff).order_by("id").values_list("id", "sender", "message", "timestamp")[:segment_size]
+        )
+        if not rows:
+            return archived
+
+        with transaction.atomic():
+            ChatArchiveSegment.objects.create(
+                user_id=user_id,
+                first_message_id=rows[0][0],
+                last_message_id=rows[-1][0],
+                first_timestamp=rows[0][3],
+                last_timestamp=rows[-1][3],
+                message_count=len(rows),
+                payload=encode_segment(rows),
+            )
+            ChatHistory.objects.filter(user_id=user_id, id__in=[r[0] for r in rows]).delete()
+        archived += len(rows)
+        context_cache.invalidate(user_id)
+
+        if len(rows) < segment_size:
+            return archived
+
+
+def users_with_archivable_history(cutoff):
+    return ChatHistory.objects.filter(timestamp__lt=cutoff).values_list("user_id", flat=True).distinct()
+
+
+def count_archivable(cutoff) -> int:
+    return sum(_archivable(user_id, cutoff).count() for user_id in users_with_archivable_history(cutoff))
+
+
+# -------------------------
+# Reading archived history
+# -------------------------
+def archive_boundary(user) -> int:
+    """Highest archived message id for the user (0 if nothing is archived)."""
+    return ChatArchiveSegment.objects.filter(user=user).aggregate(m=Max("last_message_id"))["m"] or 0
+
+
+def get_archived_messages(user, before_id=None, after_id=None, limit=None, newest_first=False) -> list:
+    """
+    Archived {id, sender, message, timestamp} dicts, decoded segment by segment.
+    Only segments overlapping the requested id range are decompressed.
+    """
+    segments = ChatArchiveSegment.objects.filter(user=user)
+    if before_id:
+        segments = segments.filter(first_message_id__lt=before_id)
+    if after_id:
+        segments = segments.filter(last_message_id__gt=after_id)
+    segments = segments.order_by("-last_message_id" if newest_first else "first_message_id")
+
+    messages = []
+    for payload in segments.values_list("payload", flat=True).iterator(chunk_size=4):
+        records = decode_segment(payload)
+        if newest_first:
+            records.reverse()
+        for record in records:
+            if (before_id and record["id"] >= before_id) or (after_id and record["id"] <= after_id):
+                continue
+            messages.append(record)
+            if limit is not None and len(messages) >= limit:
+                return messages
+    return messages
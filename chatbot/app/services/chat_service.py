@@ -1,14 +1,149 @@
-from ..models import ChatHistory, User, ConversationSummary
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Length
+from django.utils import timezone
+
+from .. import metrics
+from ..models import ChatHistory, MessageEmbedding, User, ConversationSummary
+from . import context_cache, memory_service
+from .context_builder import format_message
+from .archive_service import archive_boundary, get_archived_messages
+from .token_service import tokens_from_chars
 
 
 def save_chat(user: User, sender: str, message: str):
     """Save chat to history"""
-    ChatHistory.objects.create(user=user, sender=sender, message=message)
+    with transaction.atomic():
+        chat = ChatHistory.objects.create(user=user, sender=sender, message=message)
+        embeddings = MessageEmbedding.objects.bulk_create(memory_service.build_embeddings([chat]))
+    context_cache.append_messages(user.pk, [(chat.pk, sender, message)])
+    memory_service.remember(user.pk, embeddings)
+
+
+ChatRecord = namedtuple("ChatRecord", ["id", "sender", "message", "timestamp"])
+
+
+class ChatTurn:
+    """
+    Unit of work for one chat turn.
+    Buffers the turn's messages and writes them, together with the summary
+    job upsert, in a single short transaction: the read-only refresh-policy
+    check runs first, so the write lock is held for just two statements.
+    """
+
+    def __init__(self, user: User = None):
+        self.user = user
+        self.messages = []
+
+    def add(self, sender: str, message: str):
+        if self.user and message:
+            self.messages.append(ChatHistory(user=self.user, sender=sender, message=message))
+
+    def commit(self):
+        """Write buffered messages; returns the created ChatHistory rows."""
+        if not self.messages:
+            return []
+        return self._write(summary_refresh_due(self.user, self.messages))
+
+    async def acommit(self):
+        """
+        Async version of commit. The refresh-policy check uses the async ORM;
+        the write needs transaction.atomic, which Django only provides to sync
+        code, so it runs as one sync_to_async call.
+        """
+        if not self.messages:
+            return []
+        refresh_due = await asummary_refresh_due(self.user, self.messages)
+        return await sync_to_async(self._write)(refresh_due)
+
+    def _write(self, refresh_due):
+        from .summary_worker import queue_summary_job, start_summary_worker
+
+        with metrics.span("chat_turn_commit"), transaction.atomic():
+            created = ChatHistory.objects.bulk_create(self.messages)
+            embeddings = MessageEmbedding.objects.bulk_create(memory_service.build_embeddings(created))
+            if refresh_due:
+                queue_summary_job(self.user)
+        self.messages = []
+        context_cache.append_messages(self.user.pk, [(m.pk, m.sender, m.message) for m in created])
+        memory_service.remember(self.user.pk, embeddings)
+
+        if refresh_due:
+            start_summary_worker()
+        return created
 
 
 def get_chat_history(user: User):
-    """Retrieve full chat history for a user"""
-    return ChatHistory.objects.filter(user=user).order_by("timestamp")
+    """Retrieve full chat history for a user (archived segments + hot table)"""
+    records = [
+        ChatRecord(m["id"], m["sender"], m["message"], m["timestamp"])
+        for m in get_archived_messages(user)
+    ]
+    hot = ChatHistory.objects.filter(user=user).order_by("timestamp", "id")
+    records += [ChatRecord(*row) for row in hot.values_list("id", "sender", "message", "timestamp")]
+    return records
+
+
+def _hot_history_page(user, before_id=None, after_id=None, limit=50, forward=False):
+    """One keyset page from the hot table ({id, sender, message}, in query order)."""
+    qs = ChatHistory.objects.filter(user=user)
+    cursor_id = after_id or before_id
+    if cursor_id:
+        pivot = Subquery(ChatHistory.objects.filter(pk=cursor_id, user=user).values("timestamp")[:1])
+        if after_id:
+            qs = qs.filter(Q(timestamp__gt=pivot) | Q(timestamp=pivot, id__gt=after_id))
+        else:
+            qs = qs.filter(Q(timestamp__lt=pivot) | Q(timestamp=pivot, id__lt=before_id))
+
+    ordering = ("timestamp", "id") if forward else ("-timestamp", "-id")
+    return list(qs.order_by(*ordering).values("id", "sender", "message")[:limit])
+
+
+def _archived_page(user, before_id=None, after_id=None, limit=50, newest_first=False):
+    return [
+        {"id": m["id"], "sender": m["sender"], "message": m["message"]}
+        for m in get_archived_messages(user, before_id=before_id, after_id=after_id, limit=limit, newest_first=newest_first)
+    ]
+
+
+def get_chat_history_page(user: User, before_id=None, after_id=None, limit=50):
+    """
+    Keyset-paginated chat history (served by the (user, timestamp, id) index).
+    - neither cursor: the latest `limit` messages
+    - before_id: the `limit` messages just older than that message
+    - after_id: up to `limit` messages newer than that message
+    Pages continue transparently into archived segments, which always hold
+    the oldest ids (see archive_service).
+    Returns (rows, has_more): rows are {id, sender, message} dicts in
+    chronological order; has_more says whether more exist in that direction.
+    """
+    boundary = archive_boundary(user)
+
+    if after_id:
+        rows = []
+        if after_id <= boundary:  # the cursor row is archived (gone from the hot table)
+            rows = _archived_page(user, after_id=after_id, limit=limit + 1)
+        if len(rows) <= limit:
+            hot_cursor = after_id if after_id > boundary else None
+            rows += _hot_history_page(user, after_id=hot_cursor, limit=limit + 1 - len(rows), forward=True)
+    else:
+        rows = []
+        if not (before_id and before_id <= boundary):
+            rows = _hot_history_page(user, before_id=before_id, limit=limit + 1)
+        if len(rows) <= limit and boundary:
+            archive_cursor = rows[-1]["id"] if rows else (before_id or boundary + 1)
+            rows += _archived_page(user, before_id=archive_cursor, limit=limit + 1 - len(rows), newest_first=True)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after_id:
+        rows.reverse()
+    return rows, has_more
+
 
 # def get_recent_chat_context(user, limit=5):
 #     """
@@ -27,42 +162,127 @@ def get_chat_history(user: User):
 
 #     return context.strip()
 
+def _format_chat_context(messages):
+    return "\n".join(format_message(sender, message) for _, sender, message in messages).strip()
+
+
 def get_recent_chat_context(user, limit=5):
-    chats = ChatHistory.objects.filter(user=user).order_by('-timestamp')[:limit * 2]
-    chats = list(reversed(chats))
+    """Last `limit` user/bot pairs as prompt text (served from the context cache)."""
+    messages = context_cache.get_context(user.pk)["messages"]
+    return _format_chat_context(messages[-limit * 2:])
+
 
-    lines = []
-    for msg in chats:
-        text = msg.message.strip()
-        # Avoid prefixing again if already includes "Bot:" or "User:"
-        if not text.lower().startswith(("bot:", "user:")):
-            prefix = "User:" if msg.sender == "user" else "Bot:"
-            text = f"{prefix} {text}"
-        lines.append(text)
+PromptContext = namedtuple("PromptContext", ["summary", "recalled", "recent"])
 
-    return "\n".join(lines).strip()
 
+@metrics.timed("prompt_context")
+def get_prompt_context(user, query) -> PromptContext:
+    """
+    Everything the context builder may pack for `user`: the summary, the
+    cached recent window and older messages recalled for `query`
+    (recall skips messages already in the window).
+    """
+    entry = context_cache.get_context(user.pk)
+    recent = entry["messages"]
+    recalled = memory_service.recall_relevant_messages(user, query, exclude_ids={m[0] for m in recent})
+    return PromptContext(entry["summary"], recalled, recent)
+
+
+@metrics.timed("prompt_context")
+async def aget_prompt_context(user, query) -> PromptContext:
+    """Async version of get_prompt_context"""
+    entry = await context_cache.aget_context(user.pk)
+    recent = entry["messages"]
+    recalled = await sync_to_async(memory_service.recall_relevant_messages)(
+        user, query, exclude_ids={m[0] for m in recent},
+    )
+    return PromptContext(entry["summary"], recalled, recent)
+
+
+def get_last_bot_message(user) -> str:
+    """The bot's most recent message (served from the context cache)."""
+    for _, sender, message in reversed(context_cache.get_context(user.pk)["messages"]):
+        if sender == "bot":
+            return message
+    return ""
+
+
+async def aget_last_bot_message(user) -> str:
+    """Async version of get_last_bot_message"""
+    for _, sender, message in reversed((await context_cache.aget_context(user.pk))["messages"]):
+        if sender == "bot":
+            return message
+    return ""
+
+
+def get_conversation_summary(user) -> str:
+    """Long-term summary text (served from the context cache)."""
+    return context_cache.get_context(user.pk)["summary"]
+
+
+def _unsummarized_messages(user, summary_obj):
+    """Messages newer than the summary's high-water mark, oldest first (capped per refresh)."""
+    batch = getattr(settings, "SUMMARY_MAX_BATCH_MESSAGES", 50)
+    return (
+        ChatHistory.objects.filter(user=user, id__gt=summary_obj.last_message_id)
+        .order_by("id")
+        .values_list("id", "sender", "message")[:batch]
+    )
+
+
+_PENDING_TOTALS = {"count": Count("id"), "chars": Sum(Length("message"))}
+
+
+def _pending_since_watermark(user):
+    watermark = ConversationSummary.objects.filter(user=user).values("last_message_id")
+    return ChatHistory.objects.filter(user=user, id__gt=Coalesce(Subquery(watermark[:1]), Value(0)))
+
+
+def _refresh_due(pending, unsaved_messages) -> bool:
+    count = pending["count"] + len(unsaved_messages)
+    chars = (pending["chars"] or 0) + sum(len(m.message) for m in unsaved_messages)
+    return (
+        count >= getattr(settings, "SUMMARY_EVERY_N_MESSAGES", 6)
+        or tokens_from_chars(chars) >= getattr(settings, "SUMMARY_EVERY_N_TOKENS", 800)
+    )
+
+
+def summary_refresh_due(user, unsaved_messages=()) -> bool:
+    """
+    Refresh policy: summarize once SUMMARY_EVERY_N_MESSAGES messages or
+    SUMMARY_EVERY_N_TOKENS estimated tokens have arrived past the watermark.
+    `unsaved_messages` are ChatHistory instances about to be written.
+    """
+    return _refresh_due(_pending_since_watermark(user).aggregate(**_PENDING_TOTALS), unsaved_messages)
+
+
+async def asummary_refresh_due(user, unsaved_messages=()) -> bool:
+    """Async version of summary_refresh_due"""
+    return _refresh_due(await _pending_since_watermark(user).aaggregate(**_PENDING_TOTALS), unsaved_messages)
+
+
+@metrics.timed("summary_refresh")
 def update_conversation_summary(user, limit=200):
-    from .llm_service import summarize_text
     """
-    Rebuild or update the conversation summary for the user.
+    Fold messages newer than the high-water mark into the user's summary.
     Keeps summary within ~200 words (or given limit).
+    Returns the number of messages summarized.
     """
-    # Get last 15–20 messages for context
-    messages = ChatHistory.objects.filter(user=user).order_by("-timestamp")[:20]
-    messages = list(reversed(messages))
-
-    full_conversation = "\n".join([f"{m.sender}: {m.message}" for m in messages])
+    from .llm_service import summarize_text
 
-    # Get previous summary (if any)
-    prev_summary = ""
     summary_obj, _ = ConversationSummary.objects.get_or_create(user=user)
-    if summary_obj.summary_text:
-        prev_summary = summary_obj.summary_text
+    messages = list(_unsummarized_messages(user, summary_obj))
+    if not messages:
+        return 0
 
-    # Generate new summary
-    updated_summary = summarize_text(full_conversation, existing_summary=prev_summary, word_limit=limit)
+    new_segment = "\n".join(f"{sender}: {message}" for _, sender, message in messages)
 
-    # Save updated summary
-    summary_obj.summary_text = updated_summary
+    # Raises on LLM failure so the watermark only moves after a real refresh
+    summary_obj.summary_text = summarize_text(
+        new_segment, existing_summary=summary_obj.summary_text or "", word_limit=limit, raise_errors=True
+    )
+    summary_obj.last_message_id = messages[-1][0]
+    summary_obj.refreshed_at = timezone.now()
     summary_obj.save()
+    context_cache.set_summary(user.pk, summary_obj.summary_text, summary_obj.last_message_id)
+    return len(messages)
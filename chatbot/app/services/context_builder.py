@@ -0,0 +1,100 @@
+"""
+Token-budget prompt assembly.
+
+Packs the long-term summary, recalled older messages, the recent window and
+the current message into CHAT_PROMPT_TOKEN_BUDGET estimated tokens. The
+current message always goes in. The summary and each individual message are
+capped, and when the budget runs out the oldest messages are dropped first.
+Pure functions only (no DB, no LLM), so the same inputs always give the
+same prompt.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+
+from .token_service import CHARS_PER_TOKEN, estimate_tokens
+
+BuiltPrompt = namedtuple("BuiltPrompt", ["text", "tokens", "recent_count", "recalled_count"])
+
+RECALLED_HEADER = "Relevant earlier messages:"
+ELLIPSIS = "…"
+
+
+def format_message(sender: str, message: str) -> str:
+    """One prompt line, e.g. "User: hi" (messages already carrying a prefix are kept as-is)."""
+    text = (message or "").strip()
+    if not text.lower().startswith(("bot:", "user:")):
+        prefix = "User:" if sender == "user" else "Bot:"
+        text = f"{prefix} {text}"
+    return text
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` so it estimates to at most `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * CHARS_PER_TOKEN - len(ELLIPSIS)].rstrip() + ELLIPSIS
+
+
+def _cost(line: str) -> int:
+    # One separator character per line; summing rounded-up estimates can only
+    # overestimate the total, so the joined prompt never exceeds the budget.
+    return estimate_tokens(line + "\n")
+
+
+def _pack_newest_first(messages, budget: int, message_max_tokens: int):
+    """Lines for the newest messages that fit in `budget`, in chronological order."""
+    lines = []
+    used = 0
+    for _, sender, message in reversed(list(messages)):
+        line = format_message(sender, truncate_to_tokens(message, message_max_tokens))
+        cost = _cost(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    lines.reverse()
+    return lines, used
+
+
+def build_prompt(user_message: str, summary: str = "", recalled=(), recent=(),
+                 budget: int = None, summary_max_tokens: int = None, message_max_tokens: int = None) -> BuiltPrompt:
+    """
+    Assemble the prompt for `user_message` within `budget` tokens.
+    `recalled` and `recent` are chronological (id, sender, message) rows.
+    Priority: current message, summary, recalled messages, then the recent
+    window from the newest message backwards.
+    """
+    budget = budget or getattr(settings, "CHAT_PROMPT_TOKEN_BUDGET", 2000)
+    if summary_max_tokens is None:
+        summary_max_tokens = getattr(settings, "CHAT_PROMPT_SUMMARY_MAX_TOKENS", 400)
+    if message_max_tokens is None:
+        message_max_tokens = getattr(settings, "CHAT_PROMPT_MESSAGE_MAX_TOKENS", 300)
+
+    current = truncate_to_tokens(f"User: {(user_message or '').strip()}", budget)
+    remaining = budget - _cost(current)
+
+    summary = truncate_to_tokens((summary or "").strip(), min(summary_max_tokens, remaining - 1))
+    if summary:
+        remaining -= _cost(summary) + 1  # blank line after the section
+
+    recalled_lines = []
+    if recalled and remaining > _cost(RECALLED_HEADER) + 1:
+        recalled_lines, used = _pack_newest_first(
+            recalled, remaining - _cost(RECALLED_HEADER) - 1, message_max_tokens,
+        )
+        if recalled_lines:
+            remaining -= used + _cost(RECALLED_HEADER) + 1
+
+    recent_lines, _ = _pack_newest_first(recent, remaining, message_max_tokens)
+
+    sections = []
+    if summary:
+        sections.append(summary)
+    if recalled_lines:
+        sections.append("\n".join([RECALLED_HEADER] + recalled_lines))
+    sections.append("\n".join(recent_lines + [current]))
+    text = "\n\n".join(sections)
+    return BuiltPrompt(text, estimate_tokens(text), len(recent_lines), len(recalled_lines))
@@ -0,0 +1,162 @@
+"""
+Per-user prompt context cache.
+
+Each entry holds a user's recent message window and long-term summary, so
+assembling a prompt for an active conversation needs no database reads.
+Writers (ChatTurn.commit, save_chat, update_conversation_summary) update
+entries in place after their DB write succeeds; anything that rewrites
+history behind their back (archiving, purges) calls `invalidate`.
+Eviction is LRU with a TTL, via the Django cache alias in
+CHAT_CONTEXT_CACHE_ALIAS (LocMemCache by default).
+
+The default cache is per process, so a summary refreshed by another process
+(e.g. `run_summary_worker`) never reaches this one through set_summary.
+Entries therefore record the summary's watermark (ConversationSummary.
+last_message_id) and re-check it against the database at most every
+CHAT_CONTEXT_SUMMARY_RECHECK_SECONDS — one indexed read per active user.
+
+Read-modify-write updates run under a striped per-user lock, and a loader
+only stores its entry if no write for that stripe happened while it was
+reading the database, so concurrent turns can't drop each other's messages.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from ..models import ChatHistory, ConversationSummary
+
+_LOCK_STRIPES = 64
+
+
+class _Stripe:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = 0  # bumped by every in-place update; loaders compare before storing
+
+
+_stripes = [_Stripe() for _ in range(_LOCK_STRIPES)]
+
+
+def _stripe(user_id) -> _Stripe:
+    return _stripes[hash(user_id) % _LOCK_STRIPES]
+
+
+def _cache():
+    return caches[getattr(settings, "CHAT_CONTEXT_CACHE_ALIAS", "default")]
+
+
+def _window():
+    return getattr(settings, "CHAT_CONTEXT_WINDOW", 20)
+
+
+def _recheck_seconds():
+    return getattr(settings, "CHAT_CONTEXT_SUMMARY_RECHECK_SECONDS", 30)
+
+
+def _key(user_id):
+    return f"chat-context:{user_id}"
+
+
+def _summary_fields(row):
+    """Entry fields for a ConversationSummary (watermark, text) row, or None if there is none."""
+    watermark, text = row or (None, "")
+    return {"summary": text or "", "watermark": watermark, "checked_at": time.time()}
+
+
+def _summary_row(user_id):
+    return ConversationSummary.objects.filter(user_id=user_id).values_list("last_message_id", "summary_text")
+
+
+def _load(user_id):
+    recent = ChatHistory.objects.filter(user_id=user_id).order_by("-timestamp", "-id")
+    messages = [list(row) for row in recent.values_list("id", "sender", "message")[:_window()]]
+    messages.reverse()
+    return {"messages": messages, **_summary_fields(_summary_row(user_id).first())}
+
+
+async def _aload(user_id):
+    recent = ChatHistory.objects.filter(user_id=user_id).order_by("-timestamp", "-id")
+    messages = [list(row) async for row in recent.values_list("id", "sender", "message")[:_window()]]
+    messages.reverse()
+    return {"messages": messages, **_summary_fields(await _summary_row(user_id).afirst())}
+
+
+def _summary_unchecked(entry) -> bool:
+    return time.time() - entry.get("checked_at", 0) >= _recheck_seconds()
+
+
+def _store(user_id, entry, writes_seen):
+    """Cache a freshly read entry unless an update for this stripe raced the read."""
+    stripe = _stripe(user_id)
+    with stripe.lock:
+        if stripe.writes == writes_seen:
+            _cache().set(_key(user_id), entry)
+
+
+def get_context(user_id) -> dict:
+    """
+    {"messages": [[id, sender, message], ...] (chronological), "summary": str}
+    Loaded from the database only on a cache miss; the summary is re-checked
+    against the database when the entry hasn't verified it recently.
+    """
+    entry = _cache().get(_key(user_id))
+    if entry is not None and not _summary_unchecked(entry):
+        return entry
+
+    writes_seen = _stripe(user_id).writes
+    if entry is None:
+        entry = _load(user_id)
+    else:
+        entry.update(_summary_fields(_summary_row(user_id).first()))
+    _store(user_id, entry, writes_seen)
+    return entry
+
+
+async def aget_context(user_id) -> dict:
+    """Async version of get_context"""
+    entry = await _cache().aget(_key(user_id))
+    if entry is not None and not _summary_unchecked(entry):
+        return entry
+
+    writes_seen = _stripe(user_id).writes
+    if entry is None:
+        entry = await _aload(user_id)
+    else:
+        entry.update(_summary_fields(await _summary_row(user_id).afirst()))
+    _store(user_id, entry, writes_seen)
+    return entry
+
+
+def append_messages(user_id, rows):
+    """Add freshly written (id, sender, message) rows to a cached window."""
+    stripe = _stripe(user_id)
+    with stripe.lock:
+        stripe.writes += 1
+        entry = _cache().get(_key(user_id))
+        if entry is None:
+            return  # next read loads from the DB, which already has the rows
+        known = {message[0] for message in entry["messages"]}
+        fresh = [list(row) for row in rows if row[0] not in known]
+        entry["messages"] = (entry["messages"] + fresh)[-_window():]
+        _cache().set(_key(user_id), entry)
+
+
+def set_summary(user_id, summary_text, watermark):
+    """Replace the cached summary after a refresh that covered messages up to `watermark`."""
+    stripe = _stripe(user_id)
+    with stripe.lock:
+        stripe.writes += 1
+        entry = _cache().get(_key(user_id))
+        if entry is None:
+            return
+        entry.update(_summary_fields((watermark, summary_text)))
+        _cache().set(_key(user_id), entry)
+
+
+def invalidate(user_id):
+    stripe = _stripe(user_id)
+    with stripe.lock:
+        stripe.writes += 1
+        _cache().delete(_key(user_id))
@@ -0,0 +1,68 @@
+"""
+Local text embeddings (no network).
+
+A hashing-trick vectorizer: normalized word unigrams and bigrams are hashed
+into a fixed number of signed buckets and the vector is L2-normalized, so
+the dot product of two embeddings is their cosine similarity.
+"""
+import re
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOPWORDS = frozenset(
+    "a an the to of for and or in on at is are be can do does should what which how much many "
+    "with without from by as about into some any".split()
+)
+
+BIGRAM_WEIGHT = 0.5
+
+
+def embedding_dim() -> int:
+    return getattr(settings, "EMBEDDING_DIM", 512)
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens with a light plural/suffix strip ("workouts" → "workout")."""
+    tokens = []
+    for token in TOKEN_RE.findall((text or "").lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _bucket(feature: str, dim: int):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dim, (1.0 if (h >> 31) & 1 else -1.0)
+
+
+def embed_text(text: str, dim: int = None) -> np.ndarray:
+    """Embed one text as a unit-length float32 vector (all zeros if it has no words)."""
+    dim = dim or embedding_dim()
+    vec = np.zeros(dim, dtype=np.float32)
+
+    tokens = tokenize(text)
+    content = [t for t in tokens if t not in STOPWORDS] or tokens
+    for token in content:
+        index, sign = _bucket(token, dim)
+        vec[index] += sign
+    for left, right in zip(tokens, tokens[1:]):
+        index, sign = _bucket(f"{left} {right}", dim)
+        vec[index] += sign * BIGRAM_WEIGHT
+
+    norm = np.linalg.norm(vec)
+    if norm:
+        vec /= norm
+    return vec
+
+
+def embed_texts(texts, dim: int = None) -> np.ndarray:
+    """Embed several texts as rows of a (len(texts), dim) float32 matrix."""
+    dim = dim or embedding_dim()
+    if not texts:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.vstack([embed_text(text, dim) for text in texts])
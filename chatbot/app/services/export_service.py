@@ -0,0 +1,183 @@
+"""
+Streaming bulk export of chat history (manage.py export_chat_history and the
+staff-only chat_export_api endpoint).
+
+Messages moved to archived segments (archive_service) come first: matching
+segments are read a few at a time and decoded one by one. Then the hot
+ChatHistory table is read in keyset pages on id, each page streamed from the
+cursor with .iterator(chunk_size=...) and only the exported columns
+selected. Rows are encoded as NDJSON or CSV and gzip-compressed
+incrementally. Memory use stays constant however many rows are exported,
+and no single read holds the database for the whole export.
+"""
+import csv
+import io
+import json as pyjson
+import zlib
+from collections import namedtuple
+from datetime import datetime, time as dt_time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from ..models import ChatArchiveSegment, ChatHistory
+from .archive_service import decode_segment
+
+EXPORT_COLUMNS = ("id", "user_id", "sender", "message", "timestamp")
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+ARCHIVE_SEGMENTS_PER_PAGE = 8  # each holds up to CHAT_ARCHIVE_SEGMENT_SIZE messages
+
+ExportFilters = namedtuple("ExportFilters", ["user_ids", "since", "until", "sender"])
+
+
+# -------------------------
+# Filters
+# -------------------------
+def _parse_moment(value, end_of_day=False):
+    """ISO datetime or date (a bare `until` date includes that whole day); aware in the current timezone."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date/time: {value!r}")
+        moment = datetime.combine(day, dt_time.max if end_of_day else dt_time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_export_filters(user=None, since=None, until=None, sender=None) -> ExportFilters:
+    """Build ExportFilters from raw strings (query params / CLI options). Raises ValueError."""
+    user_ids = None
+    if user:
+        try:
+            user_ids = [int(part) for part in str(user).split(",") if part.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid user id list: {user!r}")
+    if sender and sender not in ("user", "bot"):
+        raise ValueError(f"Invalid sender: {sender!r} (expected user or bot)")
+    return ExportFilters(
+        user_ids=user_ids,
+        since=_parse_moment(since) if since else None,
+        until=_parse_moment(until, end_of_day=True) if until else None,
+        sender=sender or None,
+    )
+
+
+def _filtered(filters: ExportFilters):
+    rows = ChatHistory.objects.all()
+    if filters.user_ids:
+        rows = rows.filter(user_id__in=filters.user_ids)
+    if filters.since:
+        rows = rows.filter(timestamp__gte=filters.since)
+    if filters.until:
+        rows = rows.filter(timestamp__lte=filters.until)
+    if filters.sender:
+        rows = rows.filter(sender=filters.sender)
+    return rows
+
+
+def _filtered_segments(filters: ExportFilters):
+    """Archived segments that may hold matching messages (sender is checked per message)."""
+    segments = ChatArchiveSegment.objects.all()
+    if filters.user_ids:
+        segments = segments.filter(user_id__in=filters.user_ids)
+    if filters.since:
+        segments = segments.filter(last_timestamp__gte=filters.since)
+    if filters.until:
+        segments = segments.filter(first_timestamp__lte=filters.until)
+    return segments
+
+
+def _matches(record, filters: ExportFilters) -> bool:
+    if filters.since and record["timestamp"] < filters.since:
+        return False
+    if filters.until and record["timestamp"] > filters.until:
+        return False
+    return not filters.sender or record["sender"] == filters.sender
+
+
+# -------------------------
+# Rows
+# -------------------------
+def _keyset(rows, field, batch_size):
+    """Yield values_list rows (`field` first) in `field` order, one keyset page per query."""
+    rows = rows.order_by(field)
+    last = None
+    while True:
+        page = rows if last is None else rows.filter(**{f"{field}__gt": last})
+        count = 0
+        for row in page[:batch_size].iterator(chunk_size=batch_size):
+            count += 1
+            last = row[0]
+            yield row
+        if count < batch_size:
+            return
+
+
+def iter_archived_rows(filters: ExportFilters):
+    """Yield export tuples from matching archived segments, in segment order."""
+    segments = _filtered_segments(filters).values_list("first_message_id", "user_id", "payload")
+    for _, user_id, payload in _keyset(segments, "first_message_id", ARCHIVE_SEGMENTS_PER_PAGE):
+        for record in decode_segment(payload):
+            if _matches(record, filters):
+                yield record["id"], user_id, record["sender"], record["message"], record["timestamp"]
+
+
+def iter_chat_rows(filters: ExportFilters, batch_size=2000):
+    """
+    Yield (id, user_id, sender, message, timestamp) tuples: archived messages
+    first, then the hot table in id order, one keyset page at a time.
+    """
+    yield from iter_archived_rows(filters)
+    yield from _keyset(_filtered(filters).values_list(*EXPORT_COLUMNS), "id", batch_size)
+
+
+# -------------------------
+# Encoding
+# -------------------------
+def _ndjson_lines(rows):
+    for mid, user_id, sender, message, ts in rows:
+        yield pyjson.dumps(
+            {"id": mid, "user_id": user_id, "sender": sender, "message": message, "timestamp": ts.isoformat()},
+            ensure_ascii=False,
+        ) + "\n"
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for mid, user_id, sender, message, ts in rows:
+        writer.writerow((mid, user_id, sender, message, ts.isoformat()))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()  # the header, if there were no rows
+
+
+def encode_rows(rows, fmt):
+    """Text lines for `rows` in `fmt` (ndjson or csv)."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt!r}")
+    return _ndjson_lines(rows) if fmt == "ndjson" else _csv_lines(rows)
+
+
+def gzip_chunks(lines, flush_bytes=64 * 1024):
+    """Gzip-compress an iterable of text lines, yielding compressed chunks of roughly `flush_bytes` input."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    pending, size = [], 0
+    for line in lines:
+        data = line.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+        if size >= flush_bytes:
+            chunk = compressor.compress(b"".join(pending))
+            pending, size = [], 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(b"".join(pending)) + compressor.flush()
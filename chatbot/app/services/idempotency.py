@@ -0,0 +1,240 @@
+"""
+Idempotency keys and single-flight deduplication for chat requests.
+
+- A client may send an idempotency key per message (Idempotency-Key header
+  or "idempotency_key" in the JSON body). Once that request completes its
+  reply is stored in the cache for CHAT_IDEMPOTENCY_TTL seconds, and a
+  retry with the same key replays it without another LLM call or
+  ChatHistory write. Reusing a key for a different message is an error
+  (IdempotencyKeyReused, 422) rather than a replay of the other reply.
+- Identical messages from the same user that are in flight at the same
+  time (double-clicks, timeout retries racing the original) join the first
+  request's result instead of starting their own turn. This works with or
+  without a key, and within this process only. A duplicate that outwaits
+  CHAT_IDEMPOTENCY_WAIT_SECONDS gets DuplicateInProgress (409, Retry-After).
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .. import metrics
+from .admission import AdmissionError
+
+MAX_KEY_LENGTH = 128
+
+RequestKey = namedtuple("RequestKey", ["flight", "cache", "digest"])
+
+dedup_hits = metrics.registry.counter(
+    "chatbot_chat_dedup_total", "Chat requests answered by idempotent replay or by joining an in-flight duplicate.",
+)
+
+
+class IdempotencyKeyError(ValueError):
+    status = 400
+
+
+class IdempotencyKeyReused(IdempotencyKeyError):
+    status = 422
+
+    def __init__(self):
+        super().__init__("This idempotency key was already used for a different message.")
+
+
+class DuplicateInProgress(AdmissionError):
+    """A duplicate gave up waiting for the original request to finish."""
+    status = 409
+    reason = "duplicate_in_progress"
+
+    def __init__(self, retry_after=5):
+        super().__init__("⏳ I'm still answering that message. Please try again in a moment.", retry_after)
+
+
+def _cache():
+    return caches[getattr(settings, "CHAT_IDEMPOTENCY_CACHE_ALIAS", "default")]
+
+
+def request_key(request, data, user, message):
+    """
+    The RequestKey for this chat request, or None when it cannot be scoped
+    to a user or session. Raises IdempotencyKeyError for an invalid key.
+    """
+    client_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    if client_key is not None:
+        client_key = str(client_key).strip()
+        if not client_key or len(client_key) > MAX_KEY_LENGTH:
+            raise IdempotencyKeyError(f"Idempotency key must be 1-{MAX_KEY_LENGTH} characters.")
+
+    if user is not None:
+        scope = f"user:{user.pk}"
+    elif request.session.session_key:
+        scope = f"session:{request.session.session_key}"
+    else:
+        return None
+
+    digest = hashlib.sha1(message.encode("utf-8")).hexdigest()
+    return RequestKey(
+        flight=f"{scope}:{digest}",
+        cache=f"chat-idempotency:{scope}:{client_key}" if client_key else None,
+        digest=digest,
+    )
+
+
+# -------------------------
+# Completed requests
+# -------------------------
+def replay(key):
+    """
+    The stored response payload for a completed key, or None.
+    Raises IdempotencyKeyReused if the key was stored for a different message.
+    """
+    if key is None or key.cache is None:
+        return None
+    stored = _cache().get(key.cache)
+    if stored is None:
+        return None
+    digest, payload = stored
+    if digest != key.digest:
+        raise IdempotencyKeyReused()
+    dedup_hits.inc(kind="replay")
+    return payload
+
+
+def _remember(key, payload):
+    if key is not None and key.cache is not None:
+        _cache().set(key.cache, (key.digest, payload), getattr(settings, "CHAT_IDEMPOTENCY_TTL", 24 * 60 * 60))
+
+
+# -------------------------
+# Single-flight
+# -------------------------
+class SingleFlight:
+    """
+    At most one in-flight call per key; concurrent callers share its Future.
+    A flight older than `max_age` seconds is treated as abandoned (e.g. a
+    streaming response that was never consumed) and replaced.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> (future, started_at)
+
+    def begin(self, key):
+        """(is_leader, future). The leader must call finish() or fail()."""
+        now = time.monotonic()
+        max_age = self.max_age if self.max_age is not None else _wait_seconds()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and now - flight[1] < max_age:
+                return False, flight[0]
+            future = Future()
+            self._flights[key] = (future, now)
+            return True, future
+
+    def _pop(self, key):
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        return flight[0] if flight else None
+
+    def finish(self, key, result):
+        future = self._pop(key)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def fail(self, key, error):
+        future = self._pop(key)
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+
+flights = SingleFlight()
+
+
+def _wait_seconds():
+    return getattr(settings, "CHAT_IDEMPOTENCY_WAIT_SECONDS", 120)
+
+
+def begin(key):
+    """
+    Start handling `key`. Returns (is_leader, future); followers should wait
+    on the future (see wait / await_result) instead of handling the request.
+    """
+    if key is None:
+        return True, None
+    leader, future = flights.begin(key.flight)
+    if not leader:
+        dedup_hits.inc(kind="joined")
+    return leader, future
+
+
+def finish(key, payload):
+    """Record the leader's response: stored for replay and handed to followers."""
+    if key is not None:
+        _remember(key, payload)
+        flights.finish(key.flight, payload)
+
+
+def fail(key, error):
+    if key is not None:
+        flights.fail(key.flight, error)
+
+
+def wait(key, future):
+    """Follower: block until the leader's payload is ready (and keep it under our own key)."""
+    try:
+        payload = future.result(timeout=_wait_seconds())
+    except TimeoutError:
+        raise DuplicateInProgress() from None
+    _remember(key, payload)
+    return payload
+
+
+async def await_result(key, future):
+    """Async version of wait"""
+    try:
+        payload = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=_wait_seconds())
+    except TimeoutError:
+        raise DuplicateInProgress() from None
+    await sync_to_async(_remember)(key, payload)
+    return payload
+
+
+def run_once(key, handler):
+    """Replay, join or run `handler()` for `key`; returns the response payload."""
+    payload = replay(key)
+    if payload is not None:
+        return payload
+    leader, future = begin(key)
+    if not leader:
+        return wait(key, future)
+    try:
+        payload = handler()
+    except Exception as e:
+        fail(key, e)
+        raise
+    finish(key, payload)
+    return payload
+
+
+async def arun_once(key, handler):
+    """Async version of run_once (`handler` is an async callable)."""
+    payload = await sync_to_async(replay)(key)
+    if payload is not None:
+        return payload
+    leader, future = begin(key)
+    if not leader:
+        return await await_result(key, future)
+    try:
+        payload = await handler()
+    except BaseException as e:
+        fail(key, e if isinstance(e, Exception) else RuntimeError("Request cancelled"))
+        raise
+    await sync_to_async(finish)(key, payload)
+    return payload
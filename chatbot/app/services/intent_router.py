@@ -0,0 +1,142 @@
+"""
+Local intent router, consulted before any LLM call.
+
+Greetings, thanks, acknowledgements and goodbyes are matched with compiled
+regexes. Questions about the bot itself are matched against the CHAT_FAQ
+table by local embedding similarity; a message only matches an example
+that covers all of its content words, so "how can you help me lose weight"
+is not taken for "how can you help me". Either way the canned reply is served
+directly. Everything else returns None and goes to the LLM as before, as
+do acknowledgements that answer a question the bot just asked ("ok" after
+"Want me to build you a plan?").
+Every routing decision is counted in chatbot_intent_router_total.
+"""
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+from .. import metrics
+from .embedding_service import STOPWORDS, embed_text, embedding_dim, tokenize
+
+IntentMatch = namedtuple("IntentMatch", ["intent", "reply"])
+
+# Optional "there" / "coach" / "so much" style words, punctuation and emoji after the keyword
+_TAIL = (
+    r"(?:\s+(?:there|bot|coach|fitnessbot|buddy|mate|again|so much|a lot|a ton))*"
+    r"\s*[!.?]*\s*(?:[\U0001F300-\U0001FAFF☀-➿]\s*)*$"
+)
+
+INTENT_PATTERNS = [
+    ("greeting", re.compile(
+        r"^(?:hi+|hello+|hey+|hiya|howdy|yo|sup|good\s+(?:morning|afternoon|evening)|greetings)" + _TAIL,
+        re.IGNORECASE,
+    )),
+    ("thanks", re.compile(r"^(?:thanks|thank\s+you|thx|ty|cheers|much\s+appreciated)" + _TAIL, re.IGNORECASE)),
+    ("ack", re.compile(
+        r"^(?:ok(?:ay)?|k|cool|great|nice|perfect|awesome|alright|all\s+right|got\s+it|sounds\s+good|"
+        r"understood|noted|👍|👌)" + _TAIL,
+        re.IGNORECASE,
+    )),
+    ("goodbye", re.compile(
+        r"^(?:bye+|goodbye|see\s+(?:you|ya)(?:\s+later)?|good\s*night|later|cya|take\s+care)" + _TAIL,
+        re.IGNORECASE,
+    )),
+]
+
+# Intents that may be answering the bot's last question, which the LLM must see
+CONTEXTUAL_INTENTS = frozenset({"ack", "thanks"})
+
+DEFAULT_INTENT_REPLIES = {
+    "greeting": "Hey! 💪 What would you like to work on today — training, nutrition or recovery?",
+    "thanks": "You're welcome! Let me know if there's anything else I can help with. 💪",
+    "ack": "👍 Anything else you'd like to know?",
+    "goodbye": "Bye for now! Keep up the great work. 💪",
+}
+
+# Words that may pad an FAQ question without changing it ("hey, what can you do exactly?")
+FAQ_FILLER_WORDS = frozenset("hey hi hello please so exactly actually really there bot coach fitnessbot".split())
+
+intent_hits = metrics.registry.counter(
+    "chatbot_intent_router_total", "Messages handled by the local intent router, by intent (\"llm\" = passed on).",
+)
+
+
+def _content_words(text) -> frozenset:
+    return frozenset(tokenize(text)) - STOPWORDS
+
+
+class FAQMatcher:
+    """
+    Embedding nearest-neighbour lookup over the CHAT_FAQ example questions.
+    The best example at or above `threshold` that contains every content
+    word of the message wins; anything the examples don't cover goes to the LLM.
+    """
+
+    def __init__(self, entries, threshold):
+        self.threshold = threshold
+        self.names, self.answers, self.words, vectors = [], [], [], []
+        for entry in entries:
+            for question in entry["questions"]:
+                self.names.append(entry["name"])
+                self.answers.append(entry["answer"])
+                self.words.append(_content_words(question))
+                vectors.append(embed_text(question))
+        self.matrix = np.vstack(vectors) if vectors else np.zeros((0, embedding_dim()), dtype=np.float32)
+
+    def match(self, message: str):
+        if not len(self.names):
+            return None
+        vec = embed_text(message)
+        if not vec.any():
+            return None
+        words = _content_words(message) - FAQ_FILLER_WORDS
+        scores = self.matrix @ vec
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for index in candidates[np.argsort(-scores[candidates])]:
+            if words <= self.words[index]:
+                return IntentMatch(f"faq:{self.names[index]}", self.answers[index])
+        return None
+
+
+_faq = None
+_faq_config = None
+_faq_lock = threading.Lock()
+
+
+def _faq_matcher() -> FAQMatcher:
+    """Built once per CHAT_FAQ / CHAT_FAQ_THRESHOLD value."""
+    global _faq, _faq_config
+    config = (id(getattr(settings, "CHAT_FAQ", [])), getattr(settings, "CHAT_FAQ_THRESHOLD", 0.75))
+    with _faq_lock:
+        if _faq is None or _faq_config != config:
+            _faq = FAQMatcher(getattr(settings, "CHAT_FAQ", []), config[1])
+            _faq_config = config
+        return _faq
+
+
+def match_intent(message: str, last_bot_message: str = ""):
+    """The IntentMatch for `message`, or None if it needs the LLM."""
+    text = (message or "").strip()
+    if not text:
+        return None
+
+    replies = {**DEFAULT_INTENT_REPLIES, **getattr(settings, "CHAT_INTENT_REPLIES", {})}
+    bot_asked = (last_bot_message or "").rstrip().endswith("?")
+    for intent, pattern in INTENT_PATTERNS:
+        if pattern.match(text) and replies.get(intent):
+            if intent in CONTEXTUAL_INTENTS and bot_asked:
+                return None
+            return IntentMatch(intent, replies[intent])
+    return _faq_matcher().match(text)
+
+
+def route_message(message: str, last_bot_message: str = ""):
+    """match_intent plus per-intent hit metrics. Disabled by CHAT_INTENT_ROUTER_ENABLED = False."""
+    if not getattr(settings, "CHAT_INTENT_ROUTER_ENABLED", True):
+        return None
+    match = match_intent(message, last_bot_message)
+    intent_hits.inc(intent=match.intent if match else "llm")
+    return match
@@ -0,0 +1,212 @@
+"""
+Pluggable LLM backends.
+
+model_router asks the configured backend (LLM_BACKEND) for one chat model
+per tier. Every backend hands out objects with the LangChain chat-model
+surface used by llm_service: invoke / ainvoke / stream / astream.
+
+- "gemini": ChatGoogleGenerativeAI, created on first use (GOOGLE_API_KEY
+  is only required once a real call is made, not at import time).
+- "fake": a local, seeded model for load tests and benchmarks. It simulates
+  a log-normal latency distribution, chunked streaming and a configurable
+  share of malformed JSON replies.
+- "recorded": replays replies recorded by `manage.py replay_chats --output`,
+  so a conversation replay is reproducible across commits.
+"""
+import asyncio
+import json as pyjson
+import math
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+load_dotenv()
+
+
+class LLMBackend:
+    name = None
+
+    def chat_model(self, tier: str, config: dict):
+        """A chat model for `tier`, configured by its LLM_MODEL_TIERS entry."""
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def chat_model(self, tier, config):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        if not os.getenv("GOOGLE_API_KEY"):
+            raise ImproperlyConfigured("⚠️ GOOGLE_API_KEY not found. Add it to .env")
+        return ChatGoogleGenerativeAI(**config)
+
+
+# -------------------------
+# Fake backend
+# -------------------------
+FAKE_DEFAULTS = {
+    "latency_ms": 800,          # median first-byte latency
+    "latency_sigma": 0.5,       # log-normal spread (p95 ≈ median * e^(1.645 * sigma))
+    "chunk_count": 8,           # streamed chunks per reply
+    "chunk_delay_ms": 30,
+    "malformed_rate": 0.05,     # share of replies that are not valid JSON
+    "seed": 42,
+}
+
+
+class FakeChatModel:
+    """Deterministic stand-in for a Gemini chat model."""
+
+    def __init__(self, model="fake", latency_ms=800, latency_sigma=0.5, chunk_count=8,
+                 chunk_delay_ms=30, malformed_rate=0.05, seed=42, **_):
+        self.model = model
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.chunk_count = max(1, chunk_count)
+        self.chunk_delay_ms = chunk_delay_ms
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(f"{seed}:{model}")
+        self._lock = threading.Lock()
+
+    # Simulation
+    def _latency(self) -> float:
+        if not self.latency_ms:
+            return 0.0
+        with self._lock:
+            factor = math.exp(self._random.gauss(0, self.latency_sigma)) if self.latency_sigma else 1.0
+        return self.latency_ms * factor / 1000
+
+    def _malformed(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.malformed_rate
+
+    @staticmethod
+    def _last_text(messages) -> str:
+        if isinstance(messages, str):
+            return messages
+        return messages[-1].content if messages else ""
+
+    @staticmethod
+    def _wants_json(messages) -> bool:
+        return not isinstance(messages, str) and any("JSON" in m.content for m in messages[:-1])
+
+    def _reply_text(self, messages) -> str:
+        prompt = self._last_text(messages)
+        if isinstance(messages, str):  # summaries are sent as a bare prompt
+            return f"Summary of {len(prompt.splitlines())} lines of conversation."
+        question = prompt.rsplit("User:", 1)[-1].strip()[:80]
+        reply = f"Here is some fitness advice about: {question}"
+        if not self._wants_json(messages):
+            return reply
+        if self._malformed():
+            return '```json\n{"reply": "' + reply  # truncated, unparseable
+        return "```json\n" + pyjson.dumps({"reply": reply, "intent": "advice", "code": None}) + "\n```"
+
+    def _chunks(self, text):
+        size = max(1, math.ceil(len(text) / self.chunk_count))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    # LangChain chat-model surface
+    def invoke(self, messages, *args, **kwargs):
+        time.sleep(self._latency())
+        return AIMessage(content=self._reply_text(messages))
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        await asyncio.sleep(self._latency())
+        return AIMessage(content=self._reply_text(messages))
+
+    def stream(self, messages, *args, **kwargs):
+        time.sleep(self._latency())
+        for chunk in self._chunks(self._reply_text(messages)):
+            yield AIMessageChunk(content=chunk)
+            time.sleep(self.chunk_delay_ms / 1000)
+
+    async def astream(self, messages, *args, **kwargs):
+        await asyncio.sleep(self._latency())
+        for chunk in self._chunks(self._reply_text(messages)):
+            yield AIMessageChunk(content=chunk)
+            await asyncio.sleep(self.chunk_delay_ms / 1000)
+
+
+class FakeBackend(LLMBackend):
+    name = "fake"
+
+    def chat_model(self, tier, config):
+        options = dict(FAKE_DEFAULTS, **getattr(settings, "LLM_FAKE_BACKEND", {}))
+        return FakeChatModel(model=config.get("model", tier), **options)
+
+
+# -------------------------
+# Recorded backend
+# -------------------------
+def recording_key(message: str) -> str:
+    return " ".join((message or "").split()).lower()
+
+
+def load_recording(path) -> dict:
+    """{normalized user message: reply} from an NDJSON file of {"message", "reply"} records."""
+    replies = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = pyjson.loads(line)
+                if record.get("message") and record.get("reply") is not None:
+                    replies.setdefault(recording_key(record["message"]), record["reply"])
+    return replies
+
+
+class RecordedChatModel(FakeChatModel):
+    """
+    Replays recorded replies, looked up by the current user message, with
+    the fake model's latency and chunking. Unrecorded messages (and
+    summaries) get the fake model's generated reply.
+    """
+
+    def __init__(self, replies, **options):
+        super().__init__(**options)
+        self.replies = replies
+        self.misses = 0
+
+    def _reply_text(self, messages) -> str:
+        if isinstance(messages, str):
+            return super()._reply_text(messages)
+        question = self._last_text(messages).rsplit("User:", 1)[-1]
+        reply = self.replies.get(recording_key(question))
+        if reply is None:
+            with self._lock:
+                self.misses += 1
+            return super()._reply_text(messages)
+        if not self._wants_json(messages):
+            return reply
+        return pyjson.dumps({"reply": reply, "intent": "recorded", "code": None})
+
+
+class RecordedBackend(LLMBackend):
+    """LLM_RECORDED_BACKEND = {"path": <NDJSON recording>, ...fake backend options}."""
+    name = "recorded"
+
+    def chat_model(self, tier, config):
+        options = dict(FAKE_DEFAULTS, **getattr(settings, "LLM_FAKE_BACKEND", {}))
+        options.update(getattr(settings, "LLM_RECORDED_BACKEND", {}))
+        path = options.pop("path", None)
+        if not path:
+            raise ImproperlyConfigured("LLM_BACKEND 'recorded' needs LLM_RECORDED_BACKEND['path']")
+        return RecordedChatModel(load_recording(path), model=config.get("model", tier), **options)
+
+
+BACKENDS = {backend.name: backend for backend in (GeminiBackend, FakeBackend, RecordedBackend)}
+
+
+def get_backend(name=None) -> LLMBackend:
+    name = name or getattr(settings, "LLM_BACKEND", "gemini")
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown LLM_BACKEND {name!r}; expected one of {sorted(BACKENDS)}")
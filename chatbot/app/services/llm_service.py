@@ -1,68 +1,236 @@
-import os
-import json as pyjson
-from langchain_google_genai import ChatGoogleGenerativeAI
+import contextvars
+import logging
 from langchain.prompts import ChatPromptTemplate
-from dotenv import load_dotenv
-from .chat_service import get_recent_chat_context
+from .. import metrics
+from .chat_service import (
+    get_prompt_context, aget_prompt_context, get_last_bot_message, aget_last_bot_message,
+)
+from .intent_router import route_message
+from .context_builder import build_prompt
+from . import admission, model_router
+from .model_router import record_call
+from .reply_parser import ReplyStreamExtractor, clean_reply_text, normalize_reply
+from .reply_cache import get_reply_cache, is_cacheable_question
 
-# Load environment variables
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+logger = logging.getLogger(__name__)
 
-if not GOOGLE_API_KEY:
-    raise ValueError("⚠️ GOOGLE_API_KEY not found. Add it to .env")
+# A list set by the replay harness (manage.py replay_chats): every BuiltPrompt
+# assembled while it is set is appended, so prompt sizes can be reported per turn.
+prompt_observer = contextvars.ContextVar("chatbot_prompt_observer", default=None)
 
-# Initialize Gemini model
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-pro",  # ✅ make sure this matches ListModels result
-    temperature=0
-)
+# Chat models are created per tier by model_router (LLM_BACKEND, LLM_MODEL_TIERS)
 
-# Structured prompt to enforce JSON output
+# Structured prompt to enforce JSON output. "reply" comes first so streamed
+# turns can show it while the rest of the object is generated (reply_parser).
 structured_prompt = ChatPromptTemplate.from_messages([
     ("system", """You are a friendly fitness chatbot.
-    Always reply in JSON format with:
+    Always reply with a JSON object with these keys, in this order:
+    - reply: (a natural first-person reply you would say directly to the user)
     - intent: (what the user wants)
     - code: (any code you generate or extract, else null)
-    - reply: (a natural first-person reply you would say directly to the user)
     """),
     ("human", "{user_input}")
 ])
 
 
-def process_user_message(user_message: str, user=None) -> str:
+@metrics.timed("prompt_build")
+def build_combined_prompt(user_message: str, user=None) -> str:
+    """
+    Combine the long-term summary, recalled older messages, short-term
+    memory and the current message within CHAT_PROMPT_TOKEN_BUDGET.
+    (The current message is only written to ChatHistory when the turn commits.)
+    """
+    if not user:
+        return _log_prompt(build_prompt(user_message))
+    context = get_prompt_context(user, user_message)
+    return _log_prompt(build_prompt(user_message, context.summary, context.recalled, context.recent))
+
+
+@metrics.timed("prompt_build")
+async def abuild_combined_prompt(user_message: str, user=None) -> str:
+    """
+    Async version of build_combined_prompt.
+    """
+    if not user:
+        return _log_prompt(build_prompt(user_message))
+    context = await aget_prompt_context(user, user_message)
+    return _log_prompt(build_prompt(user_message, context.summary, context.recalled, context.recent))
+
+
+def _log_prompt(prompt) -> str:
+    metrics.prompt_tokens.observe(prompt.tokens)
+    observed = prompt_observer.get()
+    if observed is not None:
+        observed.append(prompt)
+    logger.debug(
+        "Prompt: %d tokens (%d recent, %d recalled messages)\n%s",
+        prompt.tokens, prompt.recent_count, prompt.recalled_count, prompt.text,
+    )
+    return prompt.text
+
+
+def _shared_reply_cache(user_message: str):
+    """The semantic reply cache if this message may use it, else None."""
+    reply_cache = get_reply_cache()
+    if reply_cache is not None and is_cacheable_question(user_message):
+        return reply_cache
+    return None
+
+
+def _local_reply(user_message: str, user=None):
+    """Canned reply from the intent router, or None if the message needs the LLM."""
+    match = route_message(user_message, get_last_bot_message(user) if user else "")
+    return match.reply if match else None
+
+
+async def _alocal_reply(user_message: str, user=None):
+    """Async version of _local_reply"""
+    match = route_message(user_message, await aget_last_bot_message(user) if user else "")
+    return match.reply if match else None
+
+
+def process_user_message(user_message: str, user=None, rate_key=None) -> str:
     """
     Send message + short-term memory + long-term summary to Gemini.
+    Greetings, acknowledgements and FAQ questions are answered locally, and
+    general questions from the semantic reply cache when possible; only turns
+    that reach the LLM are charged to `rate_key`'s chat rate limit.
+    Raises admission.AdmissionError when the LLM is saturated or over quota,
+    or the rate limit is exceeded.
     """
-    memory_context = ""
-    long_term_summary = ""
+    local = _local_reply(user_message, user)
+    if local is not None:
+        return local
 
-    if user:
-        memory_context = get_recent_chat_context(user, limit=5)
-        try:
-            long_term_summary = user.summary.summary_text or ""
-        except Exception:
-            long_term_summary = ""
+    reply_cache = _shared_reply_cache(user_message)
+    if reply_cache is not None:
+        cached = reply_cache.lookup(user_message)
+        if cached is not None:
+            return cached
+        user = None  # shared replies must not depend on this user's history
 
-    combined_prompt = f"{long_term_summary}\n\n{memory_context}"
+    admission.check_chat_rate(rate_key)
+    combined_prompt = build_combined_prompt(user_message, user)
+    route = model_router.classify(user_message, combined_prompt)
+
+    messages = structured_prompt.format_messages(user_input=combined_prompt)
+    with admission.llm_slot(), record_call(route, "chat"):
+        response = model_router.get_llm(route.tier).invoke(messages)
+    reply = normalize_reply(response.content)
 
-    print(combined_prompt)
+    if reply_cache is not None:
+        reply_cache.store(user_message, reply)
+    return reply
 
+
+async def aprocess_user_message(user_message: str, user=None, rate_key=None) -> str:
+    """
+    Async version of process_user_message (uses ainvoke).
+    """
+    local = await _alocal_reply(user_message, user)
+    if local is not None:
+        return local
+
+    reply_cache = _shared_reply_cache(user_message)
+    if reply_cache is not None:
+        cached = reply_cache.lookup(user_message)
+        if cached is not None:
+            return cached
+        user = None
+
+    admission.check_chat_rate(rate_key)
+    combined_prompt = await abuild_combined_prompt(user_message, user)
+    route = model_router.classify(user_message, combined_prompt)
     messages = structured_prompt.format_messages(user_input=combined_prompt)
-    response = llm(messages)
-    llm_raw = response.content.strip()
+    async with admission.allm_slot():
+        with record_call(route, "chat"):
+            response = await model_router.get_llm(route.tier).ainvoke(messages)
+    reply = normalize_reply(response.content)
 
-    if llm_raw.startswith("```"):
-        llm_raw = llm_raw.strip("`").replace("json", "").strip()
+    if reply_cache is not None:
+        reply_cache.store(user_message, reply)
+    return reply
 
-    try:
-        parsed = pyjson.loads(llm_raw)
-        if isinstance(parsed, dict):
-            return parsed.get("reply", llm_raw)
-    except Exception:
-        pass
 
-    return llm_raw
+def stream_user_message(user_message: str, user=None, rate_key=None):
+    """
+    Stream the reply text of Gemini's structured response chunk by chunk
+    (for SSE), extracted from the JSON as it arrives.
+    Local and reply cache answers are yielded as a single chunk.
+    """
+    local = _local_reply(user_message, user)
+    if local is not None:
+        yield local
+        return
+
+    reply_cache = _shared_reply_cache(user_message)
+    if reply_cache is not None:
+        cached = reply_cache.lookup(user_message)
+        if cached is not None:
+            yield cached
+            return
+        user = None
+
+    admission.check_chat_rate(rate_key)
+    combined_prompt = build_combined_prompt(user_message, user)
+    route = model_router.classify(user_message, combined_prompt)
+    messages = structured_prompt.format_messages(user_input=combined_prompt)
+
+    extractor = ReplyStreamExtractor()
+    parts = []
+    with admission.llm_slot(), record_call(route, "chat_stream"):
+        for chunk in model_router.get_llm(route.tier).stream(messages):
+            text = extractor.feed(chunk.content)
+            if text:
+                parts.append(text)
+                yield text
+    tail = extractor.finish()
+    if tail:
+        parts.append(tail)
+        yield tail
+
+    if reply_cache is not None:
+        reply_cache.store(user_message, clean_reply_text("".join(parts)))
+
+
+async def astream_user_message(user_message: str, user=None, rate_key=None):
+    """
+    Async version of stream_user_message (uses astream).
+    """
+    local = await _alocal_reply(user_message, user)
+    if local is not None:
+        yield local
+        return
+
+    reply_cache = _shared_reply_cache(user_message)
+    if reply_cache is not None:
+        cached = reply_cache.lookup(user_message)
+        if cached is not None:
+            yield cached
+            return
+        user = None
+
+    admission.check_chat_rate(rate_key)
+    combined_prompt = await abuild_combined_prompt(user_message, user)
+    route = model_router.classify(user_message, combined_prompt)
+    messages = structured_prompt.format_messages(user_input=combined_prompt)
+
+    extractor = ReplyStreamExtractor()
+    parts = []
+    async with admission.allm_slot():
+        with record_call(route, "chat_stream"):
+            async for chunk in model_router.get_llm(route.tier).astream(messages):
+                text = extractor.feed(chunk.content)
+                if text:
+                    parts.append(text)
+                    yield text
+    tail = extractor.finish()
+    if tail:
+        parts.append(tail)
+        yield tail
+
+    if reply_cache is not None:
+        reply_cache.store(user_message, clean_reply_text("".join(parts)))
 
 
 # def process_user_message(user_message: str, user=None) -> str:
@@ -120,13 +288,7 @@ def should_send_to_llm(message: str) -> bool:
 
     return True
 
-def summarize_text(chat_text, existing_summary=None, word_limit=200):
-    """
-    Use Gemini to update conversation summary in <= `word_limit` words.
-    """
-    if not chat_text.strip():
-        return existing_summary or ""
-
+def _summary_prompt(chat_text, existing_summary, word_limit):
     system_prompt = (
         f"You are an assistant that summarizes a user's conversation history in under {word_limit} words. "
         "Keep it concise but preserve key context, goals, and preferences. "
@@ -137,11 +299,26 @@ def summarize_text(chat_text, existing_summary=None, word_limit=200):
     if existing_summary:
         prompt += f"Current summary:\n{existing_summary}\n\n"
     prompt += f"New chat segment:\n{chat_text}\n\nReturn the updated summary only."
+    return prompt
+
 
+def summarize_text(chat_text, existing_summary=None, word_limit=200, raise_errors=False):
+    """
+    Use Gemini (LLM_SUMMARY_TIER) to update conversation summary in <= `word_limit` words.
+    On failure returns the existing summary, or re-raises if `raise_errors`.
+    """
+    if not chat_text.strip():
+        return existing_summary or ""
+
+    prompt = _summary_prompt(chat_text, existing_summary, word_limit)
+
+    route = model_router.summary_route()
     try:
-        
-        response = llm.invoke(prompt)
+        with admission.llm_slot(), record_call(route, "summary"):
+            response = model_router.get_llm(route.tier).invoke(prompt)
         return response.content.strip()
-    except Exception as e:
-        print(f"[Summary Error] {e}")
+    except Exception:
+        if raise_errors:
+            raise
+        logger.exception("Summary generation failed")
         return existing_summary or ""
@@ -0,0 +1,178 @@
+"""
+Retrieval-augmented long-term memory over each user's chat history.
+
+Every message is embedded once, when it is saved (see ChatTurn.commit),
+and stored as float32 bytes in MessageEmbedding. At prompt time the
+user's vectors are scored against the new message in one matrix product
+and the top-k older messages are added to the context, so details like an
+injury mentioned weeks ago are recalled without growing the recent window.
+Per-user matrices are kept in a small in-process LRU so an active
+conversation does not reload its vectors for every prompt.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from ..models import ChatHistory, MessageEmbedding
+from .archive_service import get_archived_messages
+from .embedding_service import embed_text, tokenize
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def should_embed(message: str) -> bool:
+    """Skip one- and two-word messages ("ok", "thanks") — nothing worth recalling."""
+    return len(tokenize(message)) >= _setting("MEMORY_MIN_WORDS", 3)
+
+
+def build_embeddings(messages) -> list:
+    """Unsaved MessageEmbedding rows for saved ChatHistory instances."""
+    return [
+        MessageEmbedding(user_id=m.user_id, message_id=m.pk, vector=embed_text(m.message).tobytes())
+        for m in messages
+        if should_embed(m.message)
+    ]
+
+
+# -------------------------
+# In-process per-user index
+# -------------------------
+class _UserIndex:
+    """One user's message ids and their embedding matrix (row i ↔ ids[i])."""
+
+    def __init__(self, ids, matrix):
+        self._lock = threading.Lock()
+        self._ids = ids
+        self._matrix = matrix
+        self.loaded_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return self._ids, self._matrix
+
+    @property
+    def last_id(self):
+        ids, _ = self.snapshot()
+        return int(ids[-1]) if len(ids) else 0
+
+    def extend(self, ids, vectors):
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            if len(self._ids):
+                self._ids = np.concatenate([self._ids, ids])
+                self._matrix = np.vstack([self._matrix, vectors])
+            else:
+                self._ids, self._matrix = ids, vectors
+
+
+def _rows_to_arrays(rows):
+    ids = np.fromiter((mid for mid, _ in rows), dtype=np.int64, count=len(rows))
+    if rows:
+        matrix = np.vstack([np.frombuffer(bytes(vec), dtype=np.float32) for _, vec in rows])
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    return ids, matrix
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _load_rows(user_id, after_id=0):
+    return list(
+        MessageEmbedding.objects.filter(user_id=user_id, message_id__gt=after_id)
+        .order_by("message_id")
+        .values_list("message_id", "vector")
+    )
+
+
+def _get_index(user_id) -> _UserIndex:
+    """
+    The user's vectors, loaded once and then only topped up with rows
+    written by other processes every MEMORY_INDEX_REFRESH_SECONDS.
+    """
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+
+    if index is None:
+        index = _UserIndex(*_rows_to_arrays(_load_rows(user_id)))
+    elif time.monotonic() - index.loaded_at > _setting("MEMORY_INDEX_REFRESH_SECONDS", 30):
+        rows = _load_rows(user_id, after_id=index.last_id)
+        if rows:
+            index.extend(*_rows_to_arrays(rows))
+        index.loaded_at = time.monotonic()
+
+    with _indexes_lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > _setting("MEMORY_INDEX_MAX_USERS", 500):
+            _indexes.popitem(last=False)
+    return index
+
+
+def remember(user_id, embeddings):
+    """Add just-committed embeddings to the user's loaded index (if any)."""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+    if index is None or not embeddings:
+        return
+    index.extend(
+        [e.message_id for e in embeddings],
+        np.vstack([np.frombuffer(e.vector, dtype=np.float32) for e in embeddings]),
+    )
+
+
+def forget(user_id):
+    """Drop the user's loaded index (after purges)."""
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
+
+
+# -------------------------
+# Retrieval
+# -------------------------
+def recall_relevant_messages(user, query: str, exclude_ids=(), k=None) -> list:
+    """
+    Top-k older (id, sender, message) rows most similar to `query`,
+    in chronological order. Messages in `exclude_ids` (e.g. the recent
+    window already in the prompt) are skipped.
+    """
+    k = k if k is not None else _setting("MEMORY_TOP_K", 3)
+    if not k or not should_embed(query):
+        return []
+
+    ids, matrix = _get_index(user.pk).snapshot()
+    if not len(ids):
+        return []
+
+    scores = matrix @ embed_text(query)
+    if exclude_ids:
+        scores[np.isin(ids, list(exclude_ids))] = -1.0
+
+    top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+    min_score = _setting("MEMORY_MIN_SCORE", 0.2)
+    wanted = sorted(int(ids[i]) for i in top if scores[i] >= min_score)
+    if not wanted:
+        return []
+
+    found = {
+        mid: (mid, sender, message)
+        for mid, sender, message in ChatHistory.objects.filter(user=user, id__in=wanted).values_list("id", "sender", "message")
+    }
+    missing = [mid for mid in wanted if mid not in found]
+    if missing:  # archived since it was embedded
+        for m in get_archived_messages(user, after_id=missing[0] - 1, before_id=missing[-1] + 1):
+            if m["id"] in missing:
+                found[m["id"]] = (m["id"], m["sender"], m["message"])
+
+    snippet = _setting("MEMORY_SNIPPET_CHARS", 300)
+    return [(mid, found[mid][1], found[mid][2][:snippet]) for mid in wanted if mid in found]
@@ -0,0 +1,156 @@
+"""
+Tiered model routing.
+
+LLM_MODEL_TIERS names the available Gemini models (e.g. "fast" → flash,
+"heavy" → pro). A local, rule-based classifier picks a tier per request
+from the message length, detected intent and prompt size: plan/program
+requests and long or context-heavy prompts go to the heavy tier, small talk
+and short questions to the fast one. Summaries always use
+LLM_SUMMARY_TIER. Every call is recorded (tier, model, purpose, latency)
+so latency can be compared by tier.
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .. import metrics
+from .llm_backends import get_backend
+from .token_service import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIERS = {
+    "fast": {"model": "gemini-2.5-flash", "temperature": 0},
+    "heavy": {"model": "gemini-2.5-pro", "temperature": 0},
+}
+
+# Requests that need the stronger model: building plans, programs, calculations
+HEAVY_INTENT_RE = re.compile(
+    r"\b(plan|program(?:me)?|routine|schedule|split|diet|meal|macros?|calories|calculate|"
+    r"design|create|build|customi[sz]e|personali[sz]e|step[- ]by[- ]step|detailed|week(?:ly)?|month(?:ly)?)\b",
+    re.IGNORECASE,
+)
+WORD_RE = re.compile(r"\S+")
+
+RouteDecision = namedtuple("RouteDecision", ["tier", "model", "reason"])
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def model_tiers() -> dict:
+    return _setting("LLM_MODEL_TIERS", DEFAULT_TIERS)
+
+
+def _decision(tier, reason) -> RouteDecision:
+    tiers = model_tiers()
+    if tier not in tiers:
+        raise ValueError(f"Unknown LLM tier {tier!r}; configure it in LLM_MODEL_TIERS")
+    return RouteDecision(tier, tiers[tier]["model"], reason)
+
+
+def classify(user_message: str, prompt: str = "") -> RouteDecision:
+    """Pick the tier for a chat request (no network, deterministic)."""
+    forced = _setting("LLM_FORCE_TIER", None)
+    if forced:
+        return _decision(forced, "forced")
+
+    fast = _setting("LLM_FAST_TIER", "fast")
+    heavy = _setting("LLM_HEAVY_TIER", "heavy")
+
+    if HEAVY_INTENT_RE.search(user_message or ""):
+        return _decision(heavy, "intent")
+    if len(WORD_RE.findall(user_message or "")) >= _setting("LLM_HEAVY_MIN_WORDS", 40):
+        return _decision(heavy, "long_message")
+    if estimate_tokens(prompt) >= _setting("LLM_HEAVY_MIN_PROMPT_TOKENS", 1200):
+        return _decision(heavy, "large_context")
+    return _decision(fast, "simple")
+
+
+def summary_route() -> RouteDecision:
+    return _decision(_setting("LLM_SUMMARY_TIER", "fast"), "summary")
+
+
+# -------------------------
+# Clients (one per backend and tier, created on first use)
+# -------------------------
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm(tier: str):
+    """The LLM_BACKEND chat model for `tier`."""
+    backend = get_backend()
+    with _clients_lock:
+        client = _clients.get((backend.name, tier))
+        if client is None:
+            client = _clients[backend.name, tier] = backend.chat_model(tier, model_tiers()[tier])
+        return client
+
+
+def reset_clients():
+    """Forget cached clients (after changing LLM_BACKEND or LLM_MODEL_TIERS)."""
+    with _clients_lock:
+        _clients.clear()
+
+
+# -------------------------
+# Call recording
+# -------------------------
+class CallLog:
+    """Recent calls plus running per-tier totals."""
+
+    def __init__(self, maxlen=500):
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=maxlen)
+        self.totals = {}
+
+    def record(self, decision: RouteDecision, purpose: str, seconds: float, ok: bool):
+        entry = {
+            "tier": decision.tier, "model": decision.model, "reason": decision.reason,
+            "purpose": purpose, "ms": round(seconds * 1000, 1), "ok": ok,
+        }
+        with self._lock:
+            self.recent.append(entry)
+            totals = self.totals.setdefault(decision.tier, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            totals["calls"] += 1
+            totals["errors"] += 0 if ok else 1
+            totals["total_ms"] += entry["ms"]
+            totals["max_ms"] = max(totals["max_ms"], entry["ms"])
+        metrics.llm_calls.inc(tier=decision.tier, purpose=purpose, outcome="ok" if ok else "error")
+        metrics.llm_duration.observe(seconds, tier=decision.tier, purpose=purpose)
+        logger.info("llm call tier=%(tier)s model=%(model)s reason=%(reason)s purpose=%(purpose)s ms=%(ms)s ok=%(ok)s", entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                tier: dict(
+                    t,
+                    total_ms=round(t["total_ms"], 1),
+                    avg_ms=round(t["total_ms"] / t["calls"], 1) if t["calls"] else 0.0,
+                )
+                for tier, t in self.totals.items()
+            }
+
+
+call_log = CallLog()
+
+
+@contextmanager
+def record_call(decision: RouteDecision, purpose: str):
+    """Time the enclosed LLM call and record it against its tier."""
+    started = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except Exception:
+        ok = False
+        raise
+    finally:
+        call_log.record(decision, purpose, time.perf_counter() - started, ok)
@@ -1,24 +1,87 @@
+"""
+OTP issue and verification.
+
+The live code for a user is kept in the OTP_CACHE_ALIAS cache (a database
+table by default, so every worker process sees it; `manage.py
+createcachetable` creates it) with a native TTL of OTP_TTL_SECONDS, next to
+an attempt counter, so verification is a couple of cache operations no
+matter how many codes were issued before. Issuing a new
+code replaces the previous one. After OTP_MAX_ATTEMPTS wrong guesses the code
+is discarded and a new one has to be requested.
+
+OTP rows are an audit log only: they record when a code was issued and
+whether (and after how many attempts) it was used, and are purged in batches
+by `manage.py purge_otps` / `purge_data` (app.services.retention_service).
+"""
+import hmac
 import random
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
 from ..models import OTP, User
 
 
+def _cache():
+    return caches[getattr(settings, "OTP_CACHE_ALIAS", "default")]
+
+
+def _ttl():
+    return getattr(settings, "OTP_TTL_SECONDS", 300)
+
+
+def _max_attempts():
+    return getattr(settings, "OTP_MAX_ATTEMPTS", 5)
+
+
+def _keys(user):
+    return f"otp:{user.pk}", f"otp-attempts:{user.pk}"
+
+
+def _new_code():
+    return str(random.randint(100000, 999999))
+
+
 def generate_otp(user: User) -> OTP:
-    """Generate and store a new OTP for a user"""
-    code = str(random.randint(100000, 999999))
-    otp = OTP.objects.create(user=user, code=code)
+    """Generate a new OTP for a user: cached for verification, logged in the DB"""
+    otp = OTP.objects.create(user=user, code=_new_code())
+    code_key, attempts_key = _keys(user)
+    _cache().set_many({code_key: (otp.pk, otp.code), attempts_key: 0}, _ttl())
     return otp
 
 
+def _check(live, attempts, code):
+    """'ok', 'wrong' or 'locked' for this attempt (None if there is no live code)."""
+    if live is None or attempts is None:
+        return None
+    if attempts > _max_attempts():
+        return "locked"
+    return "ok" if hmac.compare_digest(live[1], str(code)) else "wrong"
+
+
 def verify_otp(user: User, code: str) -> bool:
-    """Verify OTP correctness and expiry"""
+    """Verify the user's live OTP (correct, unexpired, within OTP_MAX_ATTEMPTS)"""
+    cache = _cache()
+    code_key, attempts_key = _keys(user)
     try:
-        otp = OTP.objects.filter(user=user, code=code).latest("created_at")
-    except OTP.DoesNotExist:
+        attempts = cache.incr(attempts_key)  # counts this attempt (atomic on Redis/Memcached)
+    except ValueError:
+        return False  # no live code (never issued, expired or already used)
+    live = cache.get(code_key)
+    result = _check(live, attempts, code)
+    if result in ("ok", "locked"):
+        cache.delete_many([code_key, attempts_key])
+    if result == "wrong" or result is None:
         return False
 
-    if otp.is_expired():
+    audit = {"attempts": attempts}
+    if result == "ok":
+        audit["verified_at"] = timezone.now()
+    OTP.objects.filter(pk=live[0]).update(**audit)
+    if result == "locked":
         return False
 
     user.is_verified = True
-    user.save()
+    user.save(update_fields=["is_verified"])
     return True
+
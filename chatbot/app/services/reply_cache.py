@@ -0,0 +1,144 @@
+"""
+Semantic reply cache for context-independent questions.
+
+Near-identical general questions ("best beginner chest workout") reuse a
+previous LLM reply instead of a full Gemini round-trip. Questions are
+embedded locally (embedding_service) and looked up with one vectorized
+cosine-similarity pass over the cached entries. A hit also needs the same
+content words (stopwords aside): hashed bag-of-words vectors score
+"benefits of X" and "risks of X" as near-identical. Only questions that do
+not depend on the user's own context are eligible (see
+is_cacheable_question), and their replies are generated without the
+user's history so they are safe to share.
+"""
+import re
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .. import metrics
+from .embedding_service import STOPWORDS, embed_text, embedding_dim, tokenize
+
+# Words that tie a question to the asker or the conversation so far
+CONTEXT_WORDS = frozenset(
+    "i i'm im i've ive me my mine myself we our us you your you're it this that these those "
+    "he she they them his her their above previous earlier before again yesterday today tonight "
+    "tomorrow last next ago still same".split()
+)
+
+HAS_DIGIT_RE = re.compile(r"\d")
+
+
+def is_cacheable_question(message: str) -> bool:
+    """True for short, general questions whose answer does not depend on who asks."""
+    tokens = tokenize(message)
+    if not 3 <= len(tokens) <= 25:
+        return False
+    if HAS_DIGIT_RE.search(message):  # personal stats, dates, amounts
+        return False
+    return not CONTEXT_WORDS.intersection(tokens)
+
+
+def content_key(question: str) -> frozenset:
+    """The question's content words: two questions share a reply only if these match."""
+    return frozenset(tokenize(question)) - STOPWORDS
+
+
+class SemanticReplyCache:
+    """
+    Fixed-capacity cache of (question embedding → reply).
+    Vectors live in one preallocated float32 matrix; the least recently
+    used entry is evicted when full and entries expire after `ttl` seconds.
+    A lookup hits the most similar entry at or above `threshold` whose
+    content words are the same as the question's.
+    """
+
+    def __init__(self, max_entries=2000, threshold=0.85, ttl=24 * 3600, dim=None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.dim = dim or embedding_dim()
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._vectors = np.zeros((self.max_entries, self.dim), dtype=np.float32)
+            self._stored_at = np.zeros(self.max_entries)
+            self._used_at = np.zeros(self.max_entries)
+            self._replies = [None] * self.max_entries
+            self._keys = [None] * self.max_entries
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def lookup(self, question: str):
+        """Return a cached reply for a similar enough question, or None."""
+        vec = embed_text(question, self.dim)
+        key = content_key(question)
+        now = time.monotonic()
+        with self._lock:
+            if self._size and vec.any():
+                scores = self._vectors[:self._size] @ vec
+                scores[now - self._stored_at[:self._size] > self.ttl] = -1.0
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for slot in candidates[np.argsort(-scores[candidates])]:
+                    if self._keys[slot] == key:
+                        self._used_at[slot] = now
+                        self.hits += 1
+                        metrics.reply_cache_lookups.inc(result="hit")
+                        return self._replies[slot]
+            self.misses += 1
+        metrics.reply_cache_lookups.inc(result="miss")
+        return None
+
+    def store(self, question: str, reply: str):
+        vec = embed_text(question, self.dim)
+        if not reply or not vec.any():
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._used_at))
+                self.evictions += 1
+            self._vectors[slot] = vec
+            self._replies[slot] = reply
+            self._keys[slot] = content_key(question)
+            self._stored_at[slot] = now
+            self._used_at[slot] = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": self._size,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_reply_cache = None
+_reply_cache_lock = threading.Lock()
+
+
+def get_reply_cache():
+    """The process-wide reply cache, or None when REPLY_CACHE_ENABLED is off."""
+    global _reply_cache
+    if not getattr(settings, "REPLY_CACHE_ENABLED", True):
+        return None
+    with _reply_cache_lock:
+        if _reply_cache is None:
+            _reply_cache = SemanticReplyCache(
+                max_entries=getattr(settings, "REPLY_CACHE_MAX_ENTRIES", 2000),
+                threshold=getattr(settings, "REPLY_CACHE_THRESHOLD", 0.85),
+                ttl=getattr(settings, "REPLY_CACHE_TTL_SECONDS", 24 * 3600),
+            )
+        return _reply_cache
@@ -0,0 +1,236 @@
+"""
+One normalization path for LLM chat replies.
+
+The chat prompt asks for a JSON object whose first key is "reply". Models
+still wrap it in markdown fences, drop the JSON, or get cut off mid-object.
+ReplyStreamExtractor turns raw model output into reply text incrementally:
+fed chunk by chunk, it emits the characters of the "reply" string as they
+arrive (JSON escapes decoded), so a streamed turn shows the reply while the
+rest of the object is still being generated. Output that isn't a JSON object
+passes through as text. normalize_reply runs the same extractor over a
+complete response, so streamed and non-streamed turns end with the same text.
+"""
+import json as pyjson
+import re
+
+from .. import metrics
+
+_FENCE_OPEN_RE = re.compile(r"\s*```[\w-]*[ \t]*\n?")        # ``` or ```json at the start
+_FENCE_CLOSE_RE = re.compile(r"\n?[ \t]*```\s*$")              # a closing fence at the end
+_BOT_PREFIX_RE = re.compile(r"^(🤖\s*)?(Bot:|FitnessBot:)\s*", re.IGNORECASE)
+_STRUCTURAL_RE = re.compile(r'["{}\[\],:]')                   # JSON tokens the scanner cares about
+_STRING_SPECIAL_RE = re.compile(r'["\\]')
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+REPLY_KEY = "reply"
+
+
+def clean_reply_text(text: str) -> str:
+    """Trim whitespace and a redundant "Bot:" / "FitnessBot:" prefix."""
+    return _BOT_PREFIX_RE.sub("", (text or "").strip())
+
+
+class ReplyStreamExtractor:
+    """
+    Incremental "reply" extractor. feed(chunk) returns the reply text that
+    chunk completes (possibly ""); finish() returns whatever is left, or the
+    whole output as text if no "reply" string was found in it.
+    """
+
+    def __init__(self):
+        self.raw = []          # every chunk, for the fallback
+        self._buffer = ""      # received but not yet consumed
+        self._mode = None      # None (undecided), "json" or "text"
+        self._depth = 0
+        self._expect_key = False
+        self._after_key = None  # the key whose ":" / value comes next
+        self._in_reply = False
+        self._done = False      # the reply string has closed
+        self._found = False     # a "reply" string value was seen
+        self._high_surrogate = None
+
+    # -------------------------
+    # Public API
+    # -------------------------
+    def feed(self, chunk: str) -> str:
+        if not chunk:
+            return ""
+        self.raw.append(chunk)
+        if self._done:
+            return ""
+        self._buffer += chunk
+        if self._mode is None and not self._decide_mode():
+            return ""
+        return self._scan_text(final=False) if self._mode == "text" else self._scan_json(final=False)
+
+    def finish(self) -> str:
+        if self._mode is None:
+            self._mode = "text"
+        if self._mode == "text":
+            return self._scan_text(final=True)
+        tail = "" if self._done else self._scan_json(final=True)
+        if not self._found:
+            # Not the object we asked for (no "reply" string): fall back to the text itself
+            return _FENCE_CLOSE_RE.sub("", self._strip_open_fence("".join(self.raw)))
+        return tail
+
+    # -------------------------
+    # Mode detection
+    # -------------------------
+    @staticmethod
+    def _strip_open_fence(text):
+        match = _FENCE_OPEN_RE.match(text)
+        return text[match.end():] if match else text.lstrip()
+
+    def _decide_mode(self) -> bool:
+        stripped = self._buffer.lstrip()
+        if not stripped or (stripped.startswith("`") and "\n" not in stripped and len(stripped) < 16):
+            return False  # whitespace or a fence whose language tag may still be arriving
+        self._buffer = self._strip_open_fence(self._buffer)
+        if not self._buffer:
+            return False
+        self._mode = "json" if self._buffer.startswith("{") else "text"
+        return True
+
+    # -------------------------
+    # Plain text
+    # -------------------------
+    def _scan_text(self, final: bool) -> str:
+        if final:
+            out, self._buffer = _FENCE_CLOSE_RE.sub("", self._buffer), ""
+            return out
+        # Hold back trailing backticks/whitespace: they may be a closing fence
+        keep = len(self._buffer) - len(self._buffer.rstrip("` \t\n"))
+        out, self._buffer = self._buffer[:len(self._buffer) - keep], self._buffer[len(self._buffer) - keep:]
+        return out
+
+    # -------------------------
+    # JSON object
+    # -------------------------
+    def _scan_json(self, final: bool) -> str:
+        out = []
+        buf, pos = self._buffer, 0
+        while pos < len(buf) and not self._done:
+            if self._in_reply:
+                pos = self._read_reply(buf, pos, out, final)
+                if self._in_reply:
+                    break  # need more input
+                continue
+
+            match = _STRUCTURAL_RE.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            token, pos = match.group(), match.end()
+            if token == '"':
+                end = self._string_end(buf, pos)
+                if end is None:
+                    pos -= 1  # incomplete string: rescan it with more input
+                    break
+                self._on_string(buf[pos - 1:end])
+                pos = end
+            elif token in "{[":
+                self._depth += 1
+                self._expect_key = token == "{" and self._depth == 1
+            elif token in "}]":
+                self._depth -= 1
+            elif token == "," and self._depth == 1:
+                self._expect_key = True
+                self._after_key = None
+            elif token == ":" and self._depth == 1 and self._after_key == REPLY_KEY:
+                # the value follows: a string starts capturing, anything else is not a usable reply
+                rest = buf[pos:].lstrip()
+                if not rest:
+                    pos -= 1
+                    break
+                if rest[0] == '"':
+                    pos = len(buf) - len(rest) + 1
+                    self._in_reply = self._found = True
+                self._after_key = None
+
+        self._buffer = buf[pos:]
+        return "".join(out)
+
+    @staticmethod
+    def _string_end(buf, start):
+        """Index just past the closing quote of the string starting at `start` (None if incomplete)."""
+        pos = start
+        while True:
+            match = _STRING_SPECIAL_RE.search(buf, pos)
+            if match is None:
+                return None
+            if match.group() == '"':
+                return match.end()
+            pos = match.end() + 1  # skip the escaped character
+            if pos > len(buf):
+                return None
+
+    def _on_string(self, literal):
+        if self._depth == 1 and self._expect_key:
+            try:
+                self._after_key = pyjson.loads(literal)
+            except ValueError:
+                self._after_key = None
+            self._expect_key = False
+
+    def _read_reply(self, buf, pos, out, final) -> int:
+        """Decode reply characters from `pos`; returns the new position."""
+        while pos < len(buf):
+            match = _STRING_SPECIAL_RE.search(buf, pos)
+            end = match.start() if match else len(buf)
+            if end > pos:
+                self._emit(buf[pos:end], out)
+            if match is None:
+                return len(buf)
+            if match.group() == '"':
+                self._in_reply = False
+                self._done = True
+                self._flush_surrogate(out)
+                return match.end()
+            # backslash escape
+            esc_start = match.start()
+            if esc_start + 1 >= len(buf):
+                return esc_start  # wait for the escaped character
+            kind = buf[esc_start + 1]
+            if kind == "u":
+                digits = buf[esc_start + 2:esc_start + 6]
+                if len(digits) < 4:
+                    return esc_start
+                try:
+                    self._emit_codepoint(int(digits, 16), out)
+                except ValueError:
+                    self._emit(buf[esc_start:esc_start + 6], out)
+                pos = esc_start + 6
+            else:
+                self._emit(_ESCAPES.get(kind, kind), out)
+                pos = esc_start + 2
+        if final:
+            self._flush_surrogate(out)
+        return pos
+
+    def _emit(self, text, out):
+        self._flush_surrogate(out)
+        out.append(text)
+
+    def _emit_codepoint(self, code, out):
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate(out)
+            self._high_surrogate = code
+        elif 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            out.append(chr(0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)))
+            self._high_surrogate = None
+        else:
+            self._emit(chr(code), out)
+
+    def _flush_surrogate(self, out):
+        if self._high_surrogate is not None:
+            out.append("�")  # unpaired
+            self._high_surrogate = None
+
+
+@metrics.timed("reply_cleanup")
+def normalize_reply(llm_raw: str) -> str:
+    """The user-facing reply in a complete model response (same result as streaming it)."""
+    extractor = ReplyStreamExtractor()
+    return clean_reply_text(extractor.feed(llm_raw or "") + extractor.finish())
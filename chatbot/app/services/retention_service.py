@@ -0,0 +1,156 @@
+"""
+Data retention: delete rows past their policy age in small batches.
+
+Each policy walks its table in primary-key order (keyset, never OFFSET),
+deleting at most `batch_size` rows per short transaction, optionally
+sleeping between batches. SQLite's write lock is only held for one small
+batch at a time, so chat requests keep being served while a purge runs.
+
+Retention periods come from DATA_RETENTION ({policy name: days}); None
+keeps that data forever.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import OTP, ChatArchiveSegment, ChatHistory, MessageEmbedding, SummaryJob
+from . import context_cache, memory_service
+
+
+class RetentionPolicy:
+    """Rows of `model` whose `date_field` is older than the cutoff."""
+
+    def __init__(self, name, model, date_field, description):
+        self.name = name
+        self.model = model
+        self.date_field = date_field
+        self.description = description
+
+    def cutoff(self, days):
+        return timezone.now() - timedelta(days=days)
+
+    def queryset(self, cutoff):
+        return self.model.objects.filter(**{f"{self.date_field}__lt": cutoff})
+
+    def count(self, cutoff) -> int:
+        return self.queryset(cutoff).count()
+
+    def delete_batch(self, keys) -> int:
+        """Delete one batch of primary keys (inside the batch transaction)."""
+        deleted, _ = self.model.objects.filter(pk__in=keys).delete()
+        return deleted
+
+    def batch_context(self, keys):
+        """Hook run inside the batch transaction, before deleting; its result goes to after_batch."""
+        return None
+
+    def after_batch(self, keys, context):
+        """Hook run after each batch commits."""
+
+    def purge(self, cutoff, batch_size=500, sleep=0.0):
+        """Delete matching rows batch by batch; yields the rows deleted per batch."""
+        last_key = None
+        while True:
+            rows = self.queryset(cutoff)
+            if last_key is not None:
+                rows = rows.filter(pk__gt=last_key)
+            keys = list(rows.order_by("pk").values_list("pk", flat=True)[:batch_size])
+            if not keys:
+                return
+            last_key = keys[-1]
+
+            with transaction.atomic():
+                context = self.batch_context(keys)
+                deleted = self.delete_batch(keys)
+            self.after_batch(keys, context)
+            yield deleted
+
+            if len(keys) < batch_size:
+                return
+            if sleep:
+                time.sleep(sleep)
+
+
+def _forget_users(user_ids):
+    """Drop cached prompt context and loaded recall indexes for users whose data was purged."""
+    for user_id in user_ids:
+        context_cache.invalidate(user_id)
+        memory_service.forget(user_id)
+
+
+class ChatHistoryPolicy(RetentionPolicy):
+    """Hot chat messages, with their embeddings; affected users' caches are dropped."""
+
+    def batch_context(self, keys):
+        """The users whose messages are in the batch."""
+        return set(ChatHistory.objects.filter(pk__in=keys).values_list("user_id", flat=True))
+
+    def delete_batch(self, keys) -> int:
+        MessageEmbedding.objects.filter(message_id__in=keys).delete()
+        return super().delete_batch(keys)
+
+    def after_batch(self, keys, context):
+        _forget_users(context)
+
+
+class ChatArchivePolicy(RetentionPolicy):
+    """Archived chat segments, with the embeddings of the messages they hold; affected users' caches are dropped."""
+
+    range_chunk = 100  # OR-ed message-id ranges per embedding DELETE
+
+    def batch_context(self, keys):
+        """(user_id, first_message_id, last_message_id) for each segment in the batch."""
+        return list(
+            ChatArchiveSegment.objects.filter(pk__in=keys)
+            .values_list("user_id", "first_message_id", "last_message_id")
+        )
+
+    def delete_batch(self, keys) -> int:
+        segments = self.batch_context(keys)
+        for start in range(0, len(segments), self.range_chunk):
+            ranges = Q()
+            for user_id, first_id, last_id in segments[start:start + self.range_chunk]:
+                ranges |= Q(user_id=user_id, message_id__range=(first_id, last_id))
+            MessageEmbedding.objects.filter(ranges).delete()
+        return super().delete_batch(keys)
+
+    def after_batch(self, keys, context):
+        _forget_users({user_id for user_id, _, _ in context})
+
+
+class ExpiredSessionPolicy(RetentionPolicy):
+    """Sessions past their expiry date; the retention period is added on top (0 = as soon as expired)."""
+
+    def cutoff(self, days):
+        return timezone.now() - timedelta(days=days or 0)
+
+
+class FailedSummaryJobPolicy(RetentionPolicy):
+    """Failed jobs are kept a while for inspection; pending and running ones are never purged."""
+
+    def queryset(self, cutoff):
+        return super().queryset(cutoff).filter(status=SummaryJob.STATUS_FAILED)
+
+
+POLICIES = {
+    policy.name: policy for policy in (
+        ChatHistoryPolicy("chat_history", ChatHistory, "timestamp", "Chat messages (and their embeddings)"),
+        ChatArchivePolicy(
+            "chat_archive", ChatArchiveSegment, "last_timestamp", "Archived chat segments (and their embeddings)",
+        ),
+        RetentionPolicy("otp", OTP, "created_at", "OTP audit rows"),
+        ExpiredSessionPolicy("sessions", Session, "expire_date", "Expired sessions"),
+        FailedSummaryJobPolicy("summary_jobs", SummaryJob, "updated_at", "Failed summary jobs"),
+    )
+}
+
+
+def retention_days():
+    """{policy name: days or None} from DATA_RETENTION."""
+    configured = getattr(settings, "DATA_RETENTION", {})
+    return {name: configured.get(name) for name in POLICIES}
@@ -0,0 +1,49 @@
+"""
+The chat user for a request, resolved from the session phone at most once.
+
+ChatUserMiddleware attaches `request.chat_user()` / `await request.achat_user()`
+(the same shape as Django's `request.auser()`); views, the state machine and
+services share the one User object instead of each re-querying it. Code that
+changes who is logged in (phone entry, registration, logout) updates the
+cached value with set_chat_user.
+"""
+from functools import partial
+
+from .. import metrics
+from ..models import User
+
+_UNRESOLVED = object()
+
+
+@metrics.timed("session_user")
+def get_chat_user(request):
+    """The User for the phone stored in the session (or None)."""
+    user = getattr(request, "_chat_user", _UNRESOLVED)
+    if user is _UNRESOLVED:
+        phone = request.session.get("phone")
+        user = User.objects.filter(phone=phone).first() if phone else None
+        request._chat_user = user
+    return user
+
+
+@metrics.timed("session_user")
+async def aget_chat_user(request):
+    """Async version of get_chat_user."""
+    user = getattr(request, "_chat_user", _UNRESOLVED)
+    if user is _UNRESOLVED:
+        phone = await request.session.aget("phone")
+        user = await User.objects.filter(phone=phone).afirst() if phone else None
+        request._chat_user = user
+    return user
+
+
+def set_chat_user(request, user):
+    """Replace the cached user after the session's phone changes (or None after logout)."""
+    request._chat_user = user
+
+
+def attach(request):
+    """Give `request` the lazy chat_user() / achat_user() accessors."""
+    request.chat_user = partial(get_chat_user, request)
+    request.achat_user = partial(aget_chat_user, request)
+    return request
@@ -0,0 +1,232 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Value
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from .. import metrics
+from ..models import SummaryJob, User
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# -------------------------
+# Enqueue (request path)
+# -------------------------
+def queue_summary_job(user: User):
+    """
+    Upsert the user's single pending job — one UPDATE in the common case.
+    Quick successive turns coalesce into it: each call pushes `run_after`
+    back by the debounce window, but never past SUMMARY_MAX_DELAY_SECONDS
+    after the job was first queued.
+    """
+    now = timezone.now()
+    debounce = timedelta(seconds=_setting("SUMMARY_DEBOUNCE_SECONDS", 15))
+    max_delay = timedelta(seconds=_setting("SUMMARY_MAX_DELAY_SECONDS", 120))
+
+    updated = SummaryJob.objects.filter(user=user, status=SummaryJob.STATUS_PENDING).update(
+        run_after=Least(
+            Value(now + debounce, output_field=DateTimeField()),
+            ExpressionWrapper(F("created_at") + max_delay, output_field=DateTimeField()),
+        ),
+        updated_at=now,
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                SummaryJob.objects.create(user=user, run_after=now + debounce)
+        except IntegrityError:
+            pass  # a concurrent request already queued this user's job
+
+
+def start_summary_worker():
+    if _setting("SUMMARY_WORKER_AUTOSTART", True):
+        get_worker().start()
+
+
+def enqueue_summary_refresh(user: User, force=False):
+    """
+    Queue a debounced summary refresh for `user` once the refresh policy
+    (summary_refresh_due) says enough new content has arrived.
+    """
+    from .chat_service import summary_refresh_due
+
+    if not force and not summary_refresh_due(user):
+        return
+
+    queue_summary_job(user)
+    start_summary_worker()
+
+
+# -------------------------
+# Job processing
+# -------------------------
+def _claim(job_id) -> bool:
+    """Atomically move a pending job to running; False if another worker won."""
+    return SummaryJob.objects.filter(pk=job_id, status=SummaryJob.STATUS_PENDING).update(
+        status=SummaryJob.STATUS_RUNNING, updated_at=timezone.now()
+    ) == 1
+
+
+def _set_pending_or_drop(job, **fields):
+    """Return a job to pending, or delete it if the user already has a newer pending job."""
+    try:
+        with transaction.atomic():
+            SummaryJob.objects.filter(pk=job.pk).update(status=SummaryJob.STATUS_PENDING, **fields)
+    except IntegrityError:
+        SummaryJob.objects.filter(pk=job.pk).delete()
+
+
+def run_summary_job(job: SummaryJob):
+    """Refresh one user's summary and remove the job (retry with backoff on failure)."""
+    from .chat_service import update_conversation_summary
+
+    try:
+        summarized = update_conversation_summary(job.user, limit=200)
+    except Exception as e:
+        attempts = job.attempts + 1
+        logger.warning("Summary job %s failed (attempt %s): %s", job.pk, attempts, e)
+        if attempts >= _setting("SUMMARY_JOB_MAX_ATTEMPTS", 3):
+            SummaryJob.objects.filter(pk=job.pk).update(
+                status=SummaryJob.STATUS_FAILED, attempts=attempts, last_error=str(e)
+            )
+        else:
+            _set_pending_or_drop(
+                job,
+                attempts=attempts,
+                last_error=str(e),
+                run_after=timezone.now() + timedelta(seconds=30 * attempts),
+            )
+        return
+
+    lag = (timezone.now() - job.created_at).total_seconds()
+    metrics.summary_lag.observe(lag)
+    logger.info("Summary refreshed for user %s (lag %.1fs)", job.user_id, lag)
+    SummaryJob.objects.filter(pk=job.pk).delete()
+
+    # Batch was capped — keep going until the watermark catches up
+    if summarized >= _setting("SUMMARY_MAX_BATCH_MESSAGES", 50):
+        enqueue_summary_refresh(job.user, force=True)
+
+
+def recover_stale_jobs():
+    """Requeue jobs left running by a crashed or restarted process."""
+    stale_after = timedelta(seconds=_setting("SUMMARY_JOB_STALE_SECONDS", 300))
+    stale = SummaryJob.objects.filter(
+        status=SummaryJob.STATUS_RUNNING, updated_at__lt=timezone.now() - stale_after
+    )
+    for job in stale:
+        _set_pending_or_drop(job, run_after=timezone.now())
+
+
+def due_jobs(limit=50, user=None):
+    """Pending jobs whose debounce window has elapsed, oldest first (optionally for one user)."""
+    jobs = SummaryJob.objects.filter(status=SummaryJob.STATUS_PENDING, run_after__lte=timezone.now())
+    if user is not None:
+        jobs = jobs.filter(user=user)
+    return list(jobs.select_related("user").order_by("run_after")[:limit])
+
+
+def run_pending_summary_jobs(limit=50, user=None) -> int:
+    """Process due jobs in the current thread. Returns the number processed."""
+    recover_stale_jobs()
+    processed = 0
+    for job in due_jobs(limit, user):
+        if _claim(job.pk):
+            run_summary_job(job)
+            processed += 1
+    return processed
+
+
+# -------------------------
+# In-process worker pool
+# -------------------------
+class SummaryWorker:
+    """
+    Polls the SummaryJob table and refreshes summaries on a small thread pool.
+    Jobs live in the database, so anything queued before a restart is picked
+    up again by the next worker.
+    """
+
+    def __init__(self, threads=None, poll_seconds=None):
+        self.threads = threads or _setting("SUMMARY_WORKER_THREADS", 2)
+        self.poll_seconds = poll_seconds or _setting("SUMMARY_WORKER_POLL_SECONDS", 2)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._dispatcher = None
+        self._pool = None
+
+    @property
+    def running(self):
+        return self._dispatcher is not None and self._dispatcher.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="summary-worker")
+            self._dispatcher = threading.Thread(target=self._loop, name="summary-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def stop(self, wait=True):
+        with self._lock:
+            self._stop.set()
+            if self._dispatcher:
+                self._dispatcher.join(timeout=self.poll_seconds * 2 if wait else 0)
+            if self._pool:
+                self._pool.shutdown(wait=wait)
+            self._dispatcher = None
+            self._pool = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                recover_stale_jobs()
+                pool = self._pool
+                for job in due_jobs(limit=self.threads * 4):
+                    if self._stop.is_set():
+                        break
+                    if not _claim(job.pk):
+                        continue
+                    try:
+                        pool.submit(self._run, job)
+                    except Exception:
+                        # e.g. stop() shut the pool down meanwhile: don't leave the job "running"
+                        _set_pending_or_drop(job)
+                        raise
+            except Exception:
+                logger.exception("Summary dispatcher error")
+            finally:
+                close_old_connections()
+            self._stop.wait(self.poll_seconds)
+
+    def _run(self, job):
+        try:
+            run_summary_job(job)
+        except Exception:
+            logger.exception("Summary job %s crashed", job.pk)
+        finally:
+            close_old_connections()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker() -> SummaryWorker:
+    """Return the process-wide summary worker (created lazily)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = SummaryWorker()
+        return _worker
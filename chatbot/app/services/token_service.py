@@ -0,0 +1,16 @@
+"""
+Local token estimation (no network, no tokenizer download).
+Gemini averages roughly four characters of English text per token.
+"""
+
+CHARS_PER_TOKEN = 4
+
+
+def tokens_from_chars(chars: int) -> int:
+    """Estimated token count for `chars` characters of text."""
+    return (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimated token count for `text`."""
+    return tokens_from_chars(len(text or ""))
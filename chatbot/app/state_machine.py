@@ -1,6 +1,7 @@
 from .models import User
 from .services.otp_service import generate_otp, verify_otp
-from .services.chat_service import save_chat, get_chat_history
+from .services.chat_service import ChatTurn, save_chat
+from .services.session_user import get_chat_user, set_chat_user
 
 
 # -------------------------
@@ -11,6 +12,21 @@ class State:
         raise NotImplementedError
 
 
+def _session_user(request):
+    """The request's chat user (resolved once per request); raises User.DoesNotExist if missing."""
+    user = get_chat_user(request)
+    if user is None:
+        raise User.DoesNotExist
+    return user
+
+
+def _verified_user(request):
+    user = _session_user(request)
+    if not user.is_verified:
+        raise User.DoesNotExist
+    return user
+
+
 # -------------------------
 # Individual States
 # -------------------------
@@ -22,12 +38,12 @@ class PhoneState(State):
         phone = message
         request.session["phone"] = phone
 
-        try:
-            user = User.objects.get(phone=phone)
+        user = User.objects.filter(phone=phone).first()
+        set_chat_user(request, user)
+        if user is not None:
             otp = generate_otp(user)
             return f"📱 Welcome back! Enter OTP sent to {phone}. (Dev OTP: {otp.code})", "otp_existing"
-        except User.DoesNotExist:
-            return "❌ You are not registered. Would you like to register? (Yes/No)", "register_prompt"
+        return "❌ You are not registered. Would you like to register? (Yes/No)", "register_prompt"
 
 
 class RegisterPromptState(State):
@@ -35,6 +51,7 @@ class RegisterPromptState(State):
         if message.lower() == "yes":
             phone = request.session.get("phone")
             user, _ = User.objects.get_or_create(phone=phone, is_verified=False)
+            set_chat_user(request, user)
             otp = generate_otp(user)
             return f"📱 Enter OTP sent to {phone} to complete registration. (Dev OTP: {otp.code})", "otp_new"
         return "🚫 Registration cancelled. Start again with your number.", "phone"
@@ -42,8 +59,7 @@ class RegisterPromptState(State):
 
 class OTPNewState(State):
     def handle(self, request, message):
-        phone = request.session.get("phone")
-        user = User.objects.get(phone=phone)
+        user = _session_user(request)
 
         if verify_otp(user, message):
             return "🎉 Registration complete! Welcome to FitnessBot 💪", "chat"
@@ -56,8 +72,7 @@ class OTPNewState(State):
 
 class OTPExistingState(State):
     def handle(self, request, message):
-        phone = request.session.get("phone")
-        user = User.objects.get(phone=phone)
+        user = _session_user(request)
 
         if verify_otp(user, message):
             return "✅ Verified! Resuming your chat session.", "chat_with_history"
@@ -68,19 +83,18 @@ class OTPExistingState(State):
 
 class ChatState(State):
     def handle(self, request, message):
-        phone = request.session.get("phone")
-        user = User.objects.get(phone=phone, is_verified=True)
+        user = _verified_user(request)
         bot_reply = message
-        save_chat(user, "user", message)
-        save_chat(user, "bot", bot_reply)
+        turn = ChatTurn(user)
+        turn.add("user", message)
+        turn.add("bot", bot_reply)
+        turn.commit()
         return bot_reply, "chat"
 
 
 class ChatWithHistoryState(State):
     def handle(self, request, message):
-        phone = request.session.get("phone")
-        user = User.objects.get(phone=phone, is_verified=True)
-        history = get_chat_history(user)
+        user = _verified_user(request)
         bot_reply = "📜 Previous chat loaded. Now you can continue chatting."
         save_chat(user, "user", message)
         request.session["show_history"] = True
@@ -95,7 +109,7 @@ class OtpFailedState(State):
         # If user chooses to resend OTP
         elif message.lower() == "resend otp":
             phone = request.session.get("phone")
-            user = User.objects.get(phone=phone)
+            user = _session_user(request)
             otp = generate_otp(user)
             return (
                 f"📱 A new OTP has been sent to {phone}. (Dev OTP: {otp.code})",
@@ -129,18 +143,14 @@ class ChatStateMachine:
     def handle_message(self, request, message):
         # ✅ Global Exit / Logout Command
         if message.strip().lower() in ["exit", "logout"]:
-            phone = request.session.get("phone")
-            if phone:
-                from .models import User
-                try:
-                    user = User.objects.get(phone=phone)
-                    user.is_verified = False
-                    user.save()
-                except User.DoesNotExist:
-                    pass
+            user = get_chat_user(request)
+            if user is not None:
+                user.is_verified = False
+                user.save(update_fields=["is_verified"])
 
             # Clear session
             request.session.flush()
+            set_chat_user(request, None)
             request.session["step"] = "phone"
             
 
@@ -1,3 +1,453 @@
-from django.test import TestCase
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .loadtest import ENDPOINT_URLS, log_in
+from .models import ChatArchiveSegment, ChatHistory, ConversationSummary, MessageEmbedding, User
+from .services import admission, context_cache, idempotency, memory_service, model_router, reply_cache
+from .services.admission import (
+    ConcurrencyLimiter, LLMOverloaded, LLMQuotaExceeded, RateLimited, TokenBucketLimiter,
+)
+from .services.archive_service import archive_boundary, archive_user_history
+from .services.chat_service import get_chat_history_page
+from .services.context_builder import ELLIPSIS, build_prompt, format_message
+from .services.idempotency import DuplicateInProgress, IdempotencyKeyReused, RequestKey
+from .services.reply_parser import ReplyStreamExtractor, clean_reply_text, normalize_reply
+from .services.retention_service import POLICIES
+from .services.token_service import estimate_tokens
+
+
+class CacheResetMixin:
+    """Process-wide caches outlive each test's transaction; start every test empty."""
+
+    def setUp(self):
+        super().setUp()
+        for alias in ("default", "chat_context"):
+            caches[alias].clear()
+
+
+@override_settings(
+    LLM_BACKEND="fake",
+    LLM_FAKE_BACKEND={"latency_ms": 0, "malformed_rate": 0, "chunk_delay_ms": 0},
+    SUMMARY_WORKER_AUTOSTART=False,
+)
+class ChatClientTestCase(CacheResetMixin, TestCase):
+    """A logged-in test client talking to the fake LLM backend."""
+
+    phone = "9000000010"
+
+    def setUp(self):
+        super().setUp()
+        model_router.reset_clients()
+        self.addCleanup(model_router.reset_clients)
+        log_in(self.client, self.phone)
+        self.user = User.objects.get(phone=self.phone)
+
+    def post(self, message, key=None, endpoint="chat_api"):
+        headers = {"Idempotency-Key": key} if key else {}
+        return self.client.post(ENDPOINT_URLS[endpoint], {"message": message}, content_type="application/json",
+                                headers=headers)
+
+
+# -------------------------
+# Chat history paging
+# -------------------------
+class ChatHistoryPageTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(phone="9000000001", is_verified=True)
+        ChatHistory.objects.bulk_create(
+            [ChatHistory(user=self.user, sender="user" if i % 2 == 0 else "bot", message=f"m{i}") for i in range(20)]
+        )
+        self.ids = list(ChatHistory.objects.filter(user=self.user).order_by("id").values_list("id", flat=True))
+        # Archive the first 8 messages (3 segments); the summary must cover them first
+        ConversationSummary.objects.create(user=self.user, summary_text="s", last_message_id=self.ids[7])
+        archive_user_history(self.user.pk, cutoff=timezone.now() + timedelta(days=1), segment_size=3)
+
+    def _ids(self, **kwargs):
+        rows, has_more = get_chat_history_page(self.user, limit=5, **kwargs)
+        return [row["id"] for row in rows], has_more
+
+    def test_archive_holds_the_oldest_messages(self):
+        self.assertEqual(archive_boundary(self.user), self.ids[7])
+        self.assertEqual(ChatHistory.objects.filter(user=self.user).count(), 12)
+
+    def test_latest_page(self):
+        self.assertEqual(self._ids(), (self.ids[-5:], True))
+
+    def test_forward_from_every_message(self):
+        for i, after_id in enumerate(self.ids):
+            expected = self.ids[i + 1:i + 6]
+            with self.subTest(after_id=after_id):
+                self.assertEqual(self._ids(after_id=after_id), (expected, len(self.ids) - i - 1 > 5))
+
+    def test_backward_from_every_message(self):
+        for i, before_id in enumerate(self.ids):
+            expected = self.ids[max(0, i - 5):i]
+            with self.subTest(before_id=before_id):
+                self.assertEqual(self._ids(before_id=before_id), (expected, i > 5))
+
+    def test_forward_from_the_last_archived_message_reaches_the_hot_table(self):
+        rows, has_more = self._ids(after_id=archive_boundary(self.user))
+        self.assertEqual(rows, self.ids[8:13])
+        self.assertTrue(has_more)
+
+
+# -------------------------
+# Prompt context cache
+# -------------------------
+class ContextCacheTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(phone="9000000002", is_verified=True)
+        self.summary = ConversationSummary.objects.create(user=self.user, summary_text="old", last_message_id=0)
+
+    def _refresh_elsewhere(self, text):
+        """A summary refresh by another process: the DB changes, this process's cache isn't told."""
+        ConversationSummary.objects.filter(pk=self.summary.pk).update(summary_text=text, last_message_id=5)
+
+    def test_summary_refreshed_by_another_process_is_picked_up(self):
+        self.assertEqual(context_cache.get_context(self.user.pk)["summary"], "old")
+        self._refresh_elsewhere("new")
+        with self.settings(CHAT_CONTEXT_SUMMARY_RECHECK_SECONDS=3600):
+            self.assertEqual(context_cache.get_context(self.user.pk)["summary"], "old")
+        with self.settings(CHAT_CONTEXT_SUMMARY_RECHECK_SECONDS=0):
+            self.assertEqual(context_cache.get_context(self.user.pk)["summary"], "new")
+
+    def test_appends_do_not_hide_a_stale_summary(self):
+        context_cache.get_context(self.user.pk)
+        self._refresh_elsewhere("new")
+        context_cache.append_messages(self.user.pk, [(1, "user", "hi")])
+        with self.settings(CHAT_CONTEXT_SUMMARY_RECHECK_SECONDS=0):
+            entry = context_cache.get_context(self.user.pk)
+        self.assertEqual(entry["summary"], "new")
+        self.assertEqual(entry["messages"], [[1, "user", "hi"]])
+
+    def test_concurrent_appends_keep_every_message(self):
+        context_cache.get_context(self.user.pk)
+        rows = [(i, "user", f"m{i}") for i in range(1, 41)]
+        with self.settings(CHAT_CONTEXT_WINDOW=100), ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda row: context_cache.append_messages(self.user.pk, [row]), rows))
+            ids = sorted(message[0] for message in context_cache.get_context(self.user.pk)["messages"])
+        self.assertEqual(ids, [row[0] for row in rows])
+
+    def test_load_racing_an_append_is_not_cached(self):
+        real_load = context_cache._load
+
+        def load_then_append(user_id):
+            entry = real_load(user_id)  # read before the concurrent turn's rows were visible
+            context_cache.append_messages(user_id, [(1, "user", "hi")])
+            return entry
+
+        with mock.patch.object(context_cache, "_load", side_effect=load_then_append):
+            self.assertEqual(context_cache.get_context(self.user.pk)["messages"], [])
+        self.assertIsNone(caches["chat_context"].get(context_cache._key(self.user.pk)))
+
+
+# -------------------------
+# Prompt assembly
+# -------------------------
+class BuildPromptTests(SimpleTestCase):
+    def _history(self, count, length=40):
+        return [(i, "user" if i % 2 == 0 else "bot", f"{i:03d}" + "x" * (length - 3)) for i in range(count)]
+
+    def test_everything_fits_a_large_budget(self):
+        recent = self._history(5)
+        built = build_prompt("hello", summary="The summary.", recalled=self._history(2), recent=recent, budget=2000)
+        self.assertEqual((built.recent_count, built.recalled_count), (5, 2))
+        self.assertTrue(built.text.startswith("The summary.\n\nRelevant earlier messages:"))
+        self.assertTrue(built.text.endswith("User: hello"))
+
+    def test_stays_within_every_budget(self):
+        history = self._history(30)
+        for budget in range(5, 400, 7):
+            with self.subTest(budget=budget):
+                built = build_prompt("what should I eat?", summary="s" * 500, recalled=history[:5],
+                                     recent=history[5:], budget=budget)
+                self.assertLessEqual(estimate_tokens(built.text), budget)
+                self.assertEqual(built.tokens, estimate_tokens(built.text))
+
+    def test_oversized_items_are_truncated(self):
+        built = build_prompt("hi", summary="s" * 4000, recent=[(1, "user", "y" * 4000)], budget=2000,
+                             summary_max_tokens=50, message_max_tokens=20)
+        summary, history = built.text.split("\n\n")
+        self.assertEqual(estimate_tokens(summary), 50)
+        self.assertTrue(summary.endswith(ELLIPSIS))
+        line = history.splitlines()[0]
+        self.assertTrue(line.startswith("User: yyy") and line.endswith(ELLIPSIS))
+        self.assertLessEqual(estimate_tokens(line), 20 + 2)  # capped message plus the "User: " prefix
+
+    def test_oldest_history_is_dropped_first(self):
+        recent = self._history(20)
+        built = build_prompt("hi", recent=recent, budget=60, message_max_tokens=300)
+        self.assertTrue(0 < built.recent_count < len(recent))
+        kept = built.text.splitlines()[:-1]
+        self.assertEqual(kept, [format_message(s, m) for _, s, m in recent[-built.recent_count:]])
+
+    def test_current_message_is_always_kept(self):
+        for budget in (3, 10, 25):
+            with self.subTest(budget=budget):
+                built = build_prompt("a" * 200, summary="summary", recent=self._history(3), budget=budget)
+                self.assertEqual(built.recent_count, 0)
+                self.assertTrue(built.text.startswith("User: a"))
+                self.assertLessEqual(estimate_tokens(built.text), budget)
+        self.assertEqual(build_prompt("hi", recent=self._history(50), budget=2).text, "User: hi")
+
+    def test_output_is_deterministic(self):
+        args = ("plan my week", "summary " * 30, self._history(4), self._history(25))
+        first = build_prompt(*args, budget=150)
+        for _ in range(5):
+            self.assertEqual(build_prompt(*args, budget=150), first)
+
+
+# -------------------------
+# Idempotency
+# -------------------------
+class IdempotencyTests(ChatClientTestCase):
+    def test_retry_with_the_same_key_replays_the_reply(self):
+        first = self.post("suggest a leg workout", key="k1")
+        saved = ChatHistory.objects.filter(user=self.user).count()
+        with mock.patch("app.views.process_user_message") as llm:
+            again = self.post("suggest a leg workout", key="k1")
+        llm.assert_not_called()
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(ChatHistory.objects.filter(user=self.user).count(), saved)
+
+    def test_reused_key_with_a_different_message_is_rejected(self):
+        self.post("suggest a leg workout", key="k2")
+        response = self.post("suggest an arm workout", key="k2")
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("different message", response.json()["error"])
+
+    def test_invalid_key_is_rejected(self):
+        self.assertEqual(self.post("hello there", key="x" * 200).status_code, 400)
+
+    def test_run_once_runs_the_handler_once_per_key(self):
+        key = RequestKey(flight="test:run-once", cache="chat-idempotency:test:run-once", digest="d")
+        handler = mock.Mock(return_value={"reply": "done"})
+        self.assertEqual(idempotency.run_once(key, handler), {"reply": "done"})
+        self.assertEqual(idempotency.run_once(key, handler), {"reply": "done"})
+        handler.assert_called_once()
+        with self.assertRaises(IdempotencyKeyReused):
+            idempotency.replay(key._replace(digest="other"))
+
+    @override_settings(CHAT_IDEMPOTENCY_WAIT_SECONDS=0.05)
+    def test_in_flight_duplicate_times_out(self):
+        key = RequestKey(flight="test:in-flight", cache=None, digest="d")
+        leader, _ = idempotency.begin(key)
+        self.addCleanup(idempotency.fail, key, RuntimeError("test over"))
+        self.assertTrue(leader)
+        joined, future = idempotency.begin(key)
+        self.assertFalse(joined)
+        with self.assertRaises(DuplicateInProgress) as raised:
+            idempotency.wait(key, future)
+        self.assertEqual((raised.exception.status, raised.exception.retry_after), (409, 5))
+
+    @override_settings(CHAT_IDEMPOTENCY_WAIT_SECONDS=0.05)
+    def test_in_flight_duplicate_request_gets_409(self):
+        message = "suggest a back workout"
+        key = idempotency.request_key(mock.Mock(headers={}), {}, self.user, message)
+        leader, _ = idempotency.begin(key)
+        self.addCleanup(idempotency.fail, key, RuntimeError("test over"))
+        self.assertTrue(leader)
+        response = self.post(message)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], "5")
+
+
+# -------------------------
+# Admission control
+# -------------------------
+class ConcurrencyLimiterTests(SimpleTestCase):
+    def test_full_queue_is_rejected_immediately(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=0, timeout=3)
+        limiter.acquire()
+        with self.assertRaises(LLMOverloaded) as raised:
+            limiter.acquire()
+        error = raised.exception
+        self.assertEqual((error.status, error.reason, error.retry_after), (503, "queue_full", 3))
+        with self.assertRaises(LLMOverloaded):
+            limiter.reject_if_saturated()
+
+    def test_queued_call_times_out(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, timeout=0.05)
+        limiter.acquire()
+        with self.assertRaises(LLMOverloaded) as raised:
+            limiter.acquire()
+        error = raised.exception
+        self.assertEqual((error.status, error.reason, error.retry_after), (503, "queue_timeout", 1))
+        self.assertEqual((limiter.active, limiter.queued), (1, 0))
+
+    def test_released_slot_goes_to_the_waiter(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, timeout=5)
+        limiter.acquire()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiting = pool.submit(limiter.acquire)
+            while not limiter.queued:
+                time.sleep(0.001)
+            limiter.release()
+            waiting.result(timeout=5)
+        self.assertEqual((limiter.active, limiter.queued), (1, 0))
+
+    def test_quota_cooldown_fails_fast(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, timeout=5)
+        limiter.cool_down(30)
+        with self.assertRaises(LLMQuotaExceeded) as raised:
+            limiter.acquire()
+        self.assertEqual((raised.exception.status, raised.exception.retry_after), (503, 30))
+
+
+class TokenBucketLimiterTests(SimpleTestCase):
+    def test_burst_then_rate_limited(self):
+        limiter = TokenBucketLimiter(rate=1 / 60, burst=2)
+        limiter.take("a")
+        limiter.take("a")
+        with self.assertRaises(RateLimited) as raised:
+            limiter.take("a")
+        self.assertEqual((raised.exception.status, raised.exception.retry_after), (429, 60))
+        limiter.take("b")  # buckets are per key
+
+    def test_tokens_refill_over_time(self):
+        limiter = TokenBucketLimiter(rate=1 / 60, burst=1)
+        with mock.patch("app.services.admission.time.monotonic", return_value=1000.0):
+            limiter.take("a")
+        with mock.patch("app.services.admission.time.monotonic", return_value=1030.0):
+            with self.assertRaises(RateLimited) as raised:
+                limiter.take("a")
+        self.assertEqual(raised.exception.retry_after, 30)
+        with mock.patch("app.services.admission.time.monotonic", return_value=1060.0):
+            limiter.take("a")
+
+
+@override_settings(CHAT_RATE_LIMIT_PER_MINUTE=20, CHAT_RATE_LIMIT_BURST=1)
+class ChatRateLimitTests(ChatClientTestCase):
+    """Only turns that reach the LLM spend the user's tokens."""
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (("_rate_limiter", None), ("_rate_config", None)):
+            patcher = mock.patch.object(admission, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(reply_cache, "_reply_cache", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertRateLimited(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()["error"], "rate_limited")
+        self.assertEqual(response["Retry-After"], "3")  # one token every 60/20 seconds
+
+    def test_second_llm_turn_is_rate_limited(self):
+        self.assertEqual(self.post("I ran 5 km today, what should I eat?").status_code, 200)
+        self.assertRateLimited(self.post("I lifted 40 kg today, how do I recover?"))
+
+    def test_local_replies_are_not_charged(self):
+        for message in ("hi", "hello", "hi"):
+            self.assertEqual(self.post(message).status_code, 200)
+        self.assertEqual(self.post("I ran 5 km today, what should I eat?").status_code, 200)
+        self.assertRateLimited(self.post("I lifted 40 kg today, how do I recover?"))
+
+    def test_reply_cache_hits_are_not_charged(self):
+        question = "how does sleep affect muscle recovery"
+        self.assertEqual(self.post(question).status_code, 200)
+        with mock.patch.object(model_router, "get_llm") as get_llm:
+            self.assertEqual(self.post(question).status_code, 200)
+        get_llm.assert_not_called()
+        self.assertRateLimited(self.post("I lifted 40 kg today, how do I recover?"))
+
+
+# -------------------------
+# Data retention
+# -------------------------
+class ChatArchivePurgeTests(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(phone="9000000003", is_verified=True)
+        self.other = User.objects.create(phone="9000000004", is_verified=True)
+        for user in (self.user, self.other):
+            ChatHistory.objects.bulk_create([ChatHistory(user=user, sender="user", message=f"m{i}") for i in range(6)])
+        rows = ChatHistory.objects.order_by("id").values_list("id", "user_id")
+        MessageEmbedding.objects.bulk_create(
+            [MessageEmbedding(user_id=user_id, message_id=pk, vector=b"\0" * 4) for pk, user_id in rows]
+        )
+        self.ids = list(ChatHistory.objects.filter(user=self.user).order_by("id").values_list("id", flat=True))
+        ConversationSummary.objects.create(user=self.user, summary_text="s", last_message_id=self.ids[3])
+        archive_user_history(self.user.pk, cutoff=timezone.now() + timedelta(days=1), segment_size=2)
+
+    def test_purging_segments_deletes_their_embeddings(self):
+        policy = POLICIES["chat_archive"]
+        with mock.patch.object(memory_service, "forget") as forget, \
+                mock.patch.object(context_cache, "invalidate") as invalidate:
+            deleted = sum(policy.purge(timezone.now() + timedelta(days=1), batch_size=1))
+        self.assertEqual(deleted, 2)
+        self.assertFalse(ChatArchiveSegment.objects.exists())
+        remaining = set(MessageEmbedding.objects.filter(user=self.user).values_list("message_id", flat=True))
+        self.assertEqual(remaining, set(self.ids[4:]))
+        self.assertEqual(MessageEmbedding.objects.filter(user=self.other).count(), 6)
+        forget.assert_called_with(self.user.pk)
+        invalidate.assert_called_with(self.user.pk)
+
+
+# -------------------------
+# Reply parsing
+# -------------------------
+class ReplyParserTests(SimpleTestCase):
+    SAMPLES = {
+        '{"reply": "Drink water.", "tips": ["a", "b"]}': "Drink water.",
+        '```json\n{"reply": "Fenced reply"}\n```': "Fenced reply",
+        '```\n{"reply": "Bare fence"}\n```  ': "Bare fence",
+        '  {"reply": "Line one\\nLine \\"two\\" \\u00e9 \\ud83d\\udcaa"}': 'Line one\nLine "two" é 💪',
+        '{"meta": {"reply": "nested"}, "note": "reply", "reply": "top level"}': "top level",
+        '{"reply": "Half a sent': "Half a sent",
+        '{"reply": "cut at an escape \\': "cut at an escape",
+        '{"reply": "cut in a code point \\u00': "cut in a code point",
+        '{"answer": "no reply key"}': '{"answer": "no reply key"}',
+        "Bot: Plain text reply.": "Plain text reply.",
+        "```\nFenced text\n```": "Fenced text",
+    }
+
+    @staticmethod
+    def _stream(chunks):
+        extractor = ReplyStreamExtractor()
+        text = "".join(extractor.feed(chunk) for chunk in chunks)
+        return clean_reply_text(text + extractor.finish())
+
+    def test_whole_responses(self):
+        for raw, expected in self.SAMPLES.items():
+            with self.subTest(raw=raw):
+                self.assertEqual(normalize_reply(raw), expected)
+
+    def test_every_split_point_matches_the_whole_string(self):
+        for raw, expected in self.SAMPLES.items():
+            for split in range(1, len(raw)):
+                with self.subTest(raw=raw, split=split):
+                    self.assertEqual(self._stream([raw[:split], raw[split:]]), expected)
+
+    def test_one_character_at_a_time(self):
+        for raw, expected in self.SAMPLES.items():
+            with self.subTest(raw=raw):
+                self.assertEqual(self._stream(list(raw)), expected)
+
+    def test_reply_streams_before_the_object_closes(self):
+        extractor = ReplyStreamExtractor()
+        self.assertEqual(extractor.feed('{"reply": "Hel'), "Hel")
+        self.assertEqual(extractor.feed('lo", "tips": ["'), "lo")
+        self.assertEqual(extractor.feed('x"]}'), "")
+        self.assertEqual(extractor.finish(), "")
+
+    def test_escapes_split_across_chunks(self):
+        self.assertEqual(self._stream(['{"reply": "a\\', 'nb \\u', "00e9 \\ud83d", '\\udcaa"}']), "a\nb é 💪")
+
+    def test_unpaired_surrogate_is_replaced(self):
+        self.assertEqual(normalize_reply('{"reply": "x\\ud83d y"}'), "x� y")
+
+    def test_empty_output(self):
+        self.assertEqual(normalize_reply(""), "")
+        self.assertEqual(normalize_reply(None), "")
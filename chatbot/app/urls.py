@@ -4,5 +4,9 @@ from . import views
 urlpatterns = [
     path("chat/", views.chat_page, name="chat_page"),
     path("chat_api/", views.chat_api, name="chat_api"),  # new API endpoint
+    path("chat_stream_api/", views.chat_stream_api, name="chat_stream_api"),  # SSE streaming variant
+    path("chat_async_api/", views.achat_api, name="chat_async_api"),  # async variants (ASGI)
+    path("chat_async_stream_api/", views.achat_stream_api, name="chat_async_stream_api"),
     path("chat_history_api/", views.chat_history_api, name="chat_history_api"),
+    path("chat_export_api/", views.chat_export_api, name="chat_export_api"),  # staff-only bulk export
 ]
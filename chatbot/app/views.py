@@ -1,102 +1,406 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render
+from django.urls import reverse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 import json as pyjson
+from . import metrics
 from .state_machine import ChatStateMachine
-from .models import User
-from .services.chat_service import get_chat_history, save_chat, update_conversation_summary
-from .services.llm_service import process_user_message, should_send_to_llm
+from .services import admission, idempotency
+from .services.admission import AdmissionError
+from .services.chat_service import ChatTurn, get_chat_history_page
+from .services.export_service import EXPORT_FORMATS, encode_rows, gzip_chunks, iter_chat_rows, parse_export_filters
+from .services.idempotency import IdempotencyKeyError
+from .services.reply_parser import clean_reply_text
+from .services.session_user import set_chat_user
+from .services.llm_service import (
+    process_user_message, should_send_to_llm, stream_user_message,
+    aprocess_user_message, astream_user_message,
+)
+
+logger = logging.getLogger(__name__)
 
 state_machine = ChatStateMachine()
 
 
 def chat_page(request):
     """
-    Render chat template with history (GET only).
-    All conversation is handled via AJAX (chat_api).
+    Render chat template (GET only).
+    History is paged in by the frontend (chat_history_api);
+    all conversation is handled via AJAX (chat_api), or over the chat
+    WebSocket when served by ASGI.
     """
-    history = None
-    phone = request.session.get("phone")
-    if phone:
-        try:
-            user = User.objects.get(phone=phone, is_verified=True)
-            history = get_chat_history(user)
-        except User.DoesNotExist:
-            pass
+    # Under ASGI the async endpoint streams natively without tying up a thread
+    asgi = isinstance(request, ASGIRequest)
+    stream_url = reverse("chat_async_stream_api" if asgi else "chat_stream_api")
+    socket_url = settings.CHAT_WEBSOCKET_PATH if asgi else ""
+
+    return render(request, "chat.html", {"stream_url": stream_url, "socket_url": socket_url})
+
+
+@metrics.timed("state_machine")
+def _handle_control_message(request, user, user_message):
+    """
+    Handle logout and state-machine messages (OTP, registration etc.).
+    Returns (reply, refresh_history), or None if the message should go to the LLM.
+    """
+    # ✅ Logout case
+    if user_message.lower() == "logout":
+        if user:
+            user.is_verified = False
+            user.save(update_fields=["is_verified"])
+        request.session.flush()
+        set_chat_user(request, None)
+        return "✅ You have been logged out.", False
+
+    # ✅ Skip messages (OTP, verification etc.)
+    if not should_send_to_llm(user_message):
+        reply = state_machine.handle_message(request, user_message)
+        return reply, "Verified" in reply
+
+    return None
+
+
+STREAM_ERROR_REPLY = "⚠️ Sorry, something went wrong. Please try again."
+
+
+def _chat_request(request):
+    """Parse the JSON body; returns (data, user_message)."""
+    data = pyjson.loads(request.body)
+    return data, data.get("message", "").strip()
+
 
-    return render(request, "chat.html", {"history": history})
+def _idempotency_error(error):
+    """400 for an invalid client key, 422 for a key reused with a different message."""
+    return JsonResponse({"error": str(error)}, status=error.status)
+
+
+def _idempotency_key(request, data, user, user_message):
+    """(key, error_response): an invalid client key gets a 400 response."""
+    try:
+        return idempotency.request_key(request, data, user, user_message), None
+    except IdempotencyKeyError as e:
+        return None, _idempotency_error(e)
+
+
+def _chat_turn(request, user, user_message):
+    """One non-streaming chat turn; returns the response payload."""
+    turn = ChatTurn(user)
+
+    # ✅ Logout / control-flow messages
+    control = _handle_control_message(request, user, user_message)
+    if control is not None:
+        reply, refresh_history = control
+
+    # ✅ Normal AI conversation
+    else:
+        refresh_history = False
+        # Buffer the user message; it is written together with the bot reply
+        turn.add("user", user_message)
+
+        # Let Gemini handle the response (skip state machine here)
+        reply = process_user_message(user_message, user=user, rate_key=admission.chat_rate_key(request, user))
+
+    # ✅ Save the whole turn (+ summary job) in one transaction
+    turn.add("bot", reply)
+    turn.commit()
+    return {"reply": reply, "refresh_history": refresh_history}
 
 
 @csrf_exempt
 def chat_api(request):
     """
     Handle AJAX chat messages (user + bot exchange).
-    Returns JSON with the bot's reply.
+    Returns JSON with the bot's reply. Retries with the same idempotency key
+    replay the stored reply (422 if the key was used for another message);
+    concurrent duplicates share one turn. Rate-limited or overloaded
+    requests, and duplicates that give up waiting, get 429/503/409 with
+    Retry-After (see AdmissionMiddleware).
     """
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request"}, status=405)
 
-    data = pyjson.loads(request.body)
-    user_message = data.get("message", "").strip()
-    reply = None
-    refresh_history = False
+    data, user_message = _chat_request(request)
+    user = request.chat_user()
+    key, error = _idempotency_key(request, data, user, user_message)
+    if error:
+        return error
 
-    phone = request.session.get("phone")
-    user = None
+    try:
+        payload = idempotency.run_once(key, lambda: _chat_turn(request, user, user_message))
+    except IdempotencyKeyError as e:
+        return _idempotency_error(e)
+    return JsonResponse(payload)
 
-    # ✅ Step 1: Get user object if exists
-    if phone:
-        try:
-            user = User.objects.get(phone=phone)
-        except User.DoesNotExist:
-            user = None
 
-    # ✅ Step 2: Logout case
-    if user_message.lower() == "logout":
-        if user:
-            user.is_verified = False
-            user.save()
-        request.session.flush()
-        reply = "✅ You have been logged out."
+def _done_event(payload):
+    return {"done": True, **payload}
+
+
+def _sse_event(payload):
+    """Encode a payload as one Server-Sent Events `data:` frame."""
+    return f"data: {pyjson.dumps(payload)}\n\n"
 
-    # ✅ Step 3: Skip messages (OTP, verification etc.)
-    elif not should_send_to_llm(user_message):
-        reply = state_machine.handle_message(request, user_message)
-        if "Verified" in reply:
-            refresh_history = True
 
-    # ✅ Step 4: Normal AI conversation
+def _sse_done(payload):
+    return _sse_event(_done_event(payload))
+
+
+def _sse_response(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+    return response
+
+
+@csrf_exempt
+def chat_stream_api(request):
+    """
+    Streaming variant of chat_api.
+    Pushes the bot's reply as SSE `delta` events while Gemini generates it,
+    then a final `done` event with the cleaned reply (same shape as chat_api).
+    Replayed and joined duplicates get just the `done` event.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request"}, status=405)
+
+    data, user_message = _chat_request(request)
+    user = request.chat_user()
+    key, error = _idempotency_key(request, data, user, user_message)
+    if error:
+        return error
+
+    try:
+        replayed = idempotency.replay(key)
+    except IdempotencyKeyError as e:
+        return _idempotency_error(e)
+    if replayed is not None:
+        return _sse_response(iter([_sse_done(replayed)]))
+
+    leader, flight = idempotency.begin(key)
+    if not leader:
+        def joined():
+            try:
+                yield _sse_done(idempotency.wait(key, flight))
+            except AdmissionError as e:
+                yield _sse_done({"reply": str(e), "refresh_history": False, "retry_after": e.retry_after})
+            except Exception:
+                yield _sse_done({"reply": STREAM_ERROR_REPLY, "refresh_history": False})
+        return _sse_response(joined())
+
+    turn = ChatTurn(user)
+    try:
+        control = _handle_control_message(request, user, user_message)
+        if control is not None:
+            reply, refresh_history = control
+            turn.add("bot", reply)
+            turn.commit()
+    except Exception as e:
+        idempotency.fail(key, e)
+        raise
+
+    if control is not None:
+        payload = {"reply": reply, "refresh_history": refresh_history}
+        idempotency.finish(key, payload)
+        return _sse_response(iter([_sse_done(payload)]))
+
+    try:
+        admission.check_llm_capacity()  # still possible to answer with a 503 before the stream starts
+    except AdmissionError as e:
+        idempotency.fail(key, e)
+        raise
+    turn.add("user", user_message)
+    rate_key = admission.chat_rate_key(request, user)
+
+    def events():
+        parts = []
+        finished = False
+        try:
+            try:
+                for chunk in stream_user_message(user_message, user=user, rate_key=rate_key):
+                    parts.append(chunk)
+                    yield _sse_event({"delta": chunk})
+            except AdmissionError as e:
+                yield _sse_done({"reply": str(e), "refresh_history": False, "retry_after": e.retry_after})
+                return
+            except Exception:
+                logger.exception("Chat stream failed")
+                if not parts:
+                    yield _sse_done({"reply": STREAM_ERROR_REPLY, "refresh_history": False})
+                    return
+
+            # Persist the turn once the stream finishes
+            reply = clean_reply_text("".join(parts))
+            turn.add("bot", reply)
+            turn.commit()
+            payload = {"reply": reply, "refresh_history": False}
+            idempotency.finish(key, payload)
+            finished = True
+            yield _sse_done(payload)
+        finally:
+            # Failed or abandoned turns save nothing: an orphan user message would feed later prompts
+            if not finished:
+                idempotency.fail(key, RuntimeError("Stream did not complete"))
+
+    return _sse_response(events())
+
+
+async def _achat_turn(request, user, user_message):
+    """Async version of _chat_turn"""
+    turn = ChatTurn(user)
+
+    # State machine is synchronous; these messages never wait on the LLM
+    control = await sync_to_async(_handle_control_message)(request, user, user_message)
+    if control is not None:
+        reply, refresh_history = control
     else:
-        # Save user message first
-        if user:
-            save_chat(user, "user", user_message)
+        refresh_history = False
+        turn.add("user", user_message)
+
+        reply = await aprocess_user_message(
+            user_message, user=user, rate_key=admission.chat_rate_key(request, user),
+        )
+
+    turn.add("bot", reply)
+    await turn.acommit()
+    return {"reply": reply, "refresh_history": refresh_history}
 
-        # Let Gemini handle the response (skip state machine here)
-        llm_raw = process_user_message(user_message, user=user)
 
-        # Clean markdown fences if present
-        if llm_raw.startswith("```"):
-            llm_raw = llm_raw.strip("`").replace("json", "").strip()
+@csrf_exempt
+async def achat_api(request):
+    """
+    Async version of chat_api for the ASGI entry point.
+    The Gemini call and ORM access are awaited, so no worker thread is held
+    while waiting on the LLM.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request"}, status=405)
 
-        # Try JSON parse → fallback to text
+    data, user_message = _chat_request(request)
+    user = await request.achat_user()
+    key, error = _idempotency_key(request, data, user, user_message)
+    if error:
+        return error
+
+    try:
+        payload = await idempotency.arun_once(key, lambda: _achat_turn(request, user, user_message))
+    except IdempotencyKeyError as e:
+        return _idempotency_error(e)
+    return JsonResponse(payload)
+
+
+async def _aevents(*events):
+    for event in events:
+        yield event
+
+
+async def _asse_frames(events):
+    async for event in events:
+        yield _sse_event(event)
+
+
+async def astream_chat_turn(request, user, user_message, key):
+    """
+    Start one streamed chat turn. Returns an async iterator of event payloads:
+    {"delta": ...} chunks, then one {"done": True, "reply": ..., ...}.
+    Shared by achat_stream_api (as SSE frames) and the chat WebSocket.
+    Raises AdmissionError, before anything is streamed, if the LLM is saturated,
+    and IdempotencyKeyReused if the key was used for a different message.
+    """
+    replayed = await sync_to_async(idempotency.replay)(key)
+    if replayed is not None:
+        return _aevents(_done_event(replayed))
+
+    leader, flight = idempotency.begin(key)
+    if not leader:
+        async def joined():
+            try:
+                yield _done_event(await idempotency.await_result(key, flight))
+            except AdmissionError as e:
+                yield _done_event({"reply": str(e), "refresh_history": False, "retry_after": e.retry_after})
+            except Exception:
+                yield _done_event({"reply": STREAM_ERROR_REPLY, "refresh_history": False})
+        return joined()
+
+    turn = ChatTurn(user)
+    try:
+        control = await sync_to_async(_handle_control_message)(request, user, user_message)
+        if control is not None:
+            reply, refresh_history = control
+            turn.add("bot", reply)
+            await turn.acommit()
+    except Exception as e:
+        idempotency.fail(key, e)
+        raise
+
+    if control is not None:
+        payload = {"reply": reply, "refresh_history": refresh_history}
+        await sync_to_async(idempotency.finish)(key, payload)
+        return _aevents(_done_event(payload))
+
+    try:
+        admission.check_llm_capacity()
+    except AdmissionError as e:
+        idempotency.fail(key, e)
+        raise
+    turn.add("user", user_message)
+    rate_key = admission.chat_rate_key(request, user)
+
+    async def events():
+        parts = []
+        finished = False
         try:
-            parsed = pyjson.loads(llm_raw)
-            reply = parsed.get("reply", llm_raw)
-        except Exception:
-            reply = llm_raw
+            try:
+                async for chunk in astream_user_message(user_message, user=user, rate_key=rate_key):
+                    parts.append(chunk)
+                    yield {"delta": chunk}
+            except AdmissionError as e:
+                yield _done_event({"reply": str(e), "refresh_history": False, "retry_after": e.retry_after})
+                return
+            except Exception:
+                logger.exception("Chat stream failed")
+                if not parts:
+                    yield _done_event({"reply": STREAM_ERROR_REPLY, "refresh_history": False})
+                    return
+
+            reply = clean_reply_text("".join(parts))
+            turn.add("bot", reply)
+            await turn.acommit()
+            payload = {"reply": reply, "refresh_history": False}
+            await sync_to_async(idempotency.finish)(key, payload)
+            finished = True
+            yield _done_event(payload)
+        finally:
+            if not finished:
+                idempotency.fail(key, RuntimeError("Stream did not complete"))
+
+    return events()
 
-        # 🧹 Clean reply — remove redundant "Bot:" prefixes or context
-        import re
-        clean_reply = re.sub(r"^(🤖\s*)?(Bot:|FitnessBot:)\s*", "", reply.strip(), flags=re.IGNORECASE)
 
-        reply = clean_reply
+@csrf_exempt
+async def achat_stream_api(request):
+    """
+    Async version of chat_stream_api (uses astream).
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request"}, status=405)
 
-    # ✅ Step 5: Save bot reply and update memory summary
-    if user and reply:
-        save_chat(user, "bot", reply)
-        update_conversation_summary(user, limit=200)
+    data, user_message = _chat_request(request)
+    user = await request.achat_user()
+    key, error = _idempotency_key(request, data, user, user_message)
+    if error:
+        return error
 
-    return JsonResponse({"reply": reply, "refresh_history": refresh_history})
+    try:
+        events = await astream_chat_turn(request, user, user_message, key)
+    except IdempotencyKeyError as e:
+        return _idempotency_error(e)
+    return _sse_response(_asse_frames(events))
 
 
 # @csrf_exempt
@@ -232,22 +536,57 @@ def chat_api(request):
 #     return JsonResponse({"reply": reply, "refresh_history": refresh_history})
 
 
+def _cursor_param(request, name):
+    value = request.GET.get(name)
+    return int(value) if value else None
+
+
 @csrf_exempt
 def chat_history_api(request):
     """
-    Return chat history for the logged-in/verified user.
+    Return one page of chat history for the logged-in/verified user.
+    Query params: before_id / after_id (keyset cursors) and limit.
     """
-    phone = request.session.get("phone")
-    if phone:
-        try:
-            user = User.objects.get(phone=phone, is_verified=True)
-            history = get_chat_history(user)
-            return JsonResponse({
-                "history": [
-                    {"sender": chat.sender, "message": chat.message}
-                    for chat in history
-                ]
-            })
-        except User.DoesNotExist:
-            pass
-    return JsonResponse({"history": []})
+    try:
+        before_id = _cursor_param(request, "before_id")
+        after_id = _cursor_param(request, "after_id")
+        limit = _cursor_param(request, "limit") or settings.CHAT_HISTORY_PAGE_SIZE
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+    limit = max(1, min(limit, settings.CHAT_HISTORY_MAX_PAGE_SIZE))
+
+    user = request.chat_user()
+    if user is not None and user.is_verified:
+        history, has_more = get_chat_history_page(user, before_id=before_id, after_id=after_id, limit=limit)
+        return JsonResponse({"history": history, "has_more": has_more})
+    return JsonResponse({"history": [], "has_more": False})
+
+
+@staff_member_required
+def chat_export_api(request):
+    """
+    Staff-only streaming export of ChatHistory as a gzip-compressed file.
+    Query params: format (ndjson|csv), user (comma-separated ids), since,
+    until (ISO date/datetime) and sender (user|bot).
+    """
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+    try:
+        filters = parse_export_filters(
+            request.GET.get("user"), request.GET.get("since"), request.GET.get("until"), request.GET.get("sender"),
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    rows = iter_chat_rows(filters, settings.CHAT_EXPORT_BATCH_SIZE)
+    response = StreamingHttpResponse(gzip_chunks(encode_rows(rows, fmt)), content_type="application/gzip")
+    response["Content-Disposition"] = f'attachment; filename="chat_history.{fmt}.gz"'
+    return response
+
+
+def metrics_view(request):
+    """In-process metrics in the Prometheus text format."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,181 @@
+"""
+Chat over a WebSocket (CHAT_WEBSOCKET_PATH, served by chatbot.asgi).
+
+One connection per chat tab. The session and chat user are resolved once,
+when the socket opens; every message then runs the same turn as
+achat_stream_api (state machine, admission control, idempotency, LLM
+streaming) and its events are pushed back on the socket. After a turn that
+verifies the user the latest history page is pushed too, so the page does
+not poll chat_history_api.
+
+Frames are JSON text:
+  client  {"id": ..., "message": "...", "idempotency_key": "..."}
+  server  {"id": ..., "delta": "..."} chunks, then
+          {"id": ..., "done": true, "reply": "...", "refresh_history": bool}
+          {"history": [...], "has_more": bool}   after a verifying turn
+          {"id": ..., "error": "..."}             for a bad frame or idempotency key
+
+Only an existing session is served. Without one (first visit, or after
+logout, which replaces the session cookie) the handshake is refused and
+the page falls back to the HTTP endpoint, whose response sets the cookie.
+"""
+import io
+import json as pyjson
+import time
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+from . import metrics
+from .services import idempotency, session_user
+from .services.admission import AdmissionError
+from .services.chat_service import get_chat_history_page
+from .services.idempotency import IdempotencyKeyError
+from .views import astream_chat_turn
+
+CLOSE_NO_SESSION = 4401       # handshake refused: no session / foreign origin
+CLOSE_SESSION_ENDED = 4001    # logged out, or the session was replaced or deleted
+
+
+async def _send_json(send, payload):
+    await send({"type": "websocket.send", "text": pyjson.dumps(payload)})
+
+
+def _origin_allowed(request) -> bool:
+    """Same-origin (or CSRF_TRUSTED_ORIGINS) only: browsers send cookies on cross-site sockets too."""
+    origin = request.headers.get("Origin")
+    if origin is None:
+        return True  # not a browser
+    if origin in getattr(settings, "CSRF_TRUSTED_ORIGINS", []):
+        return True
+    try:
+        return urlsplit(origin).netloc == request.get_host()
+    except DisallowedHost:
+        return False
+
+
+async def _open(scope):
+    """(request, outcome): a request-like object carrying the session and chat user, or None."""
+    request = ASGIRequest({**scope, "method": "GET"}, io.BytesIO())
+    if not _origin_allowed(request):
+        return None, "bad_origin"
+
+    engine = import_module(settings.SESSION_ENGINE)
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not session_key or not await engine.SessionStore().aexists(session_key):
+        return None, "no_session"
+
+    request.session = engine.SessionStore(session_key)
+    request.session_cookie_key = session_key
+    session_user.attach(request)
+    await request.achat_user()  # resolved once for the whole connection
+    return request, "accepted"
+
+
+async def _save_session(request) -> bool:
+    """Persist session changes made by the turn; False once the browser's session cookie is stale."""
+    session = request.session
+    if session.session_key != request.session_cookie_key:
+        return False  # flushed (logout): the new key never reaches the browser over a socket
+    if session.modified:
+        try:
+            await session.asave()
+        except UpdateError:
+            return False  # deleted meanwhile, e.g. logged out in another tab
+        session.modified = False
+    return True
+
+
+async def _push_history(request, send):
+    user = await request.achat_user()
+    if user is None or not user.is_verified:
+        return
+    history, has_more = await sync_to_async(get_chat_history_page)(user, limit=settings.CHAT_HISTORY_PAGE_SIZE)
+    await _send_json(send, {"history": history, "has_more": has_more})
+
+
+async def _handle_message(request, text, send) -> bool:
+    """Run one chat turn for a client frame. Returns False once the session has ended."""
+    try:
+        data = pyjson.loads(text)
+        message_id, user_message = data.get("id"), str(data.get("message", "")).strip()
+    except (ValueError, AttributeError):
+        await _send_json(send, {"error": "Invalid message"})
+        return True
+
+    user = await request.achat_user()
+    try:
+        key = idempotency.request_key(request, data, user, user_message)
+        events = await astream_chat_turn(request, user, user_message, key)
+    except AdmissionError as e:
+        await _send_json(send, {
+            "id": message_id, "done": True, "reply": str(e), "refresh_history": False, "retry_after": e.retry_after,
+        })
+        return True
+    except IdempotencyKeyError as e:
+        await _send_json(send, {"id": message_id, "error": str(e)})
+        return True
+
+    done = {}
+    async for event in events:
+        await _send_json(send, {"id": message_id, **event})
+        if event.get("done"):
+            done = event
+
+    if not await _save_session(request):
+        return False
+    if done.get("refresh_history"):
+        await _push_history(request, send)
+    return True
+
+
+async def chat_socket(scope, receive, send):
+    """ASGI application for one chat WebSocket connection."""
+    if (await receive())["type"] != "websocket.connect":
+        return
+    request, outcome = await _open(scope)
+    metrics.ws_connections.inc(outcome=outcome)
+    if request is None:
+        await send({"type": "websocket.close", "code": CLOSE_NO_SESSION})
+        return
+    await send({"type": "websocket.accept"})
+
+    try:
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                return
+            if event["type"] != "websocket.receive":
+                continue
+
+            text = event.get("text") or (event.get("bytes") or b"").decode()
+            started, queries = time.perf_counter(), metrics.start_query_count()
+            try:
+                keep_open = await _handle_message(request, text, send)
+            finally:
+                metrics.ws_message_duration.observe(time.perf_counter() - started)
+                metrics.ws_queries.observe(queries[0])
+                await sync_to_async(close_old_connections)()  # as at the end of a request
+            if not keep_open:
+                await send({"type": "websocket.close", "code": CLOSE_SESSION_ENDED})
+                return
+    finally:
+        await sync_to_async(close_old_connections)()
+
+
+def with_chat_socket(django_application):
+    """Wrap the Django ASGI app: CHAT_WEBSOCKET_PATH goes to chat_socket, other sockets are refused."""
+    async def application(scope, receive, send):
+        if scope["type"] != "websocket":
+            return await django_application(scope, receive, send)
+        if scope["path"] == settings.CHAT_WEBSOCKET_PATH:
+            return await chat_socket(scope, receive, send)
+        await receive()
+        await send({"type": "websocket.close"})
+    return application
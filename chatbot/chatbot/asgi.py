@@ -2,6 +2,8 @@
 ASGI config for chatbot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; the chat WebSocket (CHAT_WEBSOCKET_PATH) is handled by
+app.websocket.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbot.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up: the WebSocket handler uses the ORM and app services
+from app.websocket import with_chat_socket  # noqa: E402
+
+application = with_chat_socket(django_application)
@@ -41,13 +41,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'app.middleware.ChatUserMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.AdmissionMiddleware',
 ]
 
 ROOT_URLCONF = 'chatbot.urls'
@@ -77,7 +80,37 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,        # persistent connections (PRAGMAs are applied once per connection)
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,                     # seconds to wait for the write lock
+            'transaction_mode': 'IMMEDIATE',   # take the write lock at BEGIN, so busy_timeout applies
+        },
+    },
+}
+# Read-only connection to the same file for history/summary reads (app.db.ReadReplicaRouter)
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+    'OPTIONS': {'timeout': 20},
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['app.db.ReadReplicaRouter']
+DATABASE_READ_REPLICA_MODELS = [
+    'app.ChatHistory',
+    'app.ConversationSummary',
+    'app.ChatArchiveSegment',
+    'app.MessageEmbedding',
+]
+
+# Applied on every new SQLite connection (app.db.configure_sqlite)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',      # readers don't block the writer (persists in the file)
+    'synchronous': 'NORMAL',    # fsync at checkpoints only; durable enough with WAL
+    'busy_timeout': 20000,      # ms
+    'cache_size': -20000,       # KiB (~20 MB page cache per connection)
+    'temp_store': 'MEMORY',
+    'mmap_size': 134217728,     # 128 MB
 }
 
 
@@ -128,3 +161,174 @@ LOGIN_REDIRECT_URL = "/app/chat/"
 LOGOUT_REDIRECT_URL = "/app/auth/"
 
 AUTH_USER_MODEL = "app.User"
+
+# Background conversation summaries (app.services.summary_worker)
+SUMMARY_DEBOUNCE_SECONDS = 15     # quiet period before a queued refresh runs
+SUMMARY_MAX_DELAY_SECONDS = 120   # upper bound on debounce for busy conversations
+SUMMARY_WORKER_THREADS = 2
+SUMMARY_WORKER_POLL_SECONDS = 2
+SUMMARY_WORKER_AUTOSTART = True   # start the in-process worker on first enqueue
+SUMMARY_JOB_MAX_ATTEMPTS = 3
+SUMMARY_JOB_STALE_SECONDS = 300   # running jobs older than this are requeued
+SUMMARY_EVERY_N_MESSAGES = 6      # refresh once this many messages pass the watermark...
+SUMMARY_EVERY_N_TOKENS = 800      # ...or this many estimated tokens, whichever comes first
+SUMMARY_MAX_BATCH_MESSAGES = 50   # messages folded into the summary per refresh
+
+# Chat history pagination (chat_history_api)
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+# Bulk export (manage.py export_chat_history, staff-only chat_export_api)
+CHAT_EXPORT_BATCH_SIZE = 2000  # rows per keyset page / cursor chunk
+
+# Chat WebSocket (served by chatbot.asgi only; see app/websocket.py)
+CHAT_WEBSOCKET_PATH = '/ws/chat/'
+
+# Cold chat history archive (manage.py archive_chat_history)
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_SEGMENT_SIZE = 500
+
+# Caches
+# LocMemCache is per-process with LRU culling; point these at a shared
+# backend (Redis/Memcached) when running several worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'chat_context': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chat-context',
+        'TIMEOUT': 30 * 60,  # idle conversations drop out after 30 minutes
+        'OPTIONS': {'MAX_ENTRIES': 5000, 'CULL_FREQUENCY': 10},
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',  # cached_db gives each entry the session's own expiry
+        'OPTIONS': {'MAX_ENTRIES': 20000, 'CULL_FREQUENCY': 10},
+    },
+    'otp': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'otp_cache',  # run `manage.py createcachetable` after migrate to create the table
+        'OPTIONS': {'MAX_ENTRIES': 100000},  # culling would drop live codes
+    },
+}
+
+# Sessions: written through to the DB, read from their own cache, so a chat
+# message (which doesn't change the session) costs no session queries.
+# A cache miss (eviction, another process) falls back to the DB row.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_SAVE_EVERY_REQUEST = False
+
+# OTPs (app.services.otp_service): live codes in the cache, DB rows are an audit log
+OTP_CACHE_ALIAS = 'otp'             # must be shared by all worker processes (not LocMem)
+OTP_TTL_SECONDS = 5 * 60
+OTP_MAX_ATTEMPTS = 5                # wrong guesses before the code is discarded
+OTP_AUDIT_RETENTION_DAYS = 30       # manage.py purge_otps
+OTP_PURGE_BATCH_SIZE = 1000
+
+# Data retention (manage.py purge_data): days to keep each kind of data; None keeps it forever
+DATA_RETENTION = {
+    'chat_history': None,                    # hot ChatHistory rows (and their embeddings)
+    'chat_archive': None,                    # compressed archive segments
+    'otp': OTP_AUDIT_RETENTION_DAYS,
+    'sessions': 0,                           # days past expiry
+    'summary_jobs': 30,                      # failed jobs
+}
+DATA_RETENTION_BATCH_SIZE = 500
+DATA_RETENTION_BATCH_SLEEP = 0.05           # seconds between batches, so chat writes get the DB lock
+
+# Prompt context cache (app.services.context_cache)
+CHAT_CONTEXT_CACHE_ALIAS = 'chat_context'
+CHAT_CONTEXT_WINDOW = 20  # recent messages kept per user
+CHAT_CONTEXT_SUMMARY_RECHECK_SECONDS = 30  # re-read summaries refreshed by other processes (run_summary_worker)
+
+# Prompt token budget (app.services.context_builder); estimated, ~4 chars per token
+CHAT_PROMPT_TOKEN_BUDGET = 2000
+CHAT_PROMPT_SUMMARY_MAX_TOKENS = 400
+CHAT_PROMPT_MESSAGE_MAX_TOKENS = 300  # a single pasted meal plan can't crowd out the rest
+
+# Local text embeddings (app.services.embedding_service)
+EMBEDDING_DIM = 512
+
+# Semantic reply cache for general questions (app.services.reply_cache)
+REPLY_CACHE_ENABLED = True
+REPLY_CACHE_THRESHOLD = 0.85        # cosine similarity needed for a hit (content words must match too)
+REPLY_CACHE_MAX_ENTRIES = 2000      # LRU-evicted beyond this
+REPLY_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Long-term memory recall (app.services.memory_service)
+# Changing EMBEDDING_DIM requires re-running `manage.py build_message_embeddings --rebuild`.
+MEMORY_TOP_K = 3                    # older messages recalled per prompt
+MEMORY_MIN_SCORE = 0.2              # cosine similarity needed to recall a message
+MEMORY_MIN_WORDS = 3                # shorter messages are not embedded
+MEMORY_SNIPPET_CHARS = 300          # recalled messages are truncated to this
+MEMORY_INDEX_MAX_USERS = 500        # per-user vector matrices kept in memory (LRU)
+MEMORY_INDEX_REFRESH_SECONDS = 30   # pick up vectors written by other processes
+
+# LLM backend (app.services.llm_backends): 'gemini', or 'fake' for load tests
+LLM_BACKEND = 'gemini'
+LLM_FAKE_BACKEND = {
+    'latency_ms': 800,       # median latency
+    'latency_sigma': 0.5,    # log-normal spread
+    'chunk_count': 8,
+    'chunk_delay_ms': 30,
+    'malformed_rate': 0.05,  # share of replies that are not valid JSON
+    'seed': 42,
+}
+# LLM_BACKEND = 'recorded': replies from a replay_chats --output file (fake-backend options apply too)
+LLM_RECORDED_BACKEND = {
+    'path': None,
+}
+
+# Tiered model routing (app.services.model_router)
+LLM_MODEL_TIERS = {
+    'fast': {'model': 'gemini-2.5-flash', 'temperature': 0},
+    'heavy': {'model': 'gemini-2.5-pro', 'temperature': 0},
+}
+LLM_FAST_TIER = 'fast'              # small talk, short questions
+LLM_HEAVY_TIER = 'heavy'            # plans/programs, long messages, large prompts
+LLM_SUMMARY_TIER = 'fast'
+LLM_FORCE_TIER = None               # set to a tier name to bypass the classifier
+LLM_HEAVY_MIN_WORDS = 40
+LLM_HEAVY_MIN_PROMPT_TOKENS = 1200
+
+# Prometheus-text metrics at /metrics (app.metrics)
+METRICS_ENABLED = True
+
+# Local intent router (app.services.intent_router): answered without an LLM call
+CHAT_INTENT_ROUTER_ENABLED = True
+CHAT_INTENT_REPLIES = {}            # override replies for greeting / thanks / ack / goodbye
+CHAT_FAQ_THRESHOLD = 0.75           # similarity needed for an FAQ hit (the example must also cover the message's words)
+CHAT_FAQ = [
+    {
+        'name': 'capabilities',
+        'questions': ['what can you do', 'what can you help me with', 'how can you help me', 'what are your features'],
+        'answer': "I'm FitnessBot 💪 I can suggest workouts, build training plans, answer nutrition questions "
+                  "and help with recovery. Tell me your goal and I'll take it from there!",
+    },
+    {
+        'name': 'identity',
+        'questions': ['who are you', 'what are you', 'are you a bot', 'are you a real person'],
+        'answer': "I'm FitnessBot, an AI fitness assistant. I'm not a doctor, so check with a professional "
+                  "for injuries or medical conditions.",
+    },
+    {
+        'name': 'logout',
+        'questions': ['how do i log out', 'how do i sign out', 'how can i logout'],
+        'answer': 'Just type "logout" and I\'ll sign you out.',
+    },
+]
+
+# Chat idempotency keys and in-flight deduplication (app.services.idempotency)
+CHAT_IDEMPOTENCY_CACHE_ALIAS = 'default'
+CHAT_IDEMPOTENCY_TTL = 24 * 60 * 60     # completed replies replayable for this long
+CHAT_IDEMPOTENCY_WAIT_SECONDS = 120     # how long a duplicate waits for the original
+
+# Admission control (app.services.admission); limits are per process
+LLM_MAX_CONCURRENCY = 8             # LLM calls in flight at once
+LLM_MAX_QUEUE = 32                  # calls allowed to wait for a slot; more get a 503
+LLM_QUEUE_TIMEOUT_SECONDS = 10      # longest wait for a slot before a 503
+LLM_QUOTA_COOLDOWN_SECONDS = 30     # after a provider quota error, fail fast for this long
+CHAT_RATE_LIMIT_PER_MINUTE = 20     # LLM turns per user (or session); 0 disables
+CHAT_RATE_LIMIT_BURST = 5